@@ -0,0 +1,67 @@
+"""
+環境変数 CACHE_URL からキャッシュ設定を組み立てる（dj_database_url のキャッシュ版）
+
+対応しているURLの例:
+    locmem://                       プロセスごとのメモリ（デフォルト）
+    locmem://timetable              名前付きのメモリ領域
+    file:///var/tmp/django_cache    ファイルベース（同じサーバーのプロセス間で共有）
+    redis://127.0.0.1:6379/0        Redisプロトコルのサーバー（rediss:// も可）
+    dummy://                        キャッシュしない
+
+クエリ文字列で timeout / key_prefix / max_entries / cull_frequency を指定できる。
+    例: redis://cache:6379/1?timeout=600&key_prefix=timetable
+"""
+
+import os
+from urllib.parse import urlparse, parse_qs
+
+DEFAULT_ENV = 'CACHE_URL'
+
+BACKENDS = {
+    'locmem': 'django.core.cache.backends.locmem.LocMemCache',
+    'file': 'django.core.cache.backends.filebased.FileBasedCache',
+    'redis': 'django.core.cache.backends.redis.RedisCache',
+    'rediss': 'django.core.cache.backends.redis.RedisCache',
+    'dummy': 'django.core.cache.backends.dummy.DummyCache',
+}
+
+INT_OPTIONS = ('max_entries', 'cull_frequency')
+
+# プロセスの間で内容を共有しないバックエンド（複数のワーカーで動かすと、ワーカーごとに別の内容になる）
+PROCESS_LOCAL_BACKENDS = {BACKENDS['locmem'], BACKENDS['dummy']}
+
+
+def parse(url):
+    """キャッシュURLを Django の CACHES 用の辞書に変換する"""
+    parsed = urlparse(url)
+    if parsed.scheme not in BACKENDS:
+        raise ValueError(f'Unsupported cache URL scheme: {parsed.scheme!r}')
+
+    config = {'BACKEND': BACKENDS[parsed.scheme]}
+    if parsed.scheme == 'locmem':
+        config['LOCATION'] = parsed.netloc or parsed.path.lstrip('/')
+    elif parsed.scheme == 'file':
+        config['LOCATION'] = parsed.path
+    elif parsed.scheme in ('redis', 'rediss'):
+        config['LOCATION'] = parsed._replace(query='').geturl()
+
+    query = {key: values[-1] for key, values in parse_qs(parsed.query).items()}
+    if 'timeout' in query:
+        timeout = query.pop('timeout')
+        config['TIMEOUT'] = None if timeout == 'none' else int(timeout)
+    if 'key_prefix' in query:
+        config['KEY_PREFIX'] = query.pop('key_prefix')
+    options = {key.upper(): int(query.pop(key)) for key in INT_OPTIONS if key in query}
+    if options:
+        config['OPTIONS'] = options
+    return config
+
+
+def is_shared(config):
+    """キャッシュ設定が、複数のプロセスから同じ内容を読み書きできるものかを返す"""
+    return config['BACKEND'] not in PROCESS_LOCAL_BACKENDS
+
+
+def config(env=DEFAULT_ENV, default='locmem://'):
+    """環境変数（なければ default）からキャッシュ設定を返す"""
+    return parse(os.environ.get(env) or default)
@@ -0,0 +1,112 @@
+"""
+データベース設定の組み立て（dj_database_url の結果に、エンジンごとの接続設定を加える）
+
+PostgreSQL:
+    psycopg 3 の接続プール (OPTIONS['pool']) を使う。プールを使うときは CONN_MAX_AGE を 0 にする
+    （Django の持続接続とプールは併用できない）。プールの大きさは環境変数で指定する。
+        DB_POOL=0               プールを使わず、CONN_MAX_AGE + CONN_HEALTH_CHECKS の持続接続にする
+        DB_POOL_MIN_SIZE=2      常に開いておく接続数
+        DB_POOL_MAX_SIZE=10     接続数の上限（gunicorn のワーカーごと）
+        DB_POOL_TIMEOUT=10      接続が空くのを待つ秒数
+        DB_CONN_MAX_AGE=600     プールを使わないときの持続接続の秒数
+
+SQLite:
+    接続ごとに PRAGMA を実行し、同時に書き込んだときに "database is locked" にならないようにする。
+        journal_mode=WAL        読み込みと書き込みが互いを待たない
+        synchronous=NORMAL      WAL ではコミットごとの fsync を省いても壊れない
+        mmap_size               DB_SQLITE_MMAP_SIZE（バイト、デフォルト 128MB）
+        busy_timeout            DB_SQLITE_BUSY_TIMEOUT（ミリ秒、デフォルト 5000）
+    トランザクションは IMMEDIATE で始め、読み込みから書き込みへの昇格時のロック競合を避ける。
+"""
+
+import os
+
+import dj_database_url
+
+DEFAULT_ENV = 'DATABASE_URL'
+
+POOL_DEFAULTS = {'min_size': 2, 'max_size': 10, 'timeout': 10}
+
+SQLITE_MMAP_SIZE = 128 * 1024 * 1024
+SQLITE_BUSY_TIMEOUT = 5000
+
+
+def _env_int(name, default):
+    return int(os.environ.get(name, default))
+
+
+def postgres_options(config):
+    """PostgreSQL の接続プール（または持続接続）の設定を加える"""
+    options = config.setdefault('OPTIONS', {})
+    if os.environ.get('DB_POOL', '1') == '1':
+        options['pool'] = {
+            key: _env_int(f'DB_POOL_{key.upper()}', default) for key, default in POOL_DEFAULTS.items()
+        }
+        config['CONN_MAX_AGE'] = 0
+        config['CONN_HEALTH_CHECKS'] = False
+    else:
+        config['CONN_MAX_AGE'] = _env_int('DB_CONN_MAX_AGE', 600)
+        config['CONN_HEALTH_CHECKS'] = True
+    return config
+
+
+def sqlite_pragmas():
+    """SQLite の接続ごとに実行する PRAGMA"""
+    return [
+        'PRAGMA journal_mode=WAL',
+        'PRAGMA synchronous=NORMAL',
+        f"PRAGMA mmap_size={_env_int('DB_SQLITE_MMAP_SIZE', SQLITE_MMAP_SIZE)}",
+        f"PRAGMA busy_timeout={_env_int('DB_SQLITE_BUSY_TIMEOUT', SQLITE_BUSY_TIMEOUT)}",
+    ]
+
+
+def sqlite_options(config):
+    """SQLite の PRAGMA とトランザクションの開始方法を設定する"""
+    options = config.setdefault('OPTIONS', {})
+    options['init_command'] = ';'.join(sqlite_pragmas())
+    options['transaction_mode'] = 'IMMEDIATE'
+    # sqlite3 モジュール自身の待ち時間（秒）も busy_timeout に合わせる
+    options['timeout'] = _env_int('DB_SQLITE_BUSY_TIMEOUT', SQLITE_BUSY_TIMEOUT) / 1000
+    return config
+
+
+def tune(config):
+    """エンジンに合わせて接続設定を加える"""
+    engine = config.get('ENGINE', '')
+    if engine.endswith('postgresql'):
+        return postgres_options(config)
+    if engine.endswith('sqlite3'):
+        return sqlite_options(config)
+    return config
+
+
+def config(default, env=DEFAULT_ENV):
+    """環境変数（なければ default）のURLからデータベース設定を返す"""
+    return tune(dj_database_url.parse(os.environ.get(env) or default))
+
+
+# --- 接続の状態（監視用） ---
+
+def pool_metrics(connections):
+    """データベースごとの接続プール・接続設定の状態を辞書で返す"""
+    metrics = {}
+    for alias in connections:
+        connection = connections[alias]
+        entry = {'vendor': connection.vendor}
+        if connection.vendor == 'postgresql':
+            pool = connection.pool
+            entry['pooled'] = pool is not None
+            if pool is not None:
+                # 取得件数・待ち時間などの累計と、現在の pool_size / pool_available
+                entry.update(pool.get_stats())
+            else:
+                entry['conn_max_age'] = connection.settings_dict['CONN_MAX_AGE']
+        elif connection.vendor == 'sqlite':
+            entry['pooled'] = False
+            with connection.cursor() as cursor:
+                for pragma in ('journal_mode', 'synchronous', 'busy_timeout', 'mmap_size'):
+                    # メモリ上のDBでは mmap_size のように値を返さない PRAGMA もある
+                    row = cursor.execute(f'PRAGMA {pragma}').fetchone()
+                    entry[pragma] = row[0] if row else None
+        metrics[alias] = entry
+    return metrics
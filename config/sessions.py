@@ -0,0 +1,103 @@
+"""
+セッションの保存先の設定と、セッションの行の監視・掃除
+
+環境変数 SESSION_BACKEND で保存先を選ぶ:
+    db               DBだけに保存する（デフォルト）
+    cached_db        DBに保存し、キャッシュからも読む（リクエストごとの SELECT を省く）
+    cache            キャッシュだけに保存する（Redis など、消えないキャッシュを使う場合のみ）
+    signed_cookies   署名付きのCookieに保存する（サーバー側に行が増えない。データは4KB程度まで）
+
+cached_db と cache は、共有のキャッシュ (CACHE_URL=redis:// など) を設定した場合だけ使える。
+プロセスごとのメモリキャッシュでは、ログアウトしても他のワーカーに古いセッションが残り、
+ログインしたままになってしまうため。
+
+DBに保存する場合、期限切れの行は自動では消えないので、manage.py prune_sessions を定期的に実行する。
+"""
+
+import os
+
+DEFAULT_ENV = 'SESSION_BACKEND'
+
+ENGINES = {
+    'cached_db': 'django.contrib.sessions.backends.cached_db',
+    'db': 'django.contrib.sessions.backends.db',
+    'cache': 'django.contrib.sessions.backends.cache',
+    'signed_cookies': 'django.contrib.sessions.backends.signed_cookies',
+}
+
+# キャッシュに保存する（読む）保存先。共有のキャッシュが必要
+CACHE_ENGINES = ('cached_db', 'cache')
+
+PRUNE_BATCH_SIZE = 1000
+
+
+def engine(default='db', env=DEFAULT_ENV, shared_cache=False):
+    """環境変数（なければ default）の名前から SESSION_ENGINE を返す
+
+    shared_cache には、キャッシュが複数のプロセスで共有されるか (config.caches.is_shared) を渡す。
+    """
+    name = os.environ.get(env) or default
+    if name not in ENGINES:
+        raise ValueError(f'Unsupported session backend: {name!r}')
+    if name in CACHE_ENGINES and not shared_cache:
+        raise ValueError(f'Session backend {name!r} requires a shared cache (set CACHE_URL)')
+    return ENGINES[name]
+
+
+def session_model():
+    """セッションを保存するモデル（DBに保存しない保存先なら None）"""
+    from django.conf import settings
+    from django.utils.module_loading import import_string
+
+    store = import_string(f'{settings.SESSION_ENGINE}.SessionStore')
+    # db / cached_db の SessionStore だけが get_model_class を持つ
+    return store.get_model_class() if hasattr(store, 'get_model_class') else None
+
+
+# --- セッションの状態（監視用） ---
+
+def session_metrics():
+    """セッションの行数・期限切れの行数・データの大きさを辞書で返す"""
+    from django.conf import settings
+    from django.db.models import Avg, Count, Max, Min, Q, Sum
+    from django.db.models.functions import Length
+    from django.utils import timezone
+
+    metrics = {'engine': settings.SESSION_ENGINE}
+    model = session_model()
+    if model is None:
+        # Cookie・キャッシュに保存する場合は、サーバー側で数えられる行がない
+        return metrics
+    stats = model.objects.aggregate(
+        rows=Count('pk'),
+        expired=Count('pk', filter=Q(expire_date__lt=timezone.now())),
+        data_bytes=Sum(Length('session_data')),
+        avg_bytes=Avg(Length('session_data')),
+        max_bytes=Max(Length('session_data')),
+        oldest_expire_date=Min('expire_date'),
+    )
+    stats['data_bytes'] = stats['data_bytes'] or 0
+    stats['avg_bytes'] = round(stats['avg_bytes'] or 0, 1)
+    metrics.update(stats)
+    return metrics
+
+
+# --- 期限切れの行の削除 ---
+
+def prune_expired(batch_size=PRUNE_BATCH_SIZE):
+    """期限切れのセッションの行を batch_size 件ずつ削除し、削除した件数を返す
+
+    clearsessions と違い、一度の DELETE を小さくしてテーブルのロックを短くする。
+    """
+    from django.utils import timezone
+
+    model = session_model()
+    if model is None:
+        return 0
+    now = timezone.now()
+    deleted = 0
+    while True:
+        pks = list(model.objects.filter(expire_date__lt=now).values_list('pk', flat=True)[:batch_size])
+        if not pks:
+            return deleted
+        deleted += model.objects.filter(pk__in=pks).delete()[0]
@@ -12,7 +12,9 @@ https://docs.djangoproject.com/en/6.0/ref/settings/
 
 import os
 from pathlib import Path
-import dj_database_url  # 【追加】データベース自動切り替え用
+from config import caches  # 【追加】キャッシュ自動切り替え用
+from config import database  # 【追加】データベース自動切り替え・接続設定用
+from config import sessions  # 【追加】セッションの保存先の切り替え用
 
 # Build paths inside the project like this: BASE_DIR / 'subdir'.
 BASE_DIR = Path(__file__).resolve().parent.parent
@@ -32,6 +34,14 @@ DEBUG = 'RENDER' not in os.environ
 # 【変更】Render上では全てのホストを許可、開発環境ではlocalhost等
 ALLOWED_HOSTS = ['*']
 
+# 【追加】ASGI (config/asgi.py) で動かすときは 1 にすると、時間割・授業詳細・グリッドAPIを
+# 非同期版のビュー (async ORM) で処理する。WSGI (gunicorn) では同期版のままの方が速い
+SCHEDULE_ASYNC_VIEWS = os.environ.get('ASYNC_VIEWS') == '1'
+
+# 【追加】デプロイごとの識別子（条件付きGETの ETag に含め、デプロイ後に古いページが使われないようにする）
+# Render では自動で設定されるコミットIDを使い、なければアプリ・テンプレート・静的ファイルの内容から作る
+BUILD_VERSION = os.environ.get('RENDER_GIT_COMMIT', '')
+
 
 # Application definition
 
@@ -48,6 +58,8 @@ INSTALLED_APPS = [
 MIDDLEWARE = [
     'django.middleware.security.SecurityMiddleware',
     'whitenoise.middleware.WhiteNoiseMiddleware',  # 【追加】静的ファイル配信用（セキュリティの直下に配置）
+    'schedule.middleware.PerformanceMiddleware',  # 【追加】性能計測用（PERF_INSTRUMENTATION=1 のときだけ有効）
+    'schedule.middleware.CompressionMiddleware',  # 【追加】レスポンスの圧縮用（COMPRESSION=1 のときだけ有効）
     'django.contrib.sessions.middleware.SessionMiddleware',
     'django.middleware.common.CommonMiddleware',
     'django.middleware.csrf.CsrfViewMiddleware',
@@ -58,17 +70,33 @@ MIDDLEWARE = [
 
 ROOT_URLCONF = 'config.urls'
 
+# 【追加】レスポンスを Brotli / gzip で圧縮する (schedule/middleware.py の CompressionMiddleware)
+# 環境変数 COMPRESSION=1 で有効にすると、テンプレートの行頭の空白も取り除く (schedule/loaders.py)。
+# リバースプロキシやCDNが圧縮する環境では不要
+SCHEDULE_COMPRESSION = os.environ.get('COMPRESSION') == '1'
+SCHEDULE_COMPRESSION_MIN_SIZE = int(os.environ.get('COMPRESSION_MIN_SIZE', 1024))  # これより小さいレスポンスは圧縮しない
+
+# 【追加】テンプレートの読み込み元。本番 (DEBUG=False) ではコンパイル済みのテンプレートを
+# プロセス内に保持する cached.Loader を明示的に使い、リクエストごとにファイルを読み直さない
+TEMPLATE_LOADERS = [
+    'django.template.loaders.filesystem.Loader',
+    'django.template.loaders.app_directories.Loader',
+]
+if SCHEDULE_COMPRESSION:
+    TEMPLATE_LOADERS = [('schedule.loaders.Loader', TEMPLATE_LOADERS)]
+
 TEMPLATES = [
     {
         'BACKEND': 'django.template.backends.django.DjangoTemplates',
         'DIRS': [os.path.join(BASE_DIR, 'templates')],
-        'APP_DIRS': True,
+        # 【変更】loaders を指定するので APP_DIRS は使わない (app_directories.Loader が同じ役割)
         'OPTIONS': {
             'context_processors': [
                 'django.template.context_processors.request',
                 'django.contrib.auth.context_processors.auth',
                 'django.contrib.messages.context_processors.messages',
             ],
+            'loaders': TEMPLATE_LOADERS if DEBUG else [('django.template.loaders.cached.Loader', TEMPLATE_LOADERS)],
         },
     },
 ]
@@ -80,16 +108,42 @@ WSGI_APPLICATION = 'config.wsgi.application'
 # https://docs.djangoproject.com/en/6.0/ref/settings/#databases
 
 # 【変更】デフォルトはSQLite。環境変数 DATABASE_URL があればPostgreSQLに上書き
+# 【追加】PostgreSQL は接続プール、SQLite は WAL などの PRAGMA を設定する (詳しくは config/database.py を参照)
 DATABASES = {
-    'default': {
-        'ENGINE': 'django.db.backends.sqlite3',
-        'NAME': BASE_DIR / 'db.sqlite3',
-    }
+    'default': database.config(default=f"sqlite:///{BASE_DIR / 'db.sqlite3'}"),
+}
+
+
+# Cache
+# https://docs.djangoproject.com/en/6.0/topics/cache/
+
+# 【追加】デフォルトはプロセスごとのメモリキャッシュ。
+# 環境変数 CACHE_URL があればファイルやRedisの共有キャッシュに切り替える (書式は config/caches.py を参照)
+CACHES = {
+    'default': caches.config(default='locmem://'),
+}
+
+# 時間割データのキャッシュ保持時間（秒）。名前空間ごとに上書きできる
+SCHEDULE_CACHE_TIMEOUTS = {
+    'time-table': int(os.environ.get('TIME_TABLE_CACHE_TIMEOUT', 60 * 60)),
 }
 
-# Renderなどのクラウド環境用のDB設定を読み込む
-db_from_env = dj_database_url.config(conn_max_age=600)
-DATABASES['default'].update(db_from_env)
+# 【追加】時間割のキャッシュと、データのバージョンから作る ETag (304 Not Modified) を使うか。
+# バージョンもキャッシュに置くので、プロセスごとのメモリキャッシュでは他のワーカーでの変更が伝わらない。
+# 共有のキャッシュ (CACHE_URL=redis:// や file://) を設定したとき、または1プロセスで動かすとき
+# (DEBUG の runserver、または環境変数 CACHE_SINGLE_PROCESS=1) だけ有効にする
+SCHEDULE_CACHE_ENABLED = (
+    caches.is_shared(CACHES['default']) or DEBUG or os.environ.get('CACHE_SINGLE_PROCESS') == '1'
+)
+
+# 【追加】時間割画面のグリッド・ToDoリストを、描画済みのHTMLとしてキャッシュする ({% cache_fragment %})
+# 0 にすると毎回テンプレートを描画する（ヒット・ミスの回数はスタッフユーザーで /ops/cache/ から確認できる）
+SCHEDULE_FRAGMENT_CACHE = os.environ.get('FRAGMENT_CACHE', '1') == '1'
+
+# 【追加】セッションの保存先。デフォルトはDB (db)。
+# 環境変数 SESSION_BACKEND で cached_db / cache / signed_cookies に切り替えられる。cached_db と cache は
+# 共有のキャッシュ (CACHE_URL) を設定した場合だけ使える (詳しくは config/sessions.py を参照)
+SESSION_ENGINE = sessions.engine(default='db', shared_cache=caches.is_shared(CACHES['default']))
 
 
 # Password validation
@@ -133,8 +187,40 @@ STATIC_URL = 'static/'
 # 【追加】本番環境で静的ファイルを集める場所
 STATIC_ROOT = BASE_DIR / 'staticfiles'
 
-# 【追加】WhiteNoiseを使って静的ファイルを圧縮・配信する設定
-STATICFILES_STORAGE = 'whitenoise.storage.CompressedManifestStaticFilesStorage'
+# 【追加】プロジェクト共通の静的ファイル (base.html のCSSなど)
+STATICFILES_DIRS = [BASE_DIR / 'static']
+
+# 【変更】WhiteNoiseを使って静的ファイルを圧縮・配信する設定
+# (Django 5.1 で STATICFILES_STORAGE は廃止されたため STORAGES で指定する)
+# 本番では collectstatic がファイル名にハッシュを付け、Brotli / gzip で圧縮したファイルを作っておく。
+# ハッシュ付きのファイルは内容が変わると名前も変わるので、WhiteNoise が1年間キャッシュさせる。
+# 開発時 (DEBUG) は collectstatic せずに確認できるよう、通常のストレージを使う
+STORAGES = {
+    'default': {
+        'BACKEND': 'django.core.files.storage.FileSystemStorage',
+    },
+    'staticfiles': {
+        'BACKEND': ('django.contrib.staticfiles.storage.StaticFilesStorage' if DEBUG
+                    else 'whitenoise.storage.CompressedManifestStaticFilesStorage'),
+    },
+}
 
 LOGIN_REDIRECT_URL = 'schedule:time_table'  # ログイン後の遷移先
-LOGOUT_REDIRECT_URL = 'login'               # ログアウト後の遷移先
\ No newline at end of file
+LOGOUT_REDIRECT_URL = 'login'               # ログアウト後の遷移先
+
+# 【追加】リクエストごとの性能計測 (schedule/middleware.py)
+# 環境変数 PERF_INSTRUMENTATION=1 で有効にすると、Server-Timing ヘッダーとログに計測値を出力する
+PERF_INSTRUMENTATION = os.environ.get('PERF_INSTRUMENTATION') == '1'
+PERF_SLOW_REQUEST_MS = int(os.environ.get('PERF_SLOW_REQUEST_MS', 500))  # これより遅いリクエストを警告
+PERF_MAX_QUERIES = int(os.environ.get('PERF_MAX_QUERIES', 30))           # これより多いクエリ数を警告
+
+LOGGING = {
+    'version': 1,
+    'disable_existing_loggers': False,
+    'handlers': {
+        'console': {'class': 'logging.StreamHandler'},
+    },
+    'loggers': {
+        'schedule.performance': {'handlers': ['console'], 'level': 'INFO', 'propagate': False},
+    },
+}
@@ -0,0 +1,10 @@
+# config/sync_urls.py
+"""
+時間割・詳細・グリッドAPIに同期版のビューを使うURL設定（settings.SCHEDULE_ASYNC_VIEWS に関係なく）
+
+テストとベンチマークで同期版と非同期版を比べるときに、override_settings(ROOT_URLCONF=...) で指定する。
+"""
+from config.urls import site_urlpatterns
+from schedule.urls import app_name, build_urlpatterns
+
+urlpatterns = site_urlpatterns((build_urlpatterns(async_views=False), app_name))
@@ -21,15 +21,19 @@ from schedule import views as schedule_views # <-- scheduleアプリのビュー
 from django.contrib.auth import views as auth_views 
 from django.urls import path
 
-urlpatterns = [
-    path('admin/', admin.site.urls),
-    
-    # 認証関連のURL
-    path('accounts/', include('django.contrib.auth.urls')),
-    
-    # ユーザー登録
-    path('accounts/signup/', schedule_views.SignUpView.as_view(), name='signup'),
+def site_urlpatterns(schedule_urls):
+    """サイト全体のURL。schedule_urls は include() に渡す schedule アプリのURL設定"""
+    return [
+        path('admin/', admin.site.urls),
 
-    # schedule アプリのURLをルートに紐づける
-    path('', include('schedule.urls')), 
-]
\ No newline at end of file
+        # 認証関連のURL
+        path('accounts/', include('django.contrib.auth.urls')),
+
+        # ユーザー登録
+        path('accounts/signup/', schedule_views.SignUpView.as_view(), name='signup'),
+
+        # schedule アプリのURLをルートに紐づける
+        path('', include(schedule_urls)),
+    ]
+
+urlpatterns = site_urlpatterns('schedule.urls')
@@ -3,3 +3,7 @@ from django.apps import AppConfig
 
 class ScheduleConfig(AppConfig):
     name = 'schedule'
+
+    def ready(self):
+        # キャッシュ無効化用のシグナルを登録
+        from . import signals  # noqa: F401
@@ -0,0 +1,451 @@
+# schedule/benchmark.py
+"""
+合成データを使ったベンチマーク（manage.py benchmark から実行する）
+
+schedule/urls.py のすべてのURLについて、クエリ数・レイテンシ・ピークメモリ・
+レスポンスサイズを計測し、実行ごとに比較できるJSONレポートにまとめる。
+"""
+
+import asyncio
+import json
+import random
+import statistics
+import time
+import tracemalloc
+from collections import Counter
+from datetime import timedelta
+
+import django
+from asgiref.sync import async_to_sync
+from django.conf import settings
+from django.contrib.auth.models import User
+from django.core.cache import cache
+from django.db import connection
+from django.template.loader import render_to_string
+from django.test import AsyncClient, Client, RequestFactory, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+from django.utils import timezone
+
+from . import urls as schedule_urls
+from .ical import feed_token
+from .models import Timetable, Day, Period, Course, Schedule, Task
+
+REPORT_VERSION = 1
+
+# 計測中に使うキャッシュ。計測のたびに cache.clear() するので、本番のキャッシュ (Redis など) とは分ける
+BENCHMARK_CACHES = {
+    'default': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache', 'LOCATION': 'schedule-benchmark'},
+}
+
+
+def isolated_cache():
+    """計測用の専用のメモリキャッシュに切り替える（with 文で使う）
+
+    1プロセスで計測するので、キャッシュとデータのバージョンを使う ETag も有効にしておく。
+    """
+    return override_settings(CACHES=BENCHMARK_CACHES, SCHEDULE_CACHE_ENABLED=True)
+
+
+# --- 合成データの生成 ---
+
+def generate_dataset(username='bench', timetables=2, days=6, periods=5, courses=20, tasks=2000, seed=0):
+    """ベンチマーク用のユーザーとデータを作成し、計測に使うサンプルを返す
+
+    授業は最後の時間割のコマに先頭から詰めて登録し、最後の1コマは空けておく
+    （授業登録画面の計測用）。タスクは授業に均等に割り振り、期限日と完了状態はばらつかせる。
+    """
+    rng = random.Random(seed)
+    today = timezone.localdate()
+    user = User.objects.create_user(username, password='benchmark')
+
+    timetable_objs = []
+    for i in range(timetables):
+        timetable = Timetable.objects.create(user=user, name=f'{username}-{i + 1}', is_default=i == timetables - 1)
+        Day.objects.bulk_create([Day(timetable=timetable, name=f'D{d + 1}', order=d + 1) for d in range(days)])
+        Period.objects.bulk_create([
+            Period(timetable=timetable, name=f'P{p + 1}', order=p + 1,
+                   start_time=f'{8 + p:02d}:00', end_time=f'{8 + p:02d}:50')
+            for p in range(periods)
+        ])
+        timetable_objs.append(timetable)
+
+    timetable = timetable_objs[-1]
+    day_objs = list(timetable.day_set.order_by('order'))
+    period_objs = list(timetable.period_set.order_by('order'))
+    slots = [(day, period) for period in period_objs for day in day_objs]
+    free_day, free_period = slots.pop()
+
+    course_objs = Course.objects.bulk_create([
+        Course(name=f'授業{c + 1}', instructor=f'教員{c + 1}', room=f'{c + 101}教室',
+               color=Course.COLOR_CHOICES[c % len(Course.COLOR_CHOICES)][0])
+        for c in range(min(courses, len(slots)))
+    ])
+    schedule_objs = Schedule.objects.bulk_create([
+        Schedule(user=user, course=course, day=day, period=period)
+        for course, (day, period) in zip(course_objs, slots)
+    ])
+    task_objs = Task.objects.bulk_create([
+        Task(course=course_objs[t % len(course_objs)], title=f'課題{t + 1}',
+             due_date=today + timedelta(days=rng.randint(-14, 30)) if rng.random() < 0.9 else None,
+             is_completed=rng.random() < 0.3)
+        for t in range(tasks if course_objs else 0)
+    ], batch_size=1000)
+
+    return {
+        'user': user,
+        'timetable': timetable,
+        'day': day_objs[0],
+        'period': period_objs[0],
+        'free_day': free_day,
+        'free_period': free_period,
+        'schedule': schedule_objs[0] if schedule_objs else None,
+        'task': task_objs[0] if task_objs else None,
+    }
+
+
+# --- 計測対象のURL ---
+
+def _new_schedule(samples):
+    """削除系のURL用に、使い捨ての授業を空きコマに登録する"""
+    Schedule.objects.filter(user=samples['user'], day=samples['free_day'], period=samples['free_period']).delete()
+    course = Course.objects.create(name='使い捨て', instructor='-')
+    return Schedule.objects.create(user=samples['user'], course=course,
+                                   day=samples['free_day'], period=samples['free_period'])
+
+
+def _new_task(samples):
+    return Task.objects.create(course=samples['schedule'].course, title='使い捨て')
+
+
+# URL名 -> サンプルから reverse() の kwargs を作る関数。
+# データを削除するURLは、計測のたびに使い捨てのオブジェクトを作る（作成時間は計測に含めない）
+URL_KWARGS = {
+    'time_table': lambda s: {},
+    'time_table_with_pk': lambda s: {'timetable_pk': s['timetable'].pk},
+    'switch_timetable': lambda s: {'pk': s['timetable'].pk},
+    'grid_api': lambda s: {'timetable_pk': s['timetable'].pk},
+    'calendar_feed': lambda s: {'token': feed_token(s['timetable'])},
+    'calendar_feed_rotate': lambda s: {},
+    'create': lambda s: {'day_pk': s['free_day'].pk, 'period_pk': s['free_period'].pk},
+    'detail': lambda s: {'pk': s['schedule'].pk},
+    'update': lambda s: {'pk': s['schedule'].pk},
+    'delete': lambda s: {'pk': _new_schedule(s).pk},
+    'task_toggle': lambda s: {'pk': s['task'].pk},
+    'task_edit': lambda s: {'pk': s['task'].pk},
+    'task_delete': lambda s: {'pk': _new_task(s).pk},
+    'todo_dashboard': lambda s: {},
+    'task_batch': lambda s: {},
+    'task_bulk_api': lambda s: {},
+    'timetable_list': lambda s: {},
+    'timetable_create': lambda s: {},
+    'timetable_update': lambda s: {'pk': s['timetable'].pk},
+    'timetable_delete': lambda s: {'pk': s['timetable'].pk},
+    'timetable_import': lambda s: {'timetable_pk': s['timetable'].pk},
+    'day_create': lambda s: {'timetable_pk': s['timetable'].pk},
+    'day_update': lambda s: {'pk': s['day'].pk},
+    'day_delete': lambda s: {'pk': s['day'].pk},
+    'period_create': lambda s: {'timetable_pk': s['timetable'].pk},
+    'period_update': lambda s: {'pk': s['period'].pk},
+    'period_delete': lambda s: {'pk': s['period'].pk},
+    'signup': lambda s: {},
+    'account_delete': lambda s: {},
+    'data_export': lambda s: {},
+    'db_metrics': lambda s: {},
+    'cache_metrics': lambda s: {},
+    'session_metrics': lambda s: {},
+}
+
+
+def url_names():
+    """schedule/urls.py に登録されているURL名（登録順）"""
+    return [pattern.name for pattern in schedule_urls.urlpatterns if pattern.name]
+
+
+# --- 計測 ---
+
+def _percentile(values, percent):
+    ordered = sorted(values)
+    index = min(len(ordered) - 1, max(0, round(percent / 100 * len(ordered)) - 1))
+    return ordered[index]
+
+# POST でしか受け付けないURL名 -> サンプルから送信データを作る関数（ここにないURLは GET で計測する）
+# 文字列を返した場合は JSON の本文として送る
+URL_POST_DATA = {
+    'calendar_feed_rotate': lambda s: {},
+    'task_batch': lambda s: {'action': 'toggle', 'task_ids': [s['task'].pk]},
+    'task_bulk_api': lambda s: json.dumps({'action': 'toggle', 'task_ids': [s['task'].pk]}),
+}
+
+
+def _get(client, url, data=None):
+    """GET（data があれば POST）してレスポンスと本文を返す（ストリーミングのレスポンスは最後まで読む）"""
+    if data is None:
+        response = client.get(url)
+    elif isinstance(data, str):
+        response = client.post(url, data, content_type='application/json')
+    else:
+        response = client.post(url, data)
+    if response.streaming:
+        return response, b''.join(response.streaming_content)
+    return response, response.content
+
+
+def measure_url(client, name, samples, repeat=5, warm=False):
+    """1つのURLを repeat 回 GET（URL_POST_DATA にあれば POST）し、計測結果を返す"""
+    make_kwargs = URL_KWARGS[name]
+    make_data = URL_POST_DATA.get(name, lambda s: None)
+    latencies, query_counts = [], []
+    status = size = None
+
+    for _ in range(repeat):
+        url = reverse(f'schedule:{name}', kwargs=make_kwargs(samples))
+        if warm:
+            _get(client, url, make_data(samples))
+        else:
+            cache.clear()
+        with CaptureQueriesContext(connection) as ctx:
+            start = time.perf_counter()
+            response, body = _get(client, url, make_data(samples))
+            latencies.append((time.perf_counter() - start) * 1000)
+        query_counts.append(len(ctx.captured_queries))
+        status = response.status_code
+        size = len(body)
+
+    # tracemalloc は実行を遅くするので、レイテンシとは別に1回だけ計測する
+    url = reverse(f'schedule:{name}', kwargs=make_kwargs(samples))
+    if not warm:
+        cache.clear()
+    tracemalloc.start()
+    try:
+        _get(client, url, make_data(samples))
+        _, peak = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+
+    return {
+        'status': status,
+        'queries': max(query_counts),
+        'latency_ms': {
+            'min': round(min(latencies), 3),
+            'median': round(statistics.median(latencies), 3),
+            'p95': round(_percentile(latencies, 95), 3),
+        },
+        'peak_memory_kb': round(peak / 1024, 1),
+        'response_bytes': size,
+    }
+
+
+def run_benchmark(samples, repeat=5, warm=False, names=None):
+    """すべてのURLを計測してレポート（辞書）を返す"""
+    client = Client()
+    client.force_login(samples['user'])
+
+    results, skipped = {}, []
+    for name in names or url_names():
+        if name not in URL_KWARGS:
+            # 新しいURLを追加したら URL_KWARGS にも追加すること
+            skipped.append(name)
+            continue
+        results[name] = measure_url(client, name, samples, repeat=repeat, warm=warm)
+
+    return {
+        'version': REPORT_VERSION,
+        'meta': {
+            'django': django.get_version(),
+            'database': connection.vendor,
+            'cache': 'warm' if warm else 'cold',
+            'repeat': repeat,
+        },
+        'results': results,
+        'skipped': skipped,
+    }
+
+
+# --- 同期版と非同期版のビューの比較 (ASGI) ---
+
+# settings.SCHEDULE_ASYNC_VIEWS で非同期版に切り替わるURL
+ASYNC_URL_NAMES = ['time_table', 'detail', 'grid_api']
+
+# 同期版・非同期版のビューを使うURL設定 (ROOT_URLCONF)
+VIEW_URLCONFS = {'sync': 'config.sync_urls', 'async': 'config.async_urls'}
+
+
+async def _load(client, url, concurrency, requests):
+    """url に同時に最大 concurrency 件ずつ、合計 requests 件のリクエストを送る"""
+    semaphore = asyncio.Semaphore(concurrency)
+    latencies, statuses = [], Counter()
+
+    async def fetch():
+        async with semaphore:
+            start = time.perf_counter()
+            response = await client.get(url)
+            latencies.append((time.perf_counter() - start) * 1000)
+            statuses[response.status_code] += 1
+
+    start = time.perf_counter()
+    await asyncio.gather(*(fetch() for _ in range(requests)))
+    elapsed = time.perf_counter() - start
+    return {
+        'requests_per_second': round(requests / elapsed, 1),
+        'latency_ms': {
+            'median': round(statistics.median(latencies), 3),
+            'p95': round(_percentile(latencies, 95), 3),
+        },
+        'statuses': {str(status): count for status, count in sorted(statuses.items())},
+    }
+
+
+def run_load_comparison(samples, names=None, concurrency=10, requests=100, warm=True):
+    """ASGI ハンドラー (AsyncClient) 経由で、同期版と非同期版のビューに同時にリクエストを送って比べる
+
+    warm=False のときはキャッシュを無効 (DummyCache) にして、毎回DBから組み立てる。
+    """
+    cache_settings = {} if warm else {
+        'CACHES': {'default': {'BACKEND': 'django.core.cache.backends.dummy.DummyCache'}},
+    }
+    results = {}
+    for name in names or ASYNC_URL_NAMES:
+        url = reverse(f'schedule:{name}', kwargs=URL_KWARGS[name](samples))
+        results[name] = {}
+        for mode, urlconf in VIEW_URLCONFS.items():
+            with override_settings(ROOT_URLCONF=urlconf, **cache_settings):
+                client = AsyncClient()
+                client.force_login(samples['user'])
+                results[name][mode] = async_to_sync(_load)(client, url, concurrency, requests)
+    return {
+        'meta': {'concurrency': concurrency, 'requests': requests, 'cache': 'warm' if warm else 'cold'},
+        'results': results,
+    }
+
+
+# --- テンプレートの描画時間 ---
+
+DEFAULT_TEMPLATE_LOADERS = [
+    'django.template.loaders.filesystem.Loader',
+    'django.template.loaders.app_directories.Loader',
+]
+
+
+def measure_render(samples, repeat=20, template_name='schedule/time_table.html'):
+    """時間割画面のテンプレートの描画時間だけを計測する（DBアクセスは含まない）
+
+    コンテキストは一度だけ組み立て、cached.Loader（本番の設定）とファイルを毎回読み直す
+    ローダーのそれぞれで、断片キャッシュを使わずに render_to_string の時間を測る。
+    fragment は cached.Loader に断片キャッシュ ({% cache_fragment %}) がヒットした場合の時間。
+    """
+    from .views import build_time_table_context
+
+    request = RequestFactory().get(reverse('schedule:time_table'))
+    request.user = samples['user']
+    context = build_time_table_context(
+        samples['user'], samples['timetable'].pk, None, False, timezone.localdate())
+    loaders = getattr(settings, 'TEMPLATE_LOADERS', DEFAULT_TEMPLATE_LOADERS)
+    cached_loaders = [('django.template.loaders.cached.Loader', loaders)]
+
+    results = {}
+    for mode, mode_loaders, fragment_cache in (('cached', cached_loaders, False),
+                                               ('uncached', loaders, False),
+                                               ('fragment', cached_loaders, True)):
+        base = settings.TEMPLATES[0]
+        templates = [{**base, 'APP_DIRS': False, 'OPTIONS': {**base.get('OPTIONS', {}), 'loaders': mode_loaders}}]
+        with override_settings(TEMPLATES=templates, SCHEDULE_FRAGMENT_CACHE=fragment_cache):
+            # 1回目はテンプレートのコンパイル（と断片の保存）を含むので計測しない
+            html = render_to_string(template_name, context, request)
+            latencies = []
+            for _ in range(repeat):
+                start = time.perf_counter()
+                html = render_to_string(template_name, context, request)
+                latencies.append((time.perf_counter() - start) * 1000)
+        results[mode] = {
+            'median': round(statistics.median(latencies), 3),
+            'p95': round(_percentile(latencies, 95), 3),
+        }
+    return {
+        'template': template_name,
+        'repeat': repeat,
+        'cells': sum(len(row.cells) for row in context.get('grid_rows', [])),
+        'html_bytes': len(html.encode()),
+        'latency_ms': results,
+    }
+
+
+# --- レスポンスの圧縮 ---
+
+# 圧縮の効果を計測するURL（HTMLのページとJSON API）
+COMPRESSION_URL_NAMES = ['time_table', 'todo_dashboard', 'detail', 'grid_api']
+
+# モード -> (テンプレートの空白を取り除くか, 圧縮するか, Accept-Encoding)
+COMPRESSION_MODES = {
+    'identity': (False, False, ''),
+    'stripped': (True, False, ''),
+    'gzip': (True, True, 'gzip'),
+    'br': (True, True, 'br, gzip'),
+}
+
+
+def measure_compression(samples, repeat=10, names=None):
+    """圧縮なし・空白の除去のみ・gzip・Brotli のそれぞれで、レスポンスのバイト数とレイテンシを計測する
+
+    キャッシュは温めた状態で測る（圧縮にかかる時間の差が分かるように）。
+    """
+    base = settings.TEMPLATES[0]
+    results = {name: {} for name in names or COMPRESSION_URL_NAMES}
+    for mode, (strip, compress, accept) in COMPRESSION_MODES.items():
+        loaders = [('schedule.loaders.Loader', DEFAULT_TEMPLATE_LOADERS)] if strip else DEFAULT_TEMPLATE_LOADERS
+        options = {**base.get('OPTIONS', {}), 'loaders': [('django.template.loaders.cached.Loader', loaders)]}
+        templates = [{**base, 'APP_DIRS': False, 'OPTIONS': options}]
+        with override_settings(TEMPLATES=templates, SCHEDULE_COMPRESSION=compress):
+            # 断片キャッシュに前のモードのHTMLが残らないようにする
+            cache.clear()
+            # ミドルウェアは最初のリクエストで読み込まれるので、モードごとにクライアントを作る
+            client = Client(headers={'accept-encoding': accept} if accept else None)
+            client.force_login(samples['user'])
+            for name in results:
+                url = reverse(f'schedule:{name}', kwargs=URL_KWARGS[name](samples))
+                _get(client, url)
+                latencies = []
+                for _ in range(repeat):
+                    start = time.perf_counter()
+                    response, body = _get(client, url)
+                    latencies.append((time.perf_counter() - start) * 1000)
+                results[name][mode] = {
+                    'status': response.status_code,
+                    'encoding': response.get('Content-Encoding', 'identity'),
+                    'bytes': len(body),
+                    'latency_ms': {
+                        'median': round(statistics.median(latencies), 3),
+                        'p95': round(_percentile(latencies, 95), 3),
+                    },
+                }
+    return {'repeat': repeat, 'results': results}
+
+
+# --- レポートの比較 ---
+
+def compare_reports(baseline, current, max_latency_regression=None):
+    """2つのレポートを比較し、退行（regression）の説明文のリストを返す
+
+    クエリ数の増加は常に退行とみなす。レイテンシ（中央値）は max_latency_regression
+    （0.25 なら25%）を指定したときだけ比較する。
+    """
+    regressions = []
+    for name, result in current['results'].items():
+        base = baseline['results'].get(name)
+        if base is None:
+            continue
+        if result['queries'] > base['queries']:
+            regressions.append(f"{name}: queries {base['queries']} -> {result['queries']}")
+        if result['status'] != base['status']:
+            regressions.append(f"{name}: status {base['status']} -> {result['status']}")
+        if max_latency_regression is not None:
+            before, after = base['latency_ms']['median'], result['latency_ms']['median']
+            if before > 0 and (after - before) / before > max_latency_regression:
+                regressions.append(f'{name}: median latency {before}ms -> {after}ms')
+    # テンプレートの描画時間 (--render) は、両方のレポートにあるときだけ比較する
+    if max_latency_regression is not None and 'render' in baseline and 'render' in current:
+        before = baseline['render']['latency_ms']['cached']['median']
+        after = current['render']['latency_ms']['cached']['median']
+        if before > 0 and (after - before) / before > max_latency_regression:
+            regressions.append(f'render: median latency {before}ms -> {after}ms')
+    return regressions
@@ -0,0 +1,207 @@
+# schedule/cache.py
+"""
+時間割アプリ用のキャッシュ補助関数
+
+キーは「schedule:<名前空間>:<ユーザーID>:<データのバージョン>:<パラメータ...>」の形式。
+ユーザーのデータが変更されると bump_user_version() でバージョンが変わり、
+そのユーザーの古いキャッシュは読まれなくなる（期限切れで自然に消える）。
+"""
+
+import time
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db import transaction
+
+KEY_PREFIX = 'schedule'
+
+# キャッシュするデータの形式を変えたら上げる（デプロイ直後に古い形式を読まないため）
+SCHEMA_VERSION = 1
+
+# 名前空間ごとの保持時間（秒）。settings.SCHEDULE_CACHE_TIMEOUTS で上書きできる
+DEFAULT_TIMEOUTS = {
+    'time-table': 60 * 60,
+    'grid-json': 60 * 60,
+    'grid-snapshot': 60 * 60 * 24,
+    'fragment': 60 * 60,
+}
+DEFAULT_TIMEOUT = 60 * 5
+
+
+def get_timeout(namespace):
+    """名前空間の保持時間（秒）を返す"""
+    timeouts = {**DEFAULT_TIMEOUTS, **getattr(settings, 'SCHEDULE_CACHE_TIMEOUTS', {})}
+    return timeouts.get(namespace, DEFAULT_TIMEOUT)
+
+
+def make_key(namespace, *parts):
+    """名前空間付きのキャッシュキーを作る（None は '-' として扱う）"""
+    return ':'.join([KEY_PREFIX, namespace, *('-' if part is None else str(part) for part in parts)])
+
+
+def enabled():
+    """ユーザーのデータのバージョンを使うキャッシュと ETag を使えるか (settings.SCHEDULE_CACHE_ENABLED)
+
+    バージョンはキャッシュに置くので、プロセスごとのメモリキャッシュでは他のワーカーでデータが
+    変更されてもバージョンが変わらず、古い内容を返してしまう。無効のときは毎回作り直す。
+    """
+    return getattr(settings, 'SCHEDULE_CACHE_ENABLED', True)
+
+
+# --- ユーザーごとのデータのバージョン ---
+
+def get_user_version(user_id):
+    """ユーザーのデータのバージョンを返す（未登録なら新しく発行する）"""
+    key = make_key('user-version', user_id)
+    version = cache.get(key, version=SCHEMA_VERSION)
+    if version is None:
+        cache.add(key, time.time_ns(), None, version=SCHEMA_VERSION)
+        version = cache.get(key, version=SCHEMA_VERSION)
+    return version
+
+
+def bump_user_version(*user_ids):
+    """ユーザーのデータが変更されたときに呼び、そのユーザーのキャッシュをすべて無効にする
+
+    トランザクションの中で呼ばれた場合は、コミットした後にバージョンを変える。コミット前に変えると、
+    同時に来たリクエストが新しいバージョンでコミット前のデータを読み、そのままキャッシュしてしまうため。
+    """
+    user_ids = set(user_ids)
+    transaction.on_commit(lambda: _set_user_versions(user_ids))
+
+
+def _set_user_versions(user_ids):
+    # 連番ではなく時刻を使うので、キャッシュから消えた後に再発行しても古い値と衝突しない
+    version = time.time_ns()
+    cache.set_many(
+        {make_key('user-version', user_id): version for user_id in user_ids},
+        None, version=SCHEMA_VERSION,
+    )
+
+
+def user_key(namespace, user_id, *parts):
+    """ユーザーのデータのバージョンを含むキャッシュキーを作る"""
+    return make_key(namespace, user_id, get_user_version(user_id), *parts)
+
+
+# --- 読み書き ---
+
+def get_data(namespace, *parts):
+    """バージョンに関係しないキャッシュを取得する（なければ None）"""
+    return cache.get(make_key(namespace, *parts), version=SCHEMA_VERSION)
+
+
+def set_data(namespace, *parts, value, timeout=None):
+    """バージョンに関係しないキャッシュを保存する（データ変更後も残したい値に使う）"""
+    if timeout is None:
+        timeout = get_timeout(namespace)
+    cache.set(make_key(namespace, *parts), value, timeout, version=SCHEMA_VERSION)
+
+
+def get_user_data(namespace, user_id, *parts):
+    """ユーザーのキャッシュを取得する（なければ None）"""
+    if not enabled():
+        return None
+    return cache.get(user_key(namespace, user_id, *parts), version=SCHEMA_VERSION)
+
+
+def set_user_data(namespace, user_id, *parts, value, timeout=None):
+    """ユーザーのキャッシュを保存する（timeout 省略時は名前空間の保持時間）"""
+    if not enabled():
+        return
+    if timeout is None:
+        timeout = get_timeout(namespace)
+    cache.set(user_key(namespace, user_id, *parts), value, timeout, version=SCHEMA_VERSION)
+
+
+def get_or_build(namespace, user_id, parts, build):
+    """キャッシュがあればそれを返し、なければ build() で作って保存する"""
+    if not enabled():
+        return build()
+    key = user_key(namespace, user_id, *parts)
+    value = cache.get(key, version=SCHEMA_VERSION)
+    if value is None:
+        value = build()
+        cache.set(key, value, get_timeout(namespace), version=SCHEMA_VERSION)
+    return value
+
+
+# --- テンプレートの断片（{% cache_fragment %} タグ） ---
+
+# 監視用にヒット・ミスを数える断片の名前（time_table.html のグリッドとToDoリスト）
+FRAGMENTS = ('grid', 'todos')
+
+
+def get_fragment(user_id, name, parts):
+    """描画済みの断片を取得する（なければ None）。ヒット・ミスを数える"""
+    html = get_user_data('fragment', user_id, name, *parts)
+    record_fragment(name, hit=html is not None)
+    return html
+
+
+def set_fragment(user_id, name, parts, html):
+    set_user_data('fragment', user_id, name, *parts, value=html)
+
+
+def record_fragment(name, hit):
+    """断片のヒット・ミスの回数を数える（プロセスをまたいで集計できるようキャッシュに置く）"""
+    key = make_key('fragment-stats', name, 'hit' if hit else 'miss')
+    try:
+        cache.incr(key, version=SCHEMA_VERSION)
+    except ValueError:
+        # 初回（またはキャッシュから消えた後）。同時に来た分は数え漏れてもよい
+        cache.add(key, 1, None, version=SCHEMA_VERSION)
+
+
+def fragment_stats(names=FRAGMENTS):
+    """断片ごとのヒット・ミスの回数とヒット率を返す"""
+    keys = {
+        (name, outcome): make_key('fragment-stats', name, outcome)
+        for name in names for outcome in ('hit', 'miss')
+    }
+    counts = cache.get_many(keys.values(), version=SCHEMA_VERSION)
+    stats = {}
+    for name in names:
+        hits = counts.get(keys[name, 'hit'], 0)
+        misses = counts.get(keys[name, 'miss'], 0)
+        total = hits + misses
+        stats[name] = {'hits': hits, 'misses': misses, 'hit_ratio': round(hits / total, 3) if total else None}
+    return stats
+
+
+# --- 非同期版（ASGI の非同期ビュー用） ---
+
+async def aget_user_version(user_id):
+    """get_user_version の非同期版"""
+    key = make_key('user-version', user_id)
+    version = await cache.aget(key, version=SCHEMA_VERSION)
+    if version is None:
+        await cache.aadd(key, time.time_ns(), None, version=SCHEMA_VERSION)
+        version = await cache.aget(key, version=SCHEMA_VERSION)
+    return version
+
+
+async def auser_key(namespace, user_id, *parts):
+    return make_key(namespace, user_id, await aget_user_version(user_id), *parts)
+
+
+async def aget_data(namespace, *parts):
+    return await cache.aget(make_key(namespace, *parts), version=SCHEMA_VERSION)
+
+
+async def aset_data(namespace, *parts, value, timeout=None):
+    if timeout is None:
+        timeout = get_timeout(namespace)
+    await cache.aset(make_key(namespace, *parts), value, timeout, version=SCHEMA_VERSION)
+
+
+async def aget_or_build(namespace, user_id, parts, build):
+    """get_or_build の非同期版（build はコルーチンを返す関数）"""
+    if not enabled():
+        return await build()
+    key = await auser_key(namespace, user_id, *parts)
+    value = await cache.aget(key, version=SCHEMA_VERSION)
+    if value is None:
+        value = await build()
+        await cache.aset(key, value, get_timeout(namespace), version=SCHEMA_VERSION)
+    return value
@@ -0,0 +1,96 @@
+# schedule/exporter.py
+"""
+ユーザーのデータのエクスポート（バックアップ・移行用）
+
+Timetable / Day / Period / Course / Schedule / Task を1件1行の JSON (NDJSON) で書き出す。
+各モデルは .iterator(chunk_size=...) で少しずつ読み、1行ずつ（gzip の場合は圧縮しながら）
+出力するので、アカウントのデータ量が増えてもメモリ使用量は変わらない。
+出力は manage.py import_schedule（importer.restore_file）でそのまま取り込める。
+"""
+
+import zlib
+
+from django.core.serializers.json import DjangoJSONEncoder
+from django.utils import timezone
+
+from .models import Timetable, Day, Period, Course, Schedule, Task
+
+EXPORT_VERSION = 1
+
+# .iterator() で一度に読む行数
+CHUNK_SIZE = 1000
+
+# 出力がこの大きさ（バイト）以上たまったら書き出す（小さな書き込みを繰り返さないため）
+FLUSH_SIZE = 64 * 1024
+
+# 名前 -> (モデル, 出力する列, ユーザーのデータに絞り込む条件)。参照される側から順に並べる
+EXPORT_MODELS = {
+    'timetable': (Timetable, ['id', 'name', 'is_default'], lambda user: {'user': user}),
+    'day': (Day, ['id', 'timetable', 'name', 'order'], lambda user: {'timetable__user': user}),
+    'period': (Period, ['id', 'timetable', 'name', 'order', 'start_time', 'end_time'],
+               lambda user: {'timetable__user': user}),
+    'course': (Course, ['id', 'name', 'instructor', 'description', 'room', 'color'],
+               lambda user: {'pk__in': Schedule.objects.filter(user=user).values('course')}),
+    'schedule': (Schedule, ['id', 'course', 'day', 'period'], lambda user: {'user': user}),
+    'task': (Task, ['id', 'course', 'title', 'description', 'due_date', 'is_completed'],
+             lambda user: {'course__in': Schedule.objects.filter(user=user).values('course')}),
+}
+
+
+def iter_records(user, chunk_size=CHUNK_SIZE):
+    """エクスポートする内容を1件ずつ辞書で返す（最初の1件はファイルの見出し）"""
+    yield {
+        'model': 'export', 'version': EXPORT_VERSION, 'user': user.get_username(),
+        'exported_at': timezone.now(),
+    }
+    for name, (model, fields, scope) in EXPORT_MODELS.items():
+        rows = model.objects.filter(**scope(user)).order_by('pk').values_list(*fields)
+        for row in rows.iterator(chunk_size=chunk_size):
+            yield {'model': name, **dict(zip(fields, row))}
+
+
+def iter_ndjson(user, chunk_size=CHUNK_SIZE):
+    """NDJSON の行を1行ずつ（bytes で）返す"""
+    encoder = DjangoJSONEncoder(ensure_ascii=False, separators=(',', ':'))
+    for record in iter_records(user, chunk_size=chunk_size):
+        yield (encoder.encode(record) + '\n').encode('utf-8')
+
+
+def iter_gzip(chunks, level=6):
+    """bytes のイテレーターを gzip 形式に圧縮しながら返す"""
+    # wbits=31 で gzip のヘッダー・フッター付きの形式になる
+    compressor = zlib.compressobj(level, zlib.DEFLATED, 31)
+    pending, size = [], 0
+    for chunk in chunks:
+        data = compressor.compress(chunk)
+        if data:
+            pending.append(data)
+            size += len(data)
+        if size >= FLUSH_SIZE:
+            yield b''.join(pending)
+            pending, size = [], 0
+    pending.append(compressor.flush())
+    yield b''.join(pending)
+
+
+def iter_buffered(chunks):
+    """bytes のイテレーターを FLUSH_SIZE 程度の大きさにまとめて返す"""
+    pending, size = [], 0
+    for chunk in chunks:
+        pending.append(chunk)
+        size += len(chunk)
+        if size >= FLUSH_SIZE:
+            yield b''.join(pending)
+            pending, size = [], 0
+    if pending:
+        yield b''.join(pending)
+
+
+def iter_export(user, compress=False, chunk_size=CHUNK_SIZE):
+    """エクスポートの内容（bytes）を返すジェネレーター"""
+    lines = iter_ndjson(user, chunk_size=chunk_size)
+    return iter_gzip(lines) if compress else iter_buffered(lines)
+
+
+def export_filename(user, compress=False):
+    return f"schedule-{user.get_username()}-{timezone.localdate():%Y%m%d}.ndjson{'.gz' if compress else ''}"
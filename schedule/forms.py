@@ -3,6 +3,7 @@
 from django import forms
 # 【修正】必要なモデルを models.py からインポートする
 from .models import Schedule, Course, Task, Day, Period, Timetable
+from .todos import URGENCY_CHOICES
 
 class CourseForm(forms.ModelForm):
     class Meta:
@@ -113,6 +114,51 @@ class TimetableForm(forms.ModelForm):
             'is_default': 'デフォルトとして使用',
         }
 
+# 【追加】新規作成時だけ、直前の時間割から何を引き継ぐかを選べるようにする
+class TimetableCreateForm(TimetableForm):
+    """時間割セットの新規作成フォーム（直前の時間割からのコピー方法を選択）"""
+    COPY_STRUCTURE = 'structure'
+    COPY_SCHEDULES = 'schedules'
+    COPY_COURSES = 'courses'
+    COPY_CHOICES = [
+        (COPY_STRUCTURE, '曜日・時限の構成のみ'),
+        (COPY_SCHEDULES, '授業の登録も引き継ぐ'),
+        (COPY_COURSES, '授業とToDoを複製して引き継ぐ'),
+    ]
+    copy_mode = forms.ChoiceField(
+        choices=COPY_CHOICES, initial=COPY_STRUCTURE, required=False,
+        label='直前の時間割からのコピー',
+    )
+
+# 【追加】CSV / JSON ファイルからの一括登録用フォーム
+class TimetableImportForm(forms.Form):
+    """時間割への一括インポート用のファイル選択フォーム"""
+    file = forms.FileField(label='ファイル（CSV / JSON）')
+
+    def clean_file(self):
+        from .importer import detect_format  # importer が forms を使うので、循環インポートを避ける
+        upload = self.cleaned_data['file']
+        self.cleaned_data['format'] = detect_format(upload.name)
+        if self.cleaned_data['format'] is None:
+            raise forms.ValidationError('拡張子が .csv / .json / .jsonl のファイルを選んでください。')
+        return upload
+
+# 【追加】ToDo ダッシュボードの絞り込み用フォーム
+class TodoFilterForm(forms.Form):
+    """ToDo ダッシュボードの絞り込み条件（選択肢はログインユーザーの授業・時間割だけ）"""
+    urgency = forms.ChoiceField(label='緊急度', choices=[('', 'すべて')] + URGENCY_CHOICES, required=False)
+    course = forms.ModelChoiceField(label='授業', queryset=Course.objects.none(), required=False,
+                                    empty_label='すべての授業')
+    timetable = forms.ModelChoiceField(label='時間割', queryset=Timetable.objects.none(), required=False,
+                                       empty_label='すべての時間割')
+    all = forms.BooleanField(label='完了済みも表示', required=False)
+
+    def __init__(self, *args, user, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.fields['course'].queryset = Course.objects.filter(
+            pk__in=Schedule.objects.filter(user=user).values('course')).order_by('name', 'pk')
+        self.fields['timetable'].queryset = Timetable.objects.filter(user=user).order_by('name', 'pk')
+
 from django.contrib.auth.forms import UserCreationForm
 from django.contrib.auth.models import User
 
@@ -0,0 +1,294 @@
+# schedule/grid.py
+
+import asyncio
+import hashlib
+import json
+from datetime import timedelta
+
+from django.db.models import Count, Min, Q
+from django.urls import reverse
+
+from .models import Day, Period, Schedule, Task
+
+# 時間割画面の下部に表示するToDoの件数（それ以上はToDo一覧 (todo_dashboard) で見る）
+TODO_PREVIEW_LIMIT = 20
+
+
+def get_urgency(due_date, today, next_week):
+    """期限日から緊急度 ('overdue' / 'today' / 'weekly' / None) を判定する"""
+    if due_date is None:
+        return None
+    if due_date < today:
+        return 'overdue'
+    if due_date == today:
+        return 'today'
+    if due_date <= next_week:
+        return 'weekly'
+    return None
+
+
+# 緊急度 -> セルに表示するバッジ
+URGENCY_BADGES = {
+    'overdue': '⚠️ 期限切れ',
+    'today': '🔔 今日まで',
+    'weekly': '📅 今週',
+}
+
+
+class GridCell:
+    """時間割グリッドの1マス
+
+    リンク先・CSSクラス・バッジ・進捗率を組み立て時に決めておき、テンプレートでは
+    緊急度を何度も比較せずにそのまま出力する。セルの数だけ作られるので __slots__ で小さくする。
+    """
+    __slots__ = ('day', 'period', 'schedule', 'task_count', 'completed_count', 'urgency',
+                 'url', 'css_class', 'badge', 'progress')
+
+    def __init__(self, day, period, schedule=None, task_count=0, completed_count=0, urgency=None):
+        self.day = day
+        self.period = period
+        self.schedule = schedule
+        self.task_count = task_count
+        self.completed_count = completed_count
+        self.urgency = urgency
+        self.badge = URGENCY_BADGES.get(urgency)
+        if schedule is None:
+            self.url = reverse('schedule:create', kwargs={'day_pk': day.pk, 'period_pk': period.pk})
+            self.css_class = 'non-class'
+        else:
+            self.url = reverse('schedule:detail', kwargs={'pk': schedule.pk})
+            self.css_class = f'class-cell urgency-{urgency}' if urgency else 'class-cell'
+        # 進捗バーの幅（%）。タスクがなければ進捗欄を出さない (None)
+        if task_count or completed_count:
+            self.progress = round(completed_count * 100 / task_count) if task_count else 0
+        else:
+            self.progress = None
+
+
+class GridRow:
+    """時間割グリッドの1行（時限と、曜日順に並んだセル）"""
+    __slots__ = ('period', 'cells')
+
+    def __init__(self, period, cells):
+        self.period = period
+        self.cells = cells
+
+
+def fetch_course_task_stats(course_ids, today):
+    """授業ごとのタスク集計を Task から直接1クエリで取得する
+
+    グリッドは Course の集計値を使うので、これは集計値の検証 (rebuild_task_counters --check) 用。
+
+    戻り値は course_id をキーとした辞書で、各値は次のキーを持つ。
+    total / completed / incomplete: タスク件数
+    overdue / due_today / due_this_week: 未完了タスクの緊急度ごとの有無
+    next_due: 未完了タスクの最も早い期限日
+    urgency: 上記から判定した緊急度
+    """
+    next_week = today + timedelta(days=7)
+    incomplete = Q(is_completed=False)
+    rows = (
+        Task.objects.filter(course_id__in=course_ids)
+        .values('course_id')
+        .annotate(
+            total=Count('pk'),
+            completed=Count('pk', filter=Q(is_completed=True)),
+            overdue_count=Count('pk', filter=incomplete & Q(due_date__lt=today)),
+            today_count=Count('pk', filter=incomplete & Q(due_date=today)),
+            weekly_count=Count('pk', filter=incomplete & Q(due_date__gt=today, due_date__lte=next_week)),
+            next_due=Min('due_date', filter=incomplete),
+        )
+        .order_by()
+    )
+
+    stats = {}
+    for row in rows:
+        stats[row['course_id']] = {
+            'total': row['total'],
+            'completed': row['completed'],
+            'incomplete': row['total'] - row['completed'],
+            'overdue': row['overdue_count'] > 0,
+            'due_today': row['today_count'] > 0,
+            'due_this_week': row['weekly_count'] > 0,
+            'next_due': row['next_due'],
+            'urgency': get_urgency(row['next_due'], today, next_week),
+        }
+    return stats
+
+
+def time_table_querysets(user, timetable, show_all, with_todos=True):
+    """時間割画面に必要な (曜日, 時限, コマ, ToDo) のクエリセットを返す
+
+    4つは互いに依存しないので、非同期版では同時に実行できる。
+    with_todos=False のときは ToDo の代わりに None を返す（JSON API 用）。
+    """
+    schedules = Schedule.objects.filter(user=user, day__timetable=timetable, period__timetable=timetable)
+    todos = None
+    if with_todos:
+        todos = Task.objects.filter(course__in=schedules.values('course')).select_related('course')
+        if not show_all:
+            todos = todos.filter(is_completed=False)
+        # 1件多く読み、ToDo一覧へのリンクを出すかを判定する
+        todos = todos.order_by('is_completed', 'due_date', 'pk')[:TODO_PREVIEW_LIMIT + 1]
+    return (
+        Day.objects.filter(timetable=timetable).order_by('order', 'pk'),
+        Period.objects.filter(timetable=timetable).order_by('order', 'pk'),
+        schedules.select_related('course'),
+        todos,
+    )
+
+
+def assemble_time_table(days, periods, user_schedules, upcoming_todos, show_all, today):
+    """取得済みのデータから、時間割グリッド・進捗・ToDoリストをメモリ上で組み立てる"""
+    next_week = today + timedelta(days=7)
+
+    schedule_map = {(s.day_id, s.period_id): s for s in user_schedules}
+    # 授業ごとに、このユーザーの詳細画面へのリンク先となるコマ
+    schedule_by_course = {}
+    for s in user_schedules:
+        schedule_by_course.setdefault(s.course_id, s)
+    courses = [s.course for s in schedule_by_course.values()]
+
+    # グリッドデータの生成 (メモリ上で組み立てる)
+    # タスク件数と緊急度は Course の集計値 (task_total / task_completed / next_due_date) から求める
+    # テンプレートには行のリスト (grid_rows) を、JSON API などには曜日・時限からの辞書 (schedule_data) を渡す
+    schedule_data = {day.pk: {} for day in days}
+    grid_rows = []
+    for period in periods:
+        cells = []
+        for day in days:
+            schedule_obj = schedule_map.get((day.pk, period.pk))
+            if schedule_obj:
+                course = schedule_obj.course
+                cell = GridCell(
+                    day, period, schedule_obj,
+                    task_count=course.task_total if show_all else course.task_incomplete,
+                    completed_count=course.task_completed if show_all else 0,
+                    urgency=get_urgency(course.next_due_date, today, next_week),
+                )
+            else:
+                cell = GridCell(day, period)
+            schedule_data[day.pk][period.pk] = cell
+            cells.append(cell)
+        grid_rows.append(GridRow(period, cells))
+
+    # 全体の進捗計算 (グリッドと同じ集計値を合計する)
+    total_tasks = sum(course.task_total for course in courses)
+    completed_tasks = sum(course.task_completed for course in courses)
+
+    # 下部のToDoリスト（先頭の TODO_PREVIEW_LIMIT 件だけ）
+    upcoming_todos = upcoming_todos or []
+    more_todos = len(upcoming_todos) > TODO_PREVIEW_LIMIT
+    upcoming_todos = upcoming_todos[:TODO_PREVIEW_LIMIT]
+    for task in upcoming_todos:
+        task.urgency = None if task.is_completed else get_urgency(task.due_date, today, next_week)
+        task.schedule_pk = schedule_by_course[task.course_id].pk
+
+    return {
+        'days': days,
+        'periods': periods,
+        'schedule_data': schedule_data,
+        'grid_rows': grid_rows,
+        'total_timetable_tasks': total_tasks,
+        'completed_timetable_tasks': completed_tasks,
+        'upcoming_todos': upcoming_todos,
+        'more_todos': more_todos,
+    }
+
+
+def build_time_table(user, timetable, show_all, today, with_todos=True):
+    """時間割グリッドとToDoリストを、グリッドの大きさに依存しない固定回数のクエリで組み立てる
+
+    with_todos=False のときは下部のToDoリストを取得しない（JSON API 用）。
+    """
+    querysets = time_table_querysets(user, timetable, show_all, with_todos)
+    days, periods, schedules, todos = (None if qs is None else list(qs) for qs in querysets)
+    return assemble_time_table(days, periods, schedules, todos, show_all, today)
+
+
+async def alist(queryset):
+    """クエリセットを非同期で評価してリストにする（None はそのまま返す）"""
+    if queryset is None:
+        return None
+    return [obj async for obj in queryset]
+
+
+async def abuild_time_table(user, timetable, show_all, today, with_todos=True):
+    """build_time_table の非同期版（4つのクエリを asyncio.gather で同時に発行する）"""
+    querysets = time_table_querysets(user, timetable, show_all, with_todos)
+    days, periods, schedules, todos = await asyncio.gather(*(alist(qs) for qs in querysets))
+    return assemble_time_table(days, periods, schedules, todos, show_all, today)
+
+
+# --- JSON API 用のシリアライズ ---
+
+def _digest(value):
+    """JSONに変換できる値の短いハッシュ（差分検出とETag用）"""
+    encoded = json.dumps(value, ensure_ascii=False, sort_keys=True, separators=(',', ':'), default=str)
+    return hashlib.sha1(encoded.encode()).hexdigest()[:16]
+
+
+def cell_key(day_pk, period_pk):
+    return f'{day_pk}-{period_pk}'
+
+
+def serialize_time_table(user, timetable, show_all, today):
+    """時間割グリッドをJSON用の辞書にする
+
+    各セルには内容のハッシュ ('hash') を付け、全体の内容から計算した 'version' を返す。
+    内容が同じなら version も同じになるので、ETag と差分取得の基準に使える。
+    """
+    data = build_time_table(user, timetable, show_all, today, with_todos=False)
+    return serialize_grid(timetable, show_all, today, data)
+
+
+async def aserialize_time_table(user, timetable, show_all, today):
+    """serialize_time_table の非同期版"""
+    data = await abuild_time_table(user, timetable, show_all, today, with_todos=False)
+    return serialize_grid(timetable, show_all, today, data)
+
+
+def serialize_grid(timetable, show_all, today, data):
+    """組み立て済みの時間割グリッド (build_time_table の戻り値) をJSON用の辞書にする"""
+    cells = []
+    for period in data['periods']:
+        for day in data['days']:
+            cell = data['schedule_data'][day.pk][period.pk]
+            schedule_obj = cell.schedule
+            item = {
+                'key': cell_key(day.pk, period.pk),
+                'day': day.pk,
+                'period': period.pk,
+                'schedule': None,
+                'urgency': cell.urgency,
+                'task_count': cell.task_count,
+                'completed_count': cell.completed_count,
+            }
+            if schedule_obj:
+                course = schedule_obj.course
+                item['schedule'] = {
+                    'pk': schedule_obj.pk,
+                    'course': {'name': course.name, 'room': course.room, 'color': course.color},
+                }
+            item['hash'] = _digest(item)
+            cells.append(item)
+
+    payload = {
+        'timetable': timetable.pk,
+        'show_all': show_all,
+        'date': today.isoformat(),
+        'days': [{'pk': day.pk, 'name': day.name} for day in data['days']],
+        'periods': [
+            {'pk': period.pk, 'name': period.name,
+             'start_time': period.start_time.strftime('%H:%M'), 'end_time': period.end_time.strftime('%H:%M')}
+            for period in data['periods']
+        ],
+        'cells': cells,
+        'totals': {
+            'total': data['total_timetable_tasks'],
+            'completed': data['completed_timetable_tasks'],
+        },
+    }
+    payload['version'] = _digest({key: value for key, value in payload.items() if key != 'cells'}
+                                 | {'cells': [cell['hash'] for cell in cells]})
+    return payload
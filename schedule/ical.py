@@ -0,0 +1,243 @@
+# schedule/ical.py
+"""
+カレンダーアプリ購読用の iCalendar (.ics) フィード
+
+授業（Schedule × Period の開始・終了時刻）は毎週繰り返す予定として、
+未完了のToDo（Task の期限日）は終日の予定として出力する。
+カレンダーアプリはセッションを持たないので、URLに署名付きトークンを含めて認証する。
+トークンにはユーザーごとの鍵 (CalendarFeedKey) を含め、鍵を作り直すと古いURLは使えなくなる。
+"""
+
+import functools
+import zoneinfo
+from datetime import date, datetime, time, timedelta, timezone as dt_timezone
+
+from django.conf import settings
+from django.core import signing
+
+from .models import CalendarFeedKey, Day, Period, Schedule, Task, new_feed_key
+
+TOKEN_SALT = 'schedule.ical.feed'
+
+# カレンダーアプリに伝える再取得の間隔（多くのアプリはこれより短い間隔では取りに来ない）
+REFRESH_INTERVAL = 'PT1H'
+
+# .iterator() で一度に読む行数
+CHUNK_SIZE = 500
+
+# 曜日名の先頭の文字 -> weekday()（月曜日 = 0）
+WEEKDAYS = {
+    '月': 0, '火': 1, '水': 2, '木': 3, '金': 4, '土': 5, '日': 6,
+    'mon': 0, 'tue': 1, 'wed': 2, 'thu': 3, 'fri': 4, 'sat': 5, 'sun': 6,
+}
+RRULE_DAYS = ['MO', 'TU', 'WE', 'TH', 'FR', 'SA', 'SU']
+
+
+# --- 購読用トークン ---
+
+def feed_key(user_id):
+    """ユーザーの購読用の鍵を返す（なければ作る）"""
+    return CalendarFeedKey.objects.get_or_create(user_id=user_id)[0].key
+
+
+def rotate_feed_key(user_id):
+    """鍵を作り直し、そのユーザーのそれまでの購読URLをすべて無効にする（URLが漏れたとき用）"""
+    key = new_feed_key()
+    CalendarFeedKey.objects.update_or_create(user_id=user_id, defaults={'key': key})
+    return key
+
+
+def feed_token(timetable, key=None):
+    """時間割のフィードURL用の署名付きトークンを作る（鍵を作り直すか、SECRET_KEY を変えると無効になる）
+
+    複数の時間割のトークンを作るときは、feed_key() で取得した鍵を key に渡すとクエリが1回で済む。
+    """
+    if key is None:
+        key = feed_key(timetable.user_id)
+    return signing.dumps([timetable.user_id, timetable.pk, key], salt=TOKEN_SALT, compress=True)
+
+
+def read_feed_token(token):
+    """トークンから (ユーザーID, 時間割ID) を取り出す（不正なトークン・作り直す前の鍵なら None）"""
+    try:
+        user_id, timetable_pk, key = signing.loads(token, salt=TOKEN_SALT)
+    except (signing.BadSignature, TypeError, ValueError):
+        return None
+    if not CalendarFeedKey.objects.filter(user_id=user_id, key=key).exists():
+        return None
+    return user_id, timetable_pk
+
+
+# --- 日付の計算 ---
+
+def term_start(today):
+    """繰り返し予定の起点（今年度の4月1日）
+
+    フィードの内容が日によって変わらないよう、年度の間は同じ日付を使う。
+    """
+    return date(today.year if today.month >= 4 else today.year - 1, 4, 1)
+
+
+def day_weekday(day):
+    """曜日 (Day) を weekday() の値に変換する（名前で判別できなければ並び順から決める）"""
+    name = day.name.strip().lower()
+    for prefix in (name[:1], name[:3]):
+        if prefix in WEEKDAYS:
+            return WEEKDAYS[prefix]
+    return (day.order - 1) % 7
+
+
+# --- iCalendar の書式 ---
+
+def escape_text(value):
+    """TEXT 型の値をエスケープする (RFC 5545 3.3.11)"""
+    return (str(value).replace('\\', '\\\\').replace(';', '\\;').replace(',', '\\,')
+            .replace('\r\n', '\\n').replace('\n', '\\n'))
+
+
+def fold(line):
+    """75オクテットを超える行を折り返す (RFC 5545 3.1)。マルチバイト文字の途中では切らない"""
+    encoded = line.encode('utf-8')
+    if len(encoded) <= 75:
+        return line + '\r\n'
+    parts, current, size = [], [], 0
+    for char in line:
+        width = len(char.encode('utf-8'))
+        # 2行目以降は先頭に空白が付くので 74 オクテットまで
+        if size + width > (75 if not parts else 74):
+            parts.append(''.join(current))
+            current, size = [], 0
+        current.append(char)
+        size += width
+    parts.append(''.join(current))
+    return '\r\n '.join(parts) + '\r\n'
+
+
+def _local(dt):
+    return dt.strftime('%Y%m%dT%H%M%S')
+
+
+def _utc_offset(offset):
+    """UTC との差を UTC-OFFSET 型 (+0900 など) にする"""
+    minutes = int(offset.total_seconds()) // 60
+    sign = '-' if minutes < 0 else '+'
+    return f'{sign}{abs(minutes) // 60:02d}{abs(minutes) % 60:02d}'
+
+
+@functools.lru_cache(maxsize=8)
+def vtimezone(tzid, start):
+    """DTSTART;TZID= で参照するタイムゾーンの定義 (VTIMEZONE, RFC 5545 3.6.5) の行を返す
+
+    start（年度の初め）から2年分の UTC オフセットの切り替わりを1時間単位で調べ、
+    切り替わりごとに STANDARD / DAYLIGHT を出す。日本時間のように切り替わりがなければ1つだけになる。
+    """
+    tz = zoneinfo.ZoneInfo(tzid)
+    moment = datetime.combine(start, time.min, tzinfo=tz).astimezone(dt_timezone.utc)
+    end = moment + timedelta(days=365 * 2)
+
+    def observance(at, offset_from):
+        local = at.astimezone(tz)
+        kind = 'DAYLIGHT' if local.dst() else 'STANDARD'
+        return [
+            f'BEGIN:{kind}',
+            # 切り替わりの時刻は、切り替わる前の時刻で書く
+            f'DTSTART:{_local((at + offset_from).replace(tzinfo=None))}',
+            f'TZOFFSETFROM:{_utc_offset(offset_from)}',
+            f'TZOFFSETTO:{_utc_offset(local.utcoffset())}',
+            f'TZNAME:{local.tzname()}',
+            f'END:{kind}',
+        ]
+
+    offset = moment.astimezone(tz).utcoffset()
+    lines = ['BEGIN:VTIMEZONE', f'TZID:{tzid}', *observance(moment, offset)]
+    while moment < end:
+        moment += timedelta(hours=1)
+        current = moment.astimezone(tz).utcoffset()
+        if current != offset:
+            lines += observance(moment, offset)
+            offset = current
+    lines.append('END:VTIMEZONE')
+    return tuple(lines)
+
+
+# --- フィードの生成 ---
+
+def iter_calendar(timetable, host, stamp, today):
+    """フィードの内容を予定1件ずつ返すジェネレーター
+
+    曜日・時限は件数が少ないのでまとめて読み、授業とToDoは .iterator() で少しずつ読むので、
+    登録数が多くてもメモリ使用量は増えない。stamp（DTSTAMP）にはデータのバージョンの時刻を使う。
+    """
+    tzid = settings.TIME_ZONE
+    dtstamp = stamp.strftime('%Y%m%dT%H%M%SZ')
+    start = term_start(today)
+
+    yield ''.join(map(fold, [
+        'BEGIN:VCALENDAR',
+        'VERSION:2.0',
+        'PRODID:-//schedule//timetable feed//JA',
+        'CALSCALE:GREGORIAN',
+        'METHOD:PUBLISH',
+        f'X-WR-CALNAME:{escape_text(timetable.name)}',
+        f'X-WR-TIMEZONE:{tzid}',
+        f'REFRESH-INTERVAL;VALUE=DURATION:{REFRESH_INTERVAL}',
+        f'X-PUBLISHED-TTL:{REFRESH_INTERVAL}',
+        *vtimezone(tzid, start),
+    ]))
+
+    first_dates = {}
+    for day in Day.objects.filter(timetable=timetable):
+        weekday = day_weekday(day)
+        first_dates[day.pk] = (start + timedelta(days=(weekday - start.weekday()) % 7), RRULE_DAYS[weekday])
+    periods = {period.pk: period for period in Period.objects.filter(timetable=timetable)}
+
+    schedules = (
+        Schedule.objects.filter(user_id=timetable.user_id, day__timetable=timetable)
+        .select_related('course').order_by('pk')
+    )
+    for schedule in schedules.iterator(chunk_size=CHUNK_SIZE):
+        period = periods.get(schedule.period_id)
+        if period is None or schedule.day_id not in first_dates:
+            continue
+        first, byday = first_dates[schedule.day_id]
+        course = schedule.course
+        lines = [
+            'BEGIN:VEVENT',
+            f'UID:schedule-{schedule.pk}@{host}',
+            f'DTSTAMP:{dtstamp}',
+            f'DTSTART;TZID={tzid}:{_local(datetime.combine(first, period.start_time))}',
+            f'DTEND;TZID={tzid}:{_local(datetime.combine(first, period.end_time))}',
+            f'RRULE:FREQ=WEEKLY;BYDAY={byday}',
+            f'SUMMARY:{escape_text(course.name)}',
+        ]
+        if course.room:
+            lines.append(f'LOCATION:{escape_text(course.room)}')
+        description = '\n'.join(filter(None, [course.instructor, course.description]))
+        if description:
+            lines.append(f'DESCRIPTION:{escape_text(description)}')
+        lines.append('END:VEVENT')
+        yield ''.join(map(fold, lines))
+
+    # 授業と同じく、この時間割に登録されている授業の未完了ToDoだけを出す
+    tasks = (
+        Task.objects.filter(
+            course__in=Schedule.objects.filter(user_id=timetable.user_id, day__timetable=timetable).values('course'),
+            is_completed=False, due_date__isnull=False,
+        )
+        .select_related('course').order_by('due_date', 'pk')
+    )
+    for task in tasks.iterator(chunk_size=CHUNK_SIZE):
+        lines = [
+            'BEGIN:VEVENT',
+            f'UID:task-{task.pk}@{host}',
+            f'DTSTAMP:{dtstamp}',
+            f'DTSTART;VALUE=DATE:{task.due_date:%Y%m%d}',
+            f'DTEND;VALUE=DATE:{task.due_date + timedelta(days=1):%Y%m%d}',
+            f'SUMMARY:{escape_text(f"[{task.course.name}] {task.title}")}',
+        ]
+        if task.description:
+            lines.append(f'DESCRIPTION:{escape_text(task.description)}')
+        lines.append('END:VEVENT')
+        yield ''.join(map(fold, lines))
+
+    yield fold('END:VCALENDAR')
@@ -0,0 +1,524 @@
+# schedule/importer.py
+"""
+時間割の一括インポート（CSV / JSON）
+
+1行 = 1コマ（と、任意で1件のToDo）の形式のファイルを先頭から少しずつ読み、
+BATCH_SIZE 行ずつ検証して bulk_create でまとめて保存する。
+不正な行はエラーとして記録して読み飛ばし、ファイル全体は中断しない。
+
+列: day, period, name, instructor, room, color, description,
+    task_title, task_due_date, task_description, task_completed
+同じコマ（day, period）に同じ授業（name, instructor）が続く行は、ToDoだけを追加する。
+
+エクスポート（exporter.py）の出力は restore_file() で、時間割ごと新しく作り直して取り込む。
+"""
+
+import csv
+import gzip
+import io
+import json
+import zlib
+from datetime import date, time
+
+from django.core.exceptions import ValidationError
+from django.db import DatabaseError, transaction
+
+from .cache import bump_user_version
+from .forms import CourseForm, TaskForm
+from .exporter import EXPORT_VERSION
+from .models import Timetable, Day, Period, Course, Schedule, Task
+from .services import BULK_BATCH_SIZE, refresh_course_counters
+
+COLUMNS = [
+    'day', 'period', 'name', 'instructor', 'room', 'color', 'description',
+    'task_title', 'task_due_date', 'task_description', 'task_completed',
+]
+REQUIRED_COLUMNS = ['day', 'period', 'name', 'instructor']
+FORMATS = ['csv', 'json']
+
+# 一度に検証・保存する行数
+BATCH_SIZE = 500
+
+# 画面・レポートに残すエラーの最大件数（件数自体はすべて数える）
+MAX_REPORTED_ERRORS = 1000
+
+# JSON を読み込むときの1回の読み込み量（文字数）
+READ_CHUNK_SIZE = 64 * 1024
+
+# JSON の配列の要素1件の最大の大きさ（文字数）。読み足しても解析できないまま超えたら形式の誤りとする
+MAX_RECORD_SIZE = 1024 * 1024
+
+TRUE_VALUES = {'1', 'true', 'yes', 'y', 'on', '済', '完了'}
+
+
+class ImportFileError(ValueError):
+    """ファイル全体を読めないときのエラー（形式・文字コードの誤りなど）"""
+
+
+class RowError(ValueError):
+    """1行分の検証エラー"""
+
+
+class ImportReport:
+    """インポート結果（作成した件数と、行ごとのエラー）"""
+
+    def __init__(self):
+        self.rows = 0
+        self.timetables = 0
+        self.courses = 0
+        self.schedules = 0
+        self.tasks = 0
+        self.error_count = 0
+        self.errors = []
+
+    def add_error(self, line, message):
+        self.error_count += 1
+        if len(self.errors) < MAX_REPORTED_ERRORS:
+            self.errors.append((line, message))
+
+    @property
+    def ok(self):
+        return self.error_count == 0
+
+    def as_dict(self):
+        return {
+            'rows': self.rows, 'timetables': self.timetables, 'courses': self.courses,
+            'schedules': self.schedules, 'tasks': self.tasks,
+            'error_count': self.error_count,
+            'errors': [{'line': line, 'message': message} for line, message in self.errors],
+        }
+
+
+# --- ファイルの読み込み ---
+
+def detect_format(filename):
+    """ファイル名の拡張子から形式を決める（判別できなければ None）"""
+    name = filename.lower()
+    if name.endswith('.csv'):
+        return 'csv'
+    if name.endswith(('.json', '.jsonl', '.ndjson')):
+        return 'json'
+    return None
+
+
+def open_text(fileobj):
+    """バイナリのファイルを UTF-8（BOM 付きも可）のテキストとして読めるようにする"""
+    return io.TextIOWrapper(fileobj, encoding='utf-8-sig', newline='')
+
+
+def iter_csv(stream):
+    """CSV を1行ずつ (行番号, 辞書) で返す"""
+    reader = csv.DictReader(stream)
+    missing = [column for column in REQUIRED_COLUMNS if column not in (reader.fieldnames or [])]
+    if missing:
+        raise ImportFileError(f"CSV の1行目（見出し）に列がありません: {', '.join(missing)}")
+    for row in reader:
+        yield reader.line_num, row
+
+
+def iter_json(stream):
+    """JSON の配列、または JSON Lines を1件ずつ (番号, 値) で返す
+
+    配列もメモリに全部読み込まず、READ_CHUNK_SIZE ずつ読みながら要素を取り出す。
+    要素が途中で切れている場合は読み足すが、MAX_RECORD_SIZE を超えても解析できなければ、
+    残りを読まずに ImportFileError にする（壊れた要素1件でファイル全体を読み込まないように）。
+    """
+    decoder = json.JSONDecoder()
+    buffer, pos, eof = '', 0, False
+
+    def fill():
+        nonlocal buffer, pos, eof
+        chunk = stream.read(READ_CHUNK_SIZE)
+        eof = not chunk
+        buffer, pos = buffer[pos:] + chunk, 0
+
+    def skip(chars):
+        nonlocal pos
+        while True:
+            while pos < len(buffer) and buffer[pos] in chars:
+                pos += 1
+            if pos < len(buffer) or eof:
+                return
+            fill()
+
+    skip(' \t\r\n')
+    if pos >= len(buffer):
+        return
+    if buffer[pos] != '[':
+        # JSON Lines: 1行に1件
+        lines = io.StringIO(buffer[pos:]).readlines()
+        number = 0
+        for line in _chain_lines(lines, stream):
+            number += 1
+            if line.strip():
+                try:
+                    yield number, json.loads(line)
+                except json.JSONDecodeError as e:
+                    raise ImportFileError(f'{number}行目: JSON の形式が正しくありません ({e.msg})') from e
+        return
+
+    pos += 1
+    number = 0
+    while True:
+        skip(' \t\r\n,')
+        if pos >= len(buffer):
+            raise ImportFileError('JSON の配列が閉じられていません')
+        if buffer[pos] == ']':
+            return
+        try:
+            value, end = decoder.raw_decode(buffer, pos)
+        except json.JSONDecodeError as e:
+            if eof or len(buffer) - pos > MAX_RECORD_SIZE:
+                raise ImportFileError(f'{number + 1}件目: JSON の形式が正しくありません ({e.msg})') from e
+            fill()
+            continue
+        number += 1
+        pos = end
+        yield number, value
+
+
+def _chain_lines(lines, stream):
+    """先読みした行の続きを、ストリームから1行ずつ読む"""
+    if lines and not lines[-1].endswith('\n'):
+        # 先読みの最後の行は途中で切れているので、ストリームの次の行とつなげる
+        lines[-1] += stream.readline()
+    yield from lines
+    yield from stream
+
+
+def iter_rows(stream, fmt):
+    if fmt == 'csv':
+        return iter_csv(stream)
+    if fmt == 'json':
+        return iter_json(stream)
+    raise ImportFileError(f'対応していない形式です: {fmt}')
+
+
+# --- 検証と保存 ---
+
+def refresh_counters_in_batches(course_ids, batch_size):
+    """授業の集計値を batch_size 件ずつ更新する（1回の UPDATE で多くの行をロックしないように）"""
+    course_ids = list(course_ids)
+    for i in range(0, len(course_ids), batch_size):
+        refresh_course_counters(*course_ids[i:i + batch_size])
+
+
+def _form_errors(form):
+    return ' / '.join(
+        f"{form.fields[field].label if field in form.fields else field}: {' '.join(messages)}"
+        for field, messages in form.errors.items()
+    )
+
+
+class TimetableImporter:
+    """1つの時間割へのインポート
+
+    曜日・時限は名前 -> 主キーの辞書に、既存のコマは (曜日, 時限) -> 授業 の辞書に最初に読み込み、
+    行ごとの検証ではDBに問い合わせない。授業の重複判定は schedule_create_view と同じく
+    「授業名と担当教員が同じなら同じ授業」とし、この時間割に登録済みの授業だけを対象にする。
+    """
+
+    def __init__(self, user, timetable, batch_size=BATCH_SIZE):
+        self.user = user
+        self.timetable = timetable
+        self.batch_size = batch_size
+        self.report = ImportReport()
+        self.touched_courses = set()
+        self.days = dict(Day.objects.filter(timetable=timetable).values_list('name', 'pk'))
+        self.periods = dict(Period.objects.filter(timetable=timetable).values_list('name', 'pk'))
+        self.load_slots()
+
+    def load_slots(self):
+        """登録済みのコマと授業を読み込む"""
+        self.slots, self.course_ids = {}, {}
+        rows = Schedule.objects.filter(user=self.user, day__timetable=self.timetable).values_list(
+            'day_id', 'period_id', 'course_id', 'course__name', 'course__instructor')
+        for day_id, period_id, course_id, name, instructor in rows:
+            self.slots[day_id, period_id] = (name, instructor)
+            self.course_ids[name, instructor] = course_id
+
+    def run(self, rows):
+        """(行番号, 値) のイテレーターを最後まで取り込み、結果を返す"""
+        batch = []
+        try:
+            try:
+                for row in rows:
+                    batch.append(row)
+                    if len(batch) >= self.batch_size:
+                        self.import_batch(batch)
+                        batch = []
+            except (ImportFileError, UnicodeDecodeError, csv.Error) as e:
+                # ファイルの途中で読めなくなった場合は、それまでに読めた行だけを取り込んで終了する
+                self.report.add_error(
+                    None, str(e) if isinstance(e, ImportFileError) else f'ファイルを読み込めません ({e})')
+            if batch:
+                self.import_batch(batch)
+        finally:
+            refresh_counters_in_batches(self.touched_courses, self.batch_size)
+            # bulk_create はシグナルを送らないので、キャッシュはここで無効にする
+            bump_user_version(self.user.pk)
+        return self.report
+
+    def clean_row(self, raw):
+        """1行を検証し、(コマ, 授業のキー, 未保存の Course, 未保存の Task または None) を返す"""
+        if not isinstance(raw, dict):
+            raise RowError('行の形式が正しくありません')
+        values = {column: str(raw.get(column) if raw.get(column) is not None else '').strip() for column in COLUMNS}
+
+        day_id = self.days.get(values['day'])
+        if day_id is None:
+            raise RowError(f"曜日「{values['day']}」はこの時間割にありません")
+        period_id = self.periods.get(values['period'])
+        if period_id is None:
+            raise RowError(f"時限「{values['period']}」はこの時間割にありません")
+
+        course_form = CourseForm({
+            'name': values['name'], 'instructor': values['instructor'], 'room': values['room'],
+            'description': values['description'],
+            'color': values['color'] or Course._meta.get_field('color').default,
+        })
+        if not course_form.is_valid():
+            raise RowError(_form_errors(course_form))
+        course = course_form.save(commit=False)
+
+        task = None
+        if values['task_title'] or values['task_due_date'] or values['task_description']:
+            task_form = TaskForm({
+                'title': values['task_title'], 'due_date': values['task_due_date'],
+                'description': values['task_description'],
+                'is_completed': values['task_completed'].lower() in TRUE_VALUES,
+            })
+            if not task_form.is_valid():
+                raise RowError(_form_errors(task_form))
+            task = task_form.save(commit=False)
+
+        return (day_id, period_id), (course.name, course.instructor), course, task
+
+    def import_batch(self, batch):
+        """まとまり1つ分の行を検証し、1つのトランザクションで保存する"""
+        new_courses, new_schedules, new_tasks = {}, [], []
+        accepted = 0
+        for line, raw in batch:
+            try:
+                slot, key, course, task = self.clean_row(raw)
+            except RowError as e:
+                self.report.add_error(line, str(e))
+                continue
+
+            occupied = self.slots.get(slot)
+            if occupied is not None and occupied != key:
+                self.report.add_error(line, f'このコマには既に「{occupied[0]}」が登録されています')
+                continue
+            if occupied is None:
+                self.slots[slot] = key
+                new_schedules.append((slot, key))
+            if key not in self.course_ids and key not in new_courses:
+                new_courses[key] = course
+            if task is not None:
+                new_tasks.append((key, task))
+            accepted += 1
+
+        first_line, last_line = batch[0][0], batch[-1][0]
+        try:
+            with transaction.atomic():
+                created = Course.objects.bulk_create(new_courses.values(), batch_size=BULK_BATCH_SIZE)
+                course_ids = {**self.course_ids, **{key: course.pk for key, course in zip(new_courses, created)}}
+                Schedule.objects.bulk_create([
+                    Schedule(user=self.user, course_id=course_ids[key], day_id=day_id, period_id=period_id)
+                    for (day_id, period_id), key in new_schedules
+                ], batch_size=BULK_BATCH_SIZE)
+                for key, task in new_tasks:
+                    task.course_id = course_ids[key]
+                Task.objects.bulk_create([task for _, task in new_tasks], batch_size=BULK_BATCH_SIZE)
+        except DatabaseError as e:
+            # 同時に別の登録があった場合など。このまとまりは保存せず、状態を読み込み直して続ける
+            self.load_slots()
+            self.report.add_error(first_line, f'{first_line}〜{last_line}行目を保存できませんでした ({e})')
+            return
+
+        self.course_ids = course_ids
+        self.touched_courses.update(course_ids[key] for key, _ in new_tasks)
+        self.report.rows += accepted
+        self.report.courses += len(created)
+        self.report.schedules += len(new_schedules)
+        self.report.tasks += len(new_tasks)
+
+
+def import_file(user, timetable, fileobj, fmt, batch_size=BATCH_SIZE):
+    """バイナリのファイルを読み込んで時間割に取り込み、ImportReport を返す"""
+    stream = open_text(fileobj)
+    try:
+        return TimetableImporter(user, timetable, batch_size=batch_size).run(iter_rows(stream, fmt))
+    finally:
+        # TextIOWrapper を閉じると元のファイルも閉じられるので、切り離しておく
+        stream.detach()
+
+
+# --- エクスポートからの復元 ---
+
+GZIP_MAGIC = b'\x1f\x8b'
+
+
+def _peek(fileobj, size):
+    """ファイルの先頭を、読み込み位置を変えずに返す"""
+    if hasattr(fileobj, 'peek'):
+        return fileobj.peek(size)[:size]
+    head = fileobj.read(size)
+    fileobj.seek(0)
+    return head
+
+
+def is_export(fileobj):
+    """exporter.py で書き出したファイル（gzip 圧縮を含む）かどうか"""
+    head = _peek(fileobj, 64)
+    return head.startswith(GZIP_MAGIC) or b'"model":"export"' in head
+
+
+# 復元するレコードの検証で除外する項目（付け替えた主キーで、存在の確認にクエリが要るため）
+RELATION_FIELDS = ['user', 'timetable', 'course', 'day', 'period']
+
+
+class DatasetRestorer:
+    """エクスポートの内容を、新しい主キーに付け替えながらユーザーのデータとして作り直す
+
+    レコードはモデルごと（参照される側から）に並んでいるので、同じモデルが続く間は
+    まとめて bulk_create する。付け替え用に保持するのは Task 以外の主キーの対応だけ。
+    同じ名前の時間割が既にあれば、名前の後ろに番号を付ける。
+    各レコードは clean_fields() で検証し（文字数・必須・選択肢）、不正なものは行のエラーにする。
+    """
+
+    def __init__(self, user, batch_size=BATCH_SIZE):
+        self.user = user
+        self.batch_size = batch_size
+        self.report = ImportReport()
+        self.id_maps = {'timetable': {}, 'day': {}, 'period': {}, 'course': {}}
+        self.pending_model, self.pending = None, []
+        self.timetable_names = set(Timetable.objects.filter(user=user).values_list('name', flat=True))
+        self.has_default = Timetable.objects.filter(user=user, is_default=True).exists()
+
+    def run(self, rows):
+        """(行番号, レコード) のイテレーターを取り込む。ファイルが壊れていた場合は何も保存しない"""
+        with transaction.atomic():
+            try:
+                for line, record in rows:
+                    # 参照先の主キーを付け替えられるよう、モデルが変わる前に保存しておく
+                    model = record.get('model') if isinstance(record, dict) else None
+                    if model != self.pending_model or len(self.pending) >= self.batch_size:
+                        self.flush()
+                    try:
+                        model, old_id, obj = self.build(record)
+                    except ImportFileError:
+                        raise
+                    except (RowError, KeyError, TypeError, ValueError) as e:
+                        message = str(e) if isinstance(e, RowError) else f'値が正しくありません ({e!r})'
+                        self.report.add_error(line, message)
+                        continue
+                    if obj is None:
+                        continue
+                    self.pending_model = model
+                    self.pending.append((old_id, obj))
+                self.flush()
+            # 圧縮データが壊れている場合の zlib.error は OSError ではないので、別に捕まえる
+            except (ImportFileError, UnicodeDecodeError, EOFError, OSError, zlib.error) as e:
+                return self.abort(f'ファイルを最後まで読み込めませんでした ({e})')
+            except DatabaseError as e:
+                # 検証を通っても保存できなかった場合（曜日の順番の重複など）
+                return self.abort(f'データを保存できませんでした ({e})')
+
+        refresh_counters_in_batches(self.id_maps['course'].values(), self.batch_size)
+        bump_user_version(self.user.pk)
+        return self.report
+
+    def abort(self, message):
+        """途中までの復元は残さずに終える（バックアップが欠けていることに気づけるように）"""
+        transaction.set_rollback(True)
+        errors = self.report.errors
+        self.report = ImportReport()
+        self.report.errors, self.report.error_count = errors, len(errors)
+        self.report.add_error(None, message)
+        return self.report
+
+    def new_id(self, model, old_id):
+        try:
+            return self.id_maps[model][old_id]
+        except KeyError:
+            raise RowError(f'参照先の{model} (id={old_id}) がファイルにありません') from None
+
+    def timetable_name(self, name):
+        candidate, number = name, 1
+        while candidate in self.timetable_names:
+            number += 1
+            candidate = f'{name} ({number})'
+        self.timetable_names.add(candidate)
+        return candidate
+
+    def build(self, record):
+        """レコード1件から (モデル名, 元の主キー, 未保存のオブジェクト) を作る"""
+        if not isinstance(record, dict):
+            raise RowError('行の形式が正しくありません')
+        model = record.get('model')
+        if model == 'export':
+            if record.get('version') != EXPORT_VERSION:
+                raise ImportFileError(f"対応していないエクスポートの形式です (version={record.get('version')})")
+            return model, None, None
+
+        if model == 'timetable':
+            is_default = bool(record['is_default']) and not self.has_default
+            self.has_default = self.has_default or is_default
+            obj = Timetable(user=self.user, name=self.timetable_name(record['name']), is_default=is_default)
+        elif model == 'day':
+            obj = Day(timetable_id=self.new_id('timetable', record['timetable']),
+                      name=record['name'], order=record['order'])
+        elif model == 'period':
+            obj = Period(timetable_id=self.new_id('timetable', record['timetable']),
+                         name=record['name'], order=record['order'],
+                         start_time=time.fromisoformat(record['start_time']),
+                         end_time=time.fromisoformat(record['end_time']))
+        elif model == 'course':
+            obj = Course(name=record['name'], instructor=record['instructor'],
+                         description=record.get('description') or '', room=record.get('room') or '',
+                         color=record.get('color') or Course._meta.get_field('color').default)
+        elif model == 'schedule':
+            obj = Schedule(user=self.user, course_id=self.new_id('course', record['course']),
+                           day_id=self.new_id('day', record['day']),
+                           period_id=self.new_id('period', record['period']))
+        elif model == 'task':
+            due_date = record.get('due_date')
+            obj = Task(course_id=self.new_id('course', record['course']), title=record['title'],
+                       description=record.get('description'),
+                       due_date=date.fromisoformat(due_date) if due_date else None,
+                       is_completed=bool(record.get('is_completed')))
+        else:
+            raise RowError(f'不明なモデルです: {model}')
+        try:
+            obj.clean_fields(exclude=RELATION_FIELDS)
+        except ValidationError as e:
+            raise RowError(' / '.join(
+                f"{obj._meta.get_field(field).verbose_name}: {' '.join(messages)}"
+                for field, messages in e.message_dict.items()
+            )) from None
+        return model, record.get('id'), obj
+
+    def flush(self):
+        if not self.pending:
+            return
+        model = self.pending_model
+        created = type(self.pending[0][1]).objects.bulk_create(
+            [obj for _, obj in self.pending], batch_size=BULK_BATCH_SIZE)
+        if model in self.id_maps:
+            self.id_maps[model].update((old_id, obj.pk) for (old_id, _), obj in zip(self.pending, created))
+        self.report.rows += len(created)
+        if model in ('timetable', 'course', 'schedule', 'task'):
+            setattr(self.report, f'{model}s', getattr(self.report, f'{model}s') + len(created))
+        self.pending = []
+
+
+def restore_file(user, fileobj, batch_size=BATCH_SIZE):
+    """エクスポートしたファイル（NDJSON / gzip）を読み込んでユーザーのデータとして復元し、ImportReport を返す"""
+    if _peek(fileobj, 2) == GZIP_MAGIC:
+        fileobj = gzip.GzipFile(fileobj=fileobj, mode='rb')
+    stream = open_text(fileobj)
+    try:
+        return DatasetRestorer(user, batch_size=batch_size).run(iter_json(stream))
+    finally:
+        stream.detach()
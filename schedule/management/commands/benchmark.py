@@ -0,0 +1,83 @@
+import json
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+
+from schedule.benchmark import (
+    ASYNC_URL_NAMES, compare_reports, generate_dataset, isolated_cache, measure_compression, measure_render,
+    run_benchmark, run_load_comparison, url_names,
+)
+
+
+class Command(BaseCommand):
+    help = '合成データでURLごとのクエリ数・レイテンシ・ピークメモリを計測し、JSONレポートを出力する'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--timetables', type=int, default=2, help='時間割の数')
+        parser.add_argument('--days', type=int, default=6, help='時間割ごとの曜日の数')
+        parser.add_argument('--periods', type=int, default=5, help='時間割ごとの時限の数')
+        parser.add_argument('--courses', type=int, default=20, help='授業の数（コマ数が上限）')
+        parser.add_argument('--tasks', type=int, default=2000, help='タスクの総数')
+        parser.add_argument('--seed', type=int, default=0, help='乱数のシード（同じ値なら同じデータになる）')
+        parser.add_argument('--repeat', type=int, default=5, help='URLごとの計測回数')
+        parser.add_argument('--warm', action='store_true', help='キャッシュを温めた状態で計測する（既定はキャッシュなし）')
+        parser.add_argument('--url', action='append', dest='urls', choices=url_names(), help='計測するURL名（複数指定可）')
+        parser.add_argument('--output', help='JSONレポートの出力先（省略時は標準出力）')
+        parser.add_argument('--compare', help='比較対象の（以前の）JSONレポート')
+        parser.add_argument('--max-latency-regression', type=float, default=None,
+                            help='レイテンシ中央値の許容増加率（例: 0.25）。省略時はクエリ数のみ比較する')
+        parser.add_argument('--load', action='store_true',
+                            help='ASGI 経由で同期版と非同期版のビュー (%s) に同時にリクエストを送って比較する' % ', '.join(ASYNC_URL_NAMES))
+        parser.add_argument('--concurrency', type=int, default=10, help='--load の同時リクエスト数')
+        parser.add_argument('--requests', type=int, default=200, help='--load のURLごとのリクエスト数')
+        parser.add_argument('--render', action='store_true',
+                            help='時間割画面のテンプレートの描画時間を、cached.Loader・断片キャッシュの有無で比較して計測する')
+        parser.add_argument('--compression', action='store_true',
+                            help='圧縮なし・テンプレートの空白の除去・gzip・Brotli でのレスポンスのバイト数とレイテンシを比較する')
+        parser.add_argument('--keepdb', action='store_true', help='テスト用データベースを削除せずに残す')
+
+    def handle(self, *args, **options):
+        baseline = None
+        if options['compare']:
+            with open(options['compare'], encoding='utf-8') as f:
+                baseline = json.load(f)
+
+        # 本番のデータベース・キャッシュを汚さないよう、テスト用データベースと専用のキャッシュで計測する
+        old_name = connection.creation.create_test_db(verbosity=0, autoclobber=True, keepdb=options['keepdb'])
+        try:
+            with isolated_cache():
+                samples = generate_dataset(
+                    timetables=options['timetables'], days=options['days'], periods=options['periods'],
+                    courses=options['courses'], tasks=options['tasks'], seed=options['seed'],
+                )
+                report = run_benchmark(samples, repeat=options['repeat'], warm=options['warm'], names=options['urls'])
+                if options['load']:
+                    report['load'] = run_load_comparison(
+                        samples, concurrency=options['concurrency'], requests=options['requests'], warm=options['warm'])
+                if options['render']:
+                    report['render'] = measure_render(samples, repeat=options['repeat'] * 4)
+                if options['compression']:
+                    report['compression'] = measure_compression(samples, repeat=options['repeat'] * 2)
+        finally:
+            connection.creation.destroy_test_db(old_name, verbosity=0, keepdb=options['keepdb'])
+
+        report['meta']['dataset'] = {
+            key: options[key] for key in ('timetables', 'days', 'periods', 'courses', 'tasks', 'seed')
+        }
+        output = json.dumps(report, ensure_ascii=False, indent=2, sort_keys=True)
+        if options['output']:
+            with open(options['output'], 'w', encoding='utf-8') as f:
+                f.write(output + '\n')
+        else:
+            self.stdout.write(output)
+
+        for name in report['skipped']:
+            self.stderr.write(self.style.WARNING(f'{name}: schedule/benchmark.py の URL_KWARGS に未登録のため計測していません'))
+
+        if baseline is not None:
+            if baseline.get('meta', {}).get('dataset') != report['meta']['dataset']:
+                self.stderr.write(self.style.WARNING('データセットの条件が比較対象のレポートと異なります'))
+            regressions = compare_reports(baseline, report, options['max_latency_regression'])
+            if regressions:
+                raise CommandError('性能が退行しています:\n' + '\n'.join(regressions))
+            self.stderr.write(self.style.SUCCESS('比較対象のレポートから退行はありません'))
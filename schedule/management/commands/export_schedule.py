@@ -0,0 +1,34 @@
+import sys
+
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand, CommandError
+
+from schedule.exporter import CHUNK_SIZE, iter_export
+
+
+class Command(BaseCommand):
+    help = 'ユーザーの時間割・授業・ToDoを NDJSON（または gzip 圧縮）で書き出す（import_schedule で復元できる）'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--user', required=True, help='書き出すユーザー名')
+        parser.add_argument('--output', help='出力先のファイル（省略時は標準出力。.gz で終わる場合は gzip 圧縮する）')
+        parser.add_argument('--gzip', action='store_true', help='gzip 圧縮して書き出す')
+        parser.add_argument('--chunk-size', type=int, default=CHUNK_SIZE, help='1回のクエリで読む行数')
+
+    def handle(self, *args, **options):
+        user = User.objects.filter(username=options['user']).first()
+        if user is None:
+            raise CommandError(f"ユーザーが見つかりません: {options['user']}")
+
+        output = options['output']
+        compress = options['gzip'] or bool(output and output.endswith('.gz'))
+        chunks = iter_export(user, compress=compress, chunk_size=options['chunk_size'])
+
+        # 読み込んだ分から順に書き出すので、データ量が増えてもメモリ使用量は変わらない
+        if output:
+            with open(output, 'wb') as f:
+                f.writelines(chunks)
+            self.stderr.write(self.style.SUCCESS(f'{output} に書き出しました'))
+        else:
+            sys.stdout.buffer.writelines(chunks)
+            sys.stdout.buffer.flush()
@@ -0,0 +1,95 @@
+import json
+import sys
+
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand, CommandError
+from django.db import transaction
+
+from schedule.importer import BATCH_SIZE, FORMATS, detect_format, import_file, is_export, restore_file
+from schedule.models import Timetable
+from schedule.services import create_default_structure
+
+
+class Command(BaseCommand):
+    help = ('CSV / JSON ファイルから授業とToDoを時間割に一括登録する（複数のユーザーにまとめて登録できる）。'
+            'export_schedule で書き出したファイルを指定した場合は、時間割ごと復元する')
+
+    def add_arguments(self, parser):
+        parser.add_argument('path', help="読み込むファイル（'-' で標準入力）")
+        parser.add_argument('--user', action='append', dest='usernames', required=True,
+                            help='登録先のユーザー名（複数指定可。ユーザーごとに別の授業として登録する）')
+        parser.add_argument('--timetable',
+                            help='登録先の時間割名（なければデフォルトの曜日・時限で作成する）。復元の場合は不要')
+        parser.add_argument('--format', choices=FORMATS, help='ファイルの形式（省略時は拡張子から判別する）')
+        parser.add_argument('--batch-size', type=int, default=BATCH_SIZE, help='一度に検証・保存する行数')
+        parser.add_argument('--report', help='結果をJSONで書き出すファイル')
+
+    def handle(self, *args, **options):
+        path = options['path']
+        if path != '-':
+            with open(path, 'rb') as f:
+                if is_export(f):
+                    return self.restore(path, options)
+        if not options['timetable']:
+            raise CommandError('--timetable を指定してください')
+
+        fmt = options['format'] or (None if path == '-' else detect_format(path))
+        if fmt is None:
+            raise CommandError('ファイルの形式を判別できません。--format を指定してください')
+        if path == '-' and len(options['usernames']) > 1:
+            raise CommandError('標準入力から読み込む場合、--user は1人だけ指定できます')
+
+        reports = {}
+        for user in self.get_users(options['usernames']):
+            timetable = self.get_timetable(user, options['timetable'])
+            if path == '-':
+                report = import_file(user, timetable, sys.stdin.buffer, fmt, options['batch_size'])
+            else:
+                with open(path, 'rb') as f:
+                    report = import_file(user, timetable, f, fmt, options['batch_size'])
+            reports[user.username] = report.as_dict()
+            self.write_report(user.username, report)
+        self.save_reports(reports, options)
+
+    def restore(self, path, options):
+        """export_schedule の出力から、ユーザーごとに時間割を作り直す"""
+        reports = {}
+        for user in self.get_users(options['usernames']):
+            with open(path, 'rb') as f:
+                report = restore_file(user, f, options['batch_size'])
+            reports[user.username] = report.as_dict()
+            self.write_report(user.username, report, f'時間割 {report.timetables} 件・')
+        self.save_reports(reports, options)
+
+    def get_users(self, usernames):
+        users = {user.username: user for user in User.objects.filter(username__in=usernames)}
+        missing = [name for name in usernames if name not in users]
+        if missing:
+            raise CommandError(f"ユーザーが見つかりません: {', '.join(missing)}")
+        return [users[name] for name in usernames]
+
+    def write_report(self, username, report, prefix=''):
+        style = self.style.SUCCESS if report.ok else self.style.WARNING
+        self.stdout.write(style(
+            f'{username}: {report.rows} 行を取り込みました（{prefix}授業 {report.courses} 件・'
+            f'コマ {report.schedules} 件・ToDo {report.tasks} 件）／ エラー {report.error_count} 件'
+        ))
+        for line, message in report.errors[:20]:
+            self.stdout.write(f"  {f'{line}行目: ' if line else ''}{message}")
+        if report.error_count > 20:
+            self.stdout.write(f'  ...ほか {report.error_count - 20} 件')
+
+    def save_reports(self, reports, options):
+        if options['report']:
+            with open(options['report'], 'w', encoding='utf-8') as f:
+                json.dump(reports, f, ensure_ascii=False, indent=2)
+
+    @transaction.atomic
+    def get_timetable(self, user, name):
+        timetable = Timetable.objects.filter(user=user, name=name).first()
+        if timetable is None:
+            is_default = not Timetable.objects.filter(user=user, is_default=True).exists()
+            timetable = Timetable.objects.create(user=user, name=name, is_default=is_default)
+            create_default_structure(timetable)
+            self.stdout.write(f'{user.username}: 時間割「{name}」を作成しました')
+        return timetable
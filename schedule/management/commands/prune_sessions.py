@@ -0,0 +1,20 @@
+import json
+
+from django.core.management.base import BaseCommand
+
+from config.sessions import PRUNE_BATCH_SIZE, prune_expired, session_metrics
+
+
+class Command(BaseCommand):
+    help = ('期限切れのセッションの行を少しずつ削除し、削除後のセッションの行数・データの大きさを報告する'
+            '（cron などで定期的に実行する。Cookie・キャッシュに保存する設定では何もしない）')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=PRUNE_BATCH_SIZE, help='1回の DELETE で削除する行数')
+        parser.add_argument('--stats', action='store_true', help='削除せず、セッションの状態だけをJSONで出力する')
+
+    def handle(self, *args, **options):
+        if not options['stats']:
+            deleted = prune_expired(options['batch_size'])
+            self.stdout.write(self.style.SUCCESS(f'期限切れのセッションを {deleted} 件削除しました'))
+        self.stdout.write(json.dumps(session_metrics(), ensure_ascii=False, default=str))
@@ -0,0 +1,57 @@
+from django.core.management.base import BaseCommand, CommandError
+from django.utils import timezone
+
+from schedule.cache import bump_user_version
+from schedule.grid import fetch_course_task_stats
+from schedule.models import Course, Schedule
+from schedule.services import refresh_course_counters
+
+
+class Command(BaseCommand):
+    help = '授業ごとのタスク集計値 (task_total / task_completed / next_due_date) を Task から作り直す'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=500, help='1回の UPDATE で扱う授業の数')
+        parser.add_argument('--check', action='store_true',
+                            help='更新せず、集計値がずれている授業の数だけを報告する（ずれがあればエラー終了）')
+
+    def handle(self, *args, **options):
+        batch_size = options['batch_size']
+        today = timezone.localdate()
+        checked = drifted = 0
+
+        batch = []
+        course_ids = Course.objects.order_by('pk').values_list('pk', flat=True).iterator(chunk_size=batch_size)
+        for course_id in course_ids:
+            batch.append(course_id)
+            if len(batch) >= batch_size:
+                drifted += self.process(batch, today, options['check'])
+                checked += len(batch)
+                batch = []
+        if batch:
+            drifted += self.process(batch, today, options['check'])
+            checked += len(batch)
+
+        if options['check']:
+            if drifted:
+                raise CommandError(f'{checked} 件中 {drifted} 件の授業の集計値がずれています')
+            self.stdout.write(self.style.SUCCESS(f'{checked} 件の授業の集計値はすべて正しい値です'))
+            return
+
+        # 集計値が変わった可能性があるので、時間割を持つユーザーのキャッシュを無効にする
+        user_ids = Schedule.objects.order_by().values_list('user_id', flat=True).distinct()
+        bump_user_version(*user_ids)
+        self.stdout.write(self.style.SUCCESS(f'{checked} 件の授業の集計値を作り直しました（ずれていたもの: {drifted} 件）'))
+
+    def process(self, course_ids, today, check_only):
+        """授業のまとまりを検証し（必要なら更新し）、ずれていた件数を返す"""
+        stats = fetch_course_task_stats(course_ids, today)
+        drifted = 0
+        for course in Course.objects.filter(pk__in=course_ids).only('task_total', 'task_completed', 'next_due_date'):
+            expected = stats.get(course.pk, {'total': 0, 'completed': 0, 'next_due': None})
+            actual = (course.task_total, course.task_completed, course.next_due_date)
+            if actual != (expected['total'], expected['completed'], expected['next_due']):
+                drifted += 1
+        if not check_only:
+            refresh_course_counters(*course_ids)
+        return drifted
@@ -0,0 +1,272 @@
+# schedule/middleware.py
+
+import json
+import logging
+import time
+from collections import Counter
+from contextvars import ContextVar
+
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction, sync_to_async
+
+from django.conf import settings
+from django.core.exceptions import MiddlewareNotUsed
+from django.db import connections
+from django.utils.cache import patch_vary_headers
+from django.utils.deprecation import MiddlewareMixin
+from django.utils.text import compress_string
+
+try:
+    import brotli
+except ImportError:  # Brotli がなければ gzip だけを使う
+    brotli = None
+
+logger = logging.getLogger('schedule.performance')
+
+# 処理中のリクエストの計測値（スレッド・非同期タスクごとに分かれる）
+_current_stats = ContextVar('schedule_request_stats', default=None)
+
+
+class RequestStats:
+    """1リクエスト分のSQL・テンプレートの計測値"""
+
+    def __init__(self):
+        self.queries = 0
+        self.db_ms = 0.0
+        self.template_ms = 0.0
+        self.statements = Counter()
+
+    def record_query(self, execute, sql, params, many, context):
+        start = time.perf_counter()
+        try:
+            return execute(sql, params, many, context)
+        finally:
+            self.db_ms += (time.perf_counter() - start) * 1000
+            self.queries += 1
+            # パラメータを含まないSQLで数えるので、N+1 のような重複がまとまって見える
+            self.statements[sql] += 1
+
+    def duplicates(self, limit=3):
+        return [
+            {'sql': sql[:300], 'count': count}
+            for sql, count in self.statements.most_common(limit) if count > 1
+        ]
+
+
+def _record_query(execute, sql, params, many, context):
+    """計測中のリクエストがあれば、そのリクエストのクエリとして数える"""
+    stats = _current_stats.get()
+    if stats is None:
+        return execute(sql, params, many, context)
+    return stats.record_query(execute, sql, params, many, context)
+
+
+def _install_query_recorder():
+    """今のスレッドのDB接続に _record_query を登録する（登録済みなら何もしない）
+
+    接続はスレッドごとに別のオブジェクトなので、ORM を実行するスレッドで呼ぶ必要がある。
+    """
+    for connection in connections.all():
+        if _record_query not in connection.execute_wrappers:
+            connection.execute_wrappers.append(_record_query)
+
+
+_template_timer_installed = False
+
+
+def _install_template_timer():
+    """Djangoテンプレートの描画時間を計測できるようにする（一度だけ）"""
+    global _template_timer_installed
+    if _template_timer_installed:
+        return
+    from django.template.backends.django import Template
+
+    original_render = Template.render
+
+    def render(self, context=None, request=None):
+        stats = _current_stats.get()
+        if stats is None:
+            return original_render(self, context, request)
+        start = time.perf_counter()
+        try:
+            return original_render(self, context, request)
+        finally:
+            stats.template_ms += (time.perf_counter() - start) * 1000
+
+    Template.render = render
+    _template_timer_installed = True
+
+
+class PerformanceMiddleware:
+    """リクエストごとのクエリ数・DB時間・テンプレート描画時間・全体の時間を計測する
+
+    settings.PERF_INSTRUMENTATION が True のときだけ有効になる（False なら読み込まれず負荷もない）。
+    DEBUG に関係なく動作し、結果は Server-Timing ヘッダーと 'schedule.performance' のログに出す。
+    PERF_SLOW_REQUEST_MS / PERF_MAX_QUERIES を超えたリクエストは WARNING で記録する。
+    ASGI の非同期ビューの前にも置けるよう非同期にも対応し、クエリは ORM を実行するスレッドの接続で数える。
+    """
+
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        if not getattr(settings, 'PERF_INSTRUMENTATION', False):
+            raise MiddlewareNotUsed
+        self.get_response = get_response
+        self.slow_ms = getattr(settings, 'PERF_SLOW_REQUEST_MS', 500)
+        self.max_queries = getattr(settings, 'PERF_MAX_QUERIES', 30)
+        _install_template_timer()
+        if iscoroutinefunction(self.get_response):
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if iscoroutinefunction(self):
+            return self.__acall__(request)
+        _install_query_recorder()
+        stats = RequestStats()
+        token = _current_stats.set(stats)
+        start = time.perf_counter()
+        try:
+            response = self.get_response(request)
+        finally:
+            _current_stats.reset(token)
+        return self.finish(request, response, stats, start)
+
+    async def __acall__(self, request):
+        # 非同期の ORM は sync_to_async のスレッドで実行され、そのスレッドの接続を使う。
+        # 同じスレッドで登録しておけば、計測値は ContextVar でそのスレッドにも引き継がれる
+        await sync_to_async(_install_query_recorder)()
+        stats = RequestStats()
+        token = _current_stats.set(stats)
+        start = time.perf_counter()
+        try:
+            response = await self.get_response(request)
+        finally:
+            _current_stats.reset(token)
+        return self.finish(request, response, stats, start)
+
+    def finish(self, request, response, stats, start):
+        total_ms = (time.perf_counter() - start) * 1000
+
+        response['Server-Timing'] = ', '.join([
+            f'db;dur={stats.db_ms:.1f};desc="{stats.queries} queries"',
+            f'tpl;dur={stats.template_ms:.1f}',
+            f'total;dur={total_ms:.1f}',
+        ])
+        self.log(request, response, stats, total_ms)
+        return response
+
+    def log(self, request, response, stats, total_ms):
+        flags = []
+        if total_ms > self.slow_ms:
+            flags.append('slow')
+        if stats.queries > self.max_queries:
+            flags.append('too_many_queries')
+
+        match = getattr(request, 'resolver_match', None)
+        record = {
+            'method': request.method,
+            'path': request.path,
+            'view': match.view_name if match else None,
+            'status': response.status_code,
+            'queries': stats.queries,
+            'db_ms': round(stats.db_ms, 1),
+            'template_ms': round(stats.template_ms, 1),
+            'total_ms': round(total_ms, 1),
+            'duplicates': stats.duplicates(),
+            'flags': flags,
+        }
+        logger.log(logging.WARNING if flags else logging.INFO, json.dumps(record, ensure_ascii=False))
+
+
+# --- レスポンスの圧縮 ---
+
+# 圧縮する Content-Type（画像・圧縮済みのファイルは圧縮しても小さくならない）
+COMPRESSIBLE_TYPES = ('text/', 'application/json', 'application/javascript', 'application/xml', 'image/svg+xml')
+
+# リクエストごとに圧縮するので、圧縮率より速さを優先する（静的ファイルは collectstatic で最大の圧縮率にしてある）
+BROTLI_QUALITY = 5
+
+# CSRF トークンを含むページを gzip で圧縮するときに付ける、ランダムな長さのファイル名の最大バイト数
+GZIP_MAX_RANDOM_BYTES = 100
+
+# {% csrf_token %} が出力する hidden フィールド（これを含むページは BREACH 攻撃の対象になりうる）
+CSRF_TOKEN_MARKER = b'name="csrfmiddlewaretoken"'
+
+
+def accepted_encodings(header):
+    """Accept-Encoding ヘッダーから、受け付ける（q が 0 でない）符号化の名前の集合を返す"""
+    encodings = set()
+    for item in header.split(','):
+        name, _, params = item.partition(';')
+        quality = 1.0
+        for param in params.split(';'):
+            key, _, value = param.strip().partition('=')
+            if key == 'q':
+                try:
+                    quality = float(value)
+                except ValueError:
+                    quality = 0.0
+        name = name.strip().lower()
+        if name and quality > 0:
+            encodings.add(name)
+    return encodings
+
+
+def choose_encoding(accepted, breach_sensitive=False):
+    """使う符号化 ('br' / 'gzip' / None) を選ぶ
+
+    CSRF トークンを含むページ (breach_sensitive) は、圧縮後のサイズからトークンを推測する
+    BREACH 攻撃への対策として、サイズにランダムなばらつきを加えられる gzip だけを使う。
+    """
+    if brotli is not None and 'br' in accepted and not breach_sensitive:
+        return 'br'
+    if 'gzip' in accepted:
+        return 'gzip'
+    return None
+
+
+class CompressionMiddleware(MiddlewareMixin):
+    """HTML・JSON のレスポンスを Brotli または gzip で圧縮する
+
+    settings.SCHEDULE_COMPRESSION が True のときだけ有効になる（リバースプロキシ側で圧縮する場合は不要）。
+    SCHEDULE_COMPRESSION_MIN_SIZE バイト未満のレスポンス・ストリーミングのレスポンス
+    （カレンダー・エクスポート）・圧縮済みのレスポンスはそのまま返す。
+    CSRF トークンを使ったページは gzip に限り、圧縮後のサイズにランダムなばらつきを加える
+    （Django の CSRF トークン自体もリクエストごとにマスクされている）。
+    """
+
+    def __init__(self, get_response):
+        if not getattr(settings, 'SCHEDULE_COMPRESSION', False):
+            raise MiddlewareNotUsed
+        super().__init__(get_response)
+        self.min_size = getattr(settings, 'SCHEDULE_COMPRESSION_MIN_SIZE', 1024)
+
+    def process_response(self, request, response):
+        if response.streaming or response.has_header('Content-Encoding') or len(response.content) < self.min_size:
+            return response
+        if not response.get('Content-Type', '').startswith(COMPRESSIBLE_TYPES):
+            return response
+
+        # 圧縮するかどうかは Accept-Encoding で変わるので、共有キャッシュにも区別させる
+        patch_vary_headers(response, ('Accept-Encoding',))
+
+        breach_sensitive = CSRF_TOKEN_MARKER in response.content
+        encoding = choose_encoding(accepted_encodings(request.headers.get('Accept-Encoding', '')), breach_sensitive)
+        if encoding == 'br':
+            compressed = brotli.compress(response.content, quality=BROTLI_QUALITY)
+        elif encoding == 'gzip':
+            compressed = compress_string(
+                response.content, max_random_bytes=GZIP_MAX_RANDOM_BYTES if breach_sensitive else None)
+        else:
+            return response
+        if len(compressed) >= len(response.content):
+            return response
+
+        response.content = compressed
+        response['Content-Length'] = str(len(compressed))
+        response['Content-Encoding'] = encoding
+        # 圧縮後のバイト列は元と異なるので、強い ETag は弱い ETag にする（条件付きGETは弱い比較で一致する）
+        etag = response.get('ETag')
+        if etag and etag.startswith('"'):
+            response['ETag'] = 'W/' + etag
+        return response
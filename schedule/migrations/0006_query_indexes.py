@@ -0,0 +1,31 @@
+# Generated by Django 6.0 on 2026-10-17 13:24
+
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('schedule', '0005_alter_timetable_name'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='schedule',
+            index=models.Index(fields=['course', 'user'], name='schedule_course_user_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='task',
+            index=models.Index(fields=['course', 'is_completed', 'due_date'], name='task_course_done_due_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='task',
+            index=models.Index(condition=models.Q(('is_completed', False)), fields=['course', 'due_date'], name='task_open_due_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='timetable',
+            index=models.Index(condition=models.Q(('is_default', True)), fields=['user'], name='timetable_user_default_idx'),
+        ),
+    ]
@@ -0,0 +1,43 @@
+# Generated by Django 6.0 on 2026-10-17 13:29
+
+from django.db import migrations, models
+from django.db.models import Count, Min, OuterRef, Subquery
+from django.db.models.functions import Coalesce
+
+
+def fill_task_counters(apps, schema_editor):
+    """既存の授業のタスク集計値を計算する"""
+    Course = apps.get_model('schedule', 'Course')
+    Task = apps.get_model('schedule', 'Task')
+    tasks = Task.objects.filter(course=OuterRef('pk')).order_by().values('course')
+    Course.objects.update(
+        task_total=Coalesce(Subquery(tasks.annotate(n=Count('pk')).values('n')), 0),
+        task_completed=Coalesce(Subquery(tasks.filter(is_completed=True).annotate(n=Count('pk')).values('n')), 0),
+        next_due_date=Subquery(tasks.filter(is_completed=False).annotate(d=Min('due_date')).values('d')),
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('schedule', '0006_query_indexes'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='course',
+            name='next_due_date',
+            field=models.DateField(blank=True, editable=False, null=True, verbose_name='直近の未完了タスクの期限日'),
+        ),
+        migrations.AddField(
+            model_name='course',
+            name='task_completed',
+            field=models.PositiveIntegerField(default=0, editable=False, verbose_name='完了タスク数'),
+        ),
+        migrations.AddField(
+            model_name='course',
+            name='task_total',
+            field=models.PositiveIntegerField(default=0, editable=False, verbose_name='タスク数'),
+        ),
+        migrations.RunPython(fill_task_counters, migrations.RunPython.noop),
+    ]
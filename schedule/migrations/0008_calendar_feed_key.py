@@ -0,0 +1,26 @@
+# Generated by Django 6.0 on 2026-10-17 14:19
+
+import django.db.models.deletion
+import schedule.models
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('schedule', '0007_course_task_counters'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='CalendarFeedKey',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('key', models.CharField(default=schedule.models.new_feed_key, max_length=32, verbose_name='鍵')),
+                ('updated_at', models.DateTimeField(auto_now=True, verbose_name='作成し直した日時')),
+                ('user', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, related_name='calendar_feed_key', to=settings.AUTH_USER_MODEL)),
+            ],
+        ),
+    ]
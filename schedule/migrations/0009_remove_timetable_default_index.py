@@ -0,0 +1,17 @@
+# Generated by Django 6.0 on 2026-10-17 14:20
+
+from django.db import migrations
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('schedule', '0008_calendar_feed_key'),
+    ]
+
+    operations = [
+        migrations.RemoveIndex(
+            model_name='timetable',
+            name='timetable_user_default_idx',
+        ),
+    ]
@@ -1,5 +1,7 @@
 # schedule/models.py
 
+import secrets
+
 from django.db import models
 from django.contrib.auth.models import User # Django標準のUserモデルをインポート
 from django.core.exceptions import ValidationError
@@ -98,6 +100,22 @@ class Course(models.Model):
     ]
     color = models.CharField(max_length=7, choices=COLOR_CHOICES, default='#e2e8f0')
 
+    # 【追加】タスクの集計値。Task の保存・削除時に signals.py で更新する
+    # (ずれた場合は manage.py rebuild_task_counters で作り直せる)
+    task_total = models.PositiveIntegerField(default=0, editable=False, verbose_name="タスク数")
+    task_completed = models.PositiveIntegerField(default=0, editable=False, verbose_name="完了タスク数")
+    next_due_date = models.DateField(null=True, blank=True, editable=False, verbose_name="直近の未完了タスクの期限日")
+
+    @property
+    def task_incomplete(self):
+        return self.task_total - self.task_completed
+
+    @property
+    def color_class(self):
+        """時間割のセルの色のCSSクラス（COLOR_CHOICES ごとに schedule/css/time_table.css で定義）"""
+        color = self.color if self.color in dict(self.COLOR_CHOICES) else self._meta.get_field('color').default
+        return f"course-color-{color.lstrip('#')}"
+
 # 4. 時間割 (Schedule) 本体：どの授業が、いつ、どこで行われるか
 class Schedule(models.Model):
 
@@ -116,7 +134,12 @@ class Schedule(models.Model):
         verbose_name = "時間割"
         verbose_name_plural = "時間割"
         # 同じ曜日、同じ時限、同じ教室で授業が重複しないようにする制約
+        # (この制約のインデックスが (user, day, period) の検索にも使われる)
         unique_together = ('user', 'day', 'period')
+        indexes = [
+            # 授業の削除時の「他に使われていないか」確認と、授業→ユーザーの所有者確認用
+            models.Index(fields=['course', 'user'], name='schedule_course_user_idx'),
+        ]
 
 # 【追加】ToDo（タスク）モデル
 class Task(models.Model):
@@ -127,6 +150,37 @@ class Task(models.Model):
     description = models.TextField(blank=True, null=True, verbose_name="詳細")
     due_date = models.DateField(null=True, blank=True, verbose_name="期限日")
     is_completed = models.BooleanField(default=False, verbose_name="完了")
-    
+
+    class Meta:
+        indexes = [
+            # 授業ごとの集計（件数・完了数・緊急度）とToDoリストの並び替え用
+            models.Index(fields=['course', 'is_completed', 'due_date'], name='task_course_done_due_idx'),
+            # 未完了タスクだけを期限順に読む部分インデックス
+            models.Index(
+                fields=['course', 'due_date'], name='task_open_due_idx',
+                condition=models.Q(is_completed=False),
+            ),
+        ]
+
+    @classmethod
+    def from_db(cls, db, field_names, values):
+        instance = super().from_db(db, field_names, values)
+        # 別の授業に移して保存したときに、元の授業の集計値も更新できるよう覚えておく (signals.task_changed)
+        instance._loaded_course_id = instance.__dict__.get('course_id')
+        return instance
+
+    def __str__(self):
+        return f"[{self.course.name}] {self.title}"
+
+# 【追加】カレンダー購読URLの鍵（ユーザーごと）
+def new_feed_key():
+    return secrets.token_urlsafe(16)
+
+class CalendarFeedKey(models.Model):
+    """購読URLのトークンに含める鍵。作り直すと、そのユーザーのそれまでの購読URLはすべて無効になる"""
+    user = models.OneToOneField(User, on_delete=models.CASCADE, related_name='calendar_feed_key')
+    key = models.CharField(max_length=32, default=new_feed_key, verbose_name="鍵")
+    updated_at = models.DateTimeField(auto_now=True, verbose_name="作成し直した日時")
+
     def __str__(self):
-        return f"[{self.course.name}] {self.title}"
\ No newline at end of file
+        return f"{self.user.username}'s calendar feed key"
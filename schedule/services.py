@@ -0,0 +1,200 @@
+# schedule/services.py
+
+from contextvars import ContextVar
+from datetime import time, timedelta
+
+from django.db import transaction
+from django.db.models import Case, Count, DateField, F, Min, OuterRef, Subquery, Value, When
+from django.db.models.functions import Cast, Coalesce
+
+from .cache import bump_user_version
+from .models import Timetable, Day, Period, Course, Schedule, Task
+
+# 初めて時間割を作るときの曜日・時限構成
+DEFAULT_DAYS = ['月', '火', '水', '木', '金', '土']
+DEFAULT_PERIODS = [
+    ('1限', time(9, 20), time(11, 0)),
+    ('2限', time(11, 10), time(12, 50)),
+    ('3限', time(13, 40), time(15, 20)),
+    ('4限', time(15, 30), time(17, 10)),
+    ('5限', time(17, 20), time(19, 0)),
+]
+
+# 一度に INSERT する行数
+BULK_BATCH_SIZE = 500
+
+# True の間は Task のシグナルで集計値・キャッシュを更新しない（まとめて更新する側が tasks_changed を呼ぶ）
+bulk_task_change = ContextVar('schedule_bulk_task_change', default=False)
+
+
+# --- 授業ごとのタスク集計値 ---
+
+def course_counter_values():
+    """Course のタスク集計値を、その授業の Task から計算する式"""
+    tasks = Task.objects.filter(course=OuterRef('pk')).order_by().values('course')
+    return {
+        'task_total': Coalesce(Subquery(tasks.annotate(n=Count('pk')).values('n')), 0),
+        'task_completed': Coalesce(
+            Subquery(tasks.filter(is_completed=True).annotate(n=Count('pk')).values('n')), 0),
+        'next_due_date': Subquery(tasks.filter(is_completed=False).annotate(d=Min('due_date')).values('d')),
+    }
+
+
+def refresh_course_counters(*course_ids):
+    """指定した授業のタスク集計値を1回の UPDATE で計算し直す
+
+    読み込み → 計算 → 書き込みを1つのSQLで行うので、同時に更新されても値がずれない。
+    """
+    if not course_ids:
+        return 0
+    return Course.objects.filter(pk__in=set(course_ids)).update(**course_counter_values())
+
+
+# --- ToDo の一括操作 ---
+
+def tasks_changed(*course_ids):
+    """QuerySet の update() / delete() でToDoを変更した後に呼び、集計値とキャッシュを更新する
+
+    update() はシグナルを送らないので、Task のシグナルの代わりに授業ごとに1回だけ行う。
+    """
+    if not course_ids:
+        return
+    refresh_course_counters(*course_ids)
+    user_ids = Schedule.objects.filter(course_id__in=set(course_ids)).values_list('user_id', flat=True)
+    bump_user_version(*user_ids)
+
+
+def toggle_tasks(tasks):
+    """ToDo の完了・未完了を1回の UPDATE で反転する
+
+    現在の値を読んでから書き込むのではなく SQL の中で反転するので、同時に押されても取りこぼさない。
+    集計値とキャッシュの更新（tasks_changed）は呼び出し側で行う。
+    """
+    return tasks.update(is_completed=Case(When(is_completed=False, then=Value(True)), default=Value(False)))
+
+
+def delete_tasks(tasks):
+    """ToDo をまとめて削除する（1件ごとのシグナルでは集計値を更新しない）"""
+    token = bulk_task_change.set(True)
+    try:
+        deleted, _ = tasks.delete()
+    finally:
+        bulk_task_change.reset(token)
+    return deleted
+
+
+def shift_due_dates(tasks, days):
+    """ToDo の期限日を days 日ずらす（期限のないToDoはそのまま）"""
+    # SQLite では日付 + 日数の結果が日時の文字列になるので、日付に変換してから保存する
+    shifted = Cast(F('due_date') + timedelta(days=days), output_field=DateField())
+    return tasks.filter(due_date__isnull=False).update(due_date=shifted)
+
+
+# 一括操作の名前 -> QuerySet に1回の UPDATE / DELETE を行う関数 (tasks, days)
+TASK_ACTIONS = {
+    'toggle': lambda tasks, days: toggle_tasks(tasks),
+    'complete': lambda tasks, days: tasks.update(is_completed=True),
+    'uncomplete': lambda tasks, days: tasks.update(is_completed=False),
+    'shift': shift_due_dates,
+    'delete': lambda tasks, days: delete_tasks(tasks),
+}
+
+
+@transaction.atomic
+def bulk_task_action(user, task_ids, action, days=0):
+    """user の授業のToDoのうち task_ids に含まれるものに、action を1回のクエリでまとめて行う
+
+    ほかのユーザーの授業のToDoは task_ids に含まれていても無視する。
+    (変更した件数, 変更したToDoの授業のID) を返す。集計値とキャッシュの更新は最後に1回だけ行う。
+    """
+    owned = Task.objects.filter(pk__in=task_ids, course__schedule__user=user)
+    # コマが複数ある授業では JOIN で行が重複するので、主キーで絞り直してから更新する
+    tasks = Task.objects.filter(pk__in=owned.values('pk'))
+    course_ids = set(tasks.values_list('course_id', flat=True))
+    if not course_ids:
+        return 0, course_ids
+    changed = TASK_ACTIONS[action](tasks, days)
+    tasks_changed(*course_ids)
+    return changed, course_ids
+
+
+# --- 時間割の作成・複製 ---
+
+def create_default_structure(timetable):
+    """デフォルトの曜日・時限を bulk_create で作成する"""
+    Day.objects.bulk_create([
+        Day(timetable=timetable, name=name, order=i + 1) for i, name in enumerate(DEFAULT_DAYS)
+    ])
+    Period.objects.bulk_create([
+        Period(timetable=timetable, name=name, order=i + 1, start_time=start, end_time=end)
+        for i, (name, start, end) in enumerate(DEFAULT_PERIODS)
+    ])
+    bump_user_version(timetable.user_id)
+
+
+@transaction.atomic
+def copy_timetable(source, target, deep=False, copy_courses=False):
+    """source の曜日・時限構成を target にコピーする
+
+    deep=True のときは授業の登録（Schedule）もコピーする。
+    copy_courses=True のときは授業（Course）とそのToDo（Task）も複製し、
+    新しい時間割の授業を編集しても元の時間割に影響しないようにする。
+    外部キーはメモリ上で付け替えるので、クエリ数は行数に依存しない。
+    """
+    days = list(source.day_set.order_by('order', 'pk'))
+    periods = list(source.period_set.order_by('order', 'pk'))
+
+    new_days = Day.objects.bulk_create([
+        Day(timetable=target, name=day.name, order=day.order) for day in days
+    ])
+    new_periods = Period.objects.bulk_create([
+        Period(timetable=target, name=period.name, order=period.order,
+               start_time=period.start_time, end_time=period.end_time)
+        for period in periods
+    ])
+
+    if deep:
+        day_map = {old.pk: new.pk for old, new in zip(days, new_days)}
+        period_map = {old.pk: new.pk for old, new in zip(periods, new_periods)}
+        schedules = list(Schedule.objects.filter(
+            user_id=source.user_id, day__timetable=source, period__timetable=source,
+        ))
+
+        course_map = {}
+        if copy_courses:
+            courses = list(Course.objects.filter(pk__in={s.course_id for s in schedules}).order_by('pk'))
+            new_courses = Course.objects.bulk_create([
+                Course(name=course.name, instructor=course.instructor, description=course.description,
+                       room=course.room, color=course.color, task_total=course.task_total,
+                       task_completed=course.task_completed, next_due_date=course.next_due_date)
+                for course in courses
+            ])
+            course_map = {old.pk: new.pk for old, new in zip(courses, new_courses)}
+
+            Task.objects.bulk_create(
+                (
+                    Task(course_id=course_map[task.course_id], title=task.title, description=task.description,
+                         due_date=task.due_date, is_completed=task.is_completed)
+                    for task in Task.objects.filter(course_id__in=course_map).iterator()
+                ),
+                batch_size=BULK_BATCH_SIZE,
+            )
+
+        Schedule.objects.bulk_create([
+            Schedule(user_id=target.user_id, course_id=course_map.get(s.course_id, s.course_id),
+                     day_id=day_map[s.day_id], period_id=period_map[s.period_id])
+            for s in schedules
+        ], batch_size=BULK_BATCH_SIZE)
+
+    # bulk_create はシグナルを送らないので、キャッシュはここで無効にする
+    bump_user_version(target.user_id)
+
+
+@transaction.atomic
+def clone_timetable(source, name, deep=False, copy_courses=False, is_default=False):
+    """source を複製した新しい時間割を作成して返す"""
+    if is_default:
+        Timetable.objects.filter(user_id=source.user_id).update(is_default=False)
+    target = Timetable.objects.create(user_id=source.user_id, name=name, is_default=is_default)
+    copy_timetable(source, target, deep=deep, copy_courses=copy_courses)
+    return target
@@ -0,0 +1,64 @@
+# schedule/signals.py
+
+from django.db.models import QuerySet
+from django.db.models.signals import post_save, post_delete
+from django.dispatch import receiver
+
+from .cache import bump_user_version
+from .models import Timetable, Day, Period, Course, Schedule, Task
+from .services import bulk_task_change, tasks_changed
+
+
+def affected_user_ids(instance):
+    """変更されたオブジェクトの時間割を表示するユーザーのIDを返す"""
+    if isinstance(instance, (Timetable, Schedule)):
+        return [instance.user_id]
+    if isinstance(instance, (Day, Period)):
+        return list(Timetable.objects.filter(pk=instance.timetable_id).values_list('user_id', flat=True))
+    if isinstance(instance, Course):
+        return list(Schedule.objects.filter(course_id=instance.pk).values_list('user_id', flat=True))
+    return []
+
+
+def deleted_with_course(origin):
+    """授業の削除に伴ってカスケード削除されたかどうか"""
+    return isinstance(origin, Course) or (isinstance(origin, QuerySet) and origin.model is Course)
+
+
+@receiver(post_save, sender=Timetable)
+@receiver(post_save, sender=Day)
+@receiver(post_save, sender=Period)
+@receiver(post_save, sender=Course)
+@receiver(post_save, sender=Schedule)
+@receiver(post_delete, sender=Timetable)
+@receiver(post_delete, sender=Day)
+@receiver(post_delete, sender=Period)
+@receiver(post_delete, sender=Course)
+@receiver(post_delete, sender=Schedule)
+def invalidate_time_table_cache(sender, instance, **kwargs):
+    """時間割に関わるデータが保存・削除されたら、該当ユーザーのキャッシュを無効にする"""
+    user_ids = affected_user_ids(instance)
+    if user_ids:
+        bump_user_version(*user_ids)
+
+
+@receiver(post_save, sender=Task)
+@receiver(post_delete, sender=Task)
+def task_changed(sender, instance, origin=None, **kwargs):
+    """タスクが保存・削除されたら、授業の集計値を更新してからキャッシュを無効にする
+
+    別の授業に移された場合は、移す前の授業も更新する。
+    """
+    # 授業ごと削除される場合は、授業側（とそのコマ）の削除で処理されるので何もしない
+    if deleted_with_course(origin):
+        return
+    # まとめて変更する処理（services.delete_tasks など）は、最後に tasks_changed で一度だけ更新する
+    if bulk_task_change.get():
+        return
+    course_ids = {instance.course_id}
+    previous = getattr(instance, '_loaded_course_id', None)
+    if previous is not None:
+        course_ids.add(previous)
+    instance._loaded_course_id = instance.course_id
+    tasks_changed(*course_ids)
+
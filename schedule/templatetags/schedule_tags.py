@@ -1,14 +1,53 @@
 # schedule/templatetags/schedule_tags.py
 
 from django import template
+from django.conf import settings
+from django.utils import timezone
+
+from schedule import cache as schedule_cache
 
 # テンプレートライブラリとして登録
 register = template.Library()
 
-@register.filter
-def get_item(dictionary, key):
+
+class FragmentNode(template.Node):
+    def __init__(self, nodelist, name, vary_on):
+        self.nodelist = nodelist
+        self.name = name
+        self.vary_on = vary_on
+
+    def render(self, context):
+        request = context.get('request')
+        user = getattr(request, 'user', None)
+        if (not getattr(settings, 'SCHEDULE_FRAGMENT_CACHE', True) or not schedule_cache.enabled()
+                or user is None or not user.is_authenticated):
+            return self.nodelist.render(context)
+
+        name = self.name.resolve(context)
+        # 緊急度は今日の日付で変わるので、日付もキーに含める
+        parts = [var.resolve(context) for var in self.vary_on]
+        parts.append(timezone.localdate().isoformat())
+
+        html = schedule_cache.get_fragment(user.pk, name, parts)
+        if html is None:
+            html = self.nodelist.render(context)
+            schedule_cache.set_fragment(user.pk, name, parts, html)
+        return html
+
+
+@register.tag
+def cache_fragment(parser, token):
     """
-    辞書から指定されたキーの値を取得するカスタムフィルター
-    例: {{ my_dict|get_item:my_key }}
+    ログインユーザーごとに、描画済みのテンプレートの断片をキャッシュするタグ
+    例: {% cache_fragment 'grid' current_timetable.pk show_all %} ... {% endcache_fragment %}
+
+    キーには断片の名前・指定した値・今日の日付と、ユーザーのデータのバージョンが入るので、
+    データが変更される（signals.py などで bump_user_version が呼ばれる）と描画し直す。
+    CSRF トークンなど、リクエストごとに変わる値を含む部分には使わないこと。
     """
-    return dictionary.get(key)
\ No newline at end of file
+    bits = token.split_contents()
+    if len(bits) < 2:
+        raise template.TemplateSyntaxError(f"'{bits[0]}' タグには断片の名前が必要です")
+    nodelist = parser.parse(('endcache_fragment',))
+    parser.delete_first_token()
+    return FragmentNode(nodelist, parser.compile_filter(bits[1]), [parser.compile_filter(bit) for bit in bits[2:]])
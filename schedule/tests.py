@@ -1,3 +1,1687 @@
-from django.test import TestCase
+import gzip
+import importlib.util
+import io
+import json
+import os
+import tempfile
+import unittest
+from datetime import date, time, timedelta
+from unittest import mock
 
-# Create your tests here.
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.contrib.auth.models import User
+from django.contrib.staticfiles import finders
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.core.cache import cache, caches
+from django.core.management import CommandError, call_command
+from django.db import connection, transaction
+from django.db.utils import ConnectionHandler
+from django.http import QueryDict
+from django.templatetags.static import static
+from django.test import Client, TestCase, SimpleTestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.urls import resolve, reverse
+from django.utils import timezone
+
+from config import caches as cache_url
+from config import database as database_url
+from config import sessions as session_config
+
+from . import cache as schedule_cache
+from . import todos, views
+from .benchmark import (
+    compare_reports, generate_dataset, isolated_cache, measure_compression, measure_render, run_benchmark,
+    run_load_comparison,
+)
+from .grid import TODO_PREVIEW_LIMIT, fetch_course_task_stats, get_urgency
+from .ical import feed_token, fold, vtimezone
+from .loaders import strip_whitespace
+from .middleware import accepted_encodings, choose_encoding
+from .exporter import EXPORT_VERSION, iter_export
+from .forms import CourseForm
+from .importer import ImportFileError, import_file, iter_json, restore_file
+from .services import clone_timetable
+from .models import Timetable, Day, Period, Course, Schedule, Task
+
+
+def make_timetable(user, name='前期', days=2, periods=2, is_default=True):
+    """テスト用に曜日・時限を持つ時間割を作る"""
+    timetable = Timetable.objects.create(user=user, name=name, is_default=is_default)
+    day_objs = [Day.objects.create(timetable=timetable, name=f'D{i}', order=i) for i in range(days)]
+    period_objs = [
+        Period.objects.create(timetable=timetable, name=f'P{i}', order=i,
+                              start_time=time(9, 0), end_time=time(10, 30))
+        for i in range(periods)
+    ]
+    return timetable, day_objs, period_objs
+
+
+def fill_schedules(user, day_objs, period_objs, tasks_per_course=0):
+    """すべてのコマに授業を登録し、授業ごとにタスクを作る"""
+    today = timezone.localdate()
+    for day in day_objs:
+        for period in period_objs:
+            course = Course.objects.create(name=f'{day.name}{period.name}', instructor='先生')
+            Schedule.objects.create(user=user, course=course, day=day, period=period)
+            for i in range(tasks_per_course):
+                Task.objects.create(course=course, title=f'課題{i}',
+                                    due_date=today + timedelta(days=i - 1), is_completed=i % 3 == 0)
+
+
+# 同期版・非同期版のビューを使うURL設定
+SYNC_URLCONF = 'config.sync_urls'
+ASYNC_URLCONF = 'config.async_urls'
+
+
+class ScheduleTestCase(TestCase):
+    """テスト間でキャッシュが残らないようにする基底クラス
+
+    TestCase はテスト全体を1つのトランザクションで囲んでコミットしないため、bump_user_version が
+    on_commit で登録する処理はその場で実行する（コミット後に実行されることは OnCommitTests で確認する）。
+    """
+
+    def setUp(self):
+        super().setUp()
+        cache.clear()
+        patcher = mock.patch.object(schedule_cache.transaction, 'on_commit', lambda func, using=None: func())
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+
+class TimeTableQueryCountTests(ScheduleTestCase):
+    """メイン画面のクエリ数がグリッドの大きさやタスク数に依存しないことを確認する"""
+
+    def count_queries(self, days, periods, tasks_per_course, show_all=False):
+        user = User.objects.create_user(f'user{days}x{periods}x{tasks_per_course}{show_all}')
+        _, day_objs, period_objs = make_timetable(user, days=days, periods=periods)
+        fill_schedules(user, day_objs, period_objs, tasks_per_course)
+        self.client.force_login(user)
+        url = reverse('schedule:time_table') + ('?all=1' if show_all else '')
+        with CaptureQueriesContext(connection) as ctx:
+            response = self.client.get(url)
+        self.assertEqual(response.status_code, 200)
+        return len(ctx.captured_queries)
+
+    def test_query_count_is_independent_of_grid_size(self):
+        small = self.count_queries(days=1, periods=1, tasks_per_course=1)
+        large = self.count_queries(days=6, periods=5, tasks_per_course=8)
+        self.assertEqual(small, large)
+
+    def test_query_count_is_independent_of_grid_size_with_show_all(self):
+        small = self.count_queries(days=1, periods=1, tasks_per_course=1, show_all=True)
+        large = self.count_queries(days=6, periods=5, tasks_per_course=8, show_all=True)
+        self.assertEqual(small, large)
+
+
+class TimeTableGridTests(ScheduleTestCase):
+    def setUp(self):
+        super().setUp()
+        self.user = User.objects.create_user('taro')
+        self.timetable, self.days, self.periods = make_timetable(self.user)
+        self.course = Course.objects.create(name='線形代数', instructor='山田')
+        self.schedule = Schedule.objects.create(
+            user=self.user, course=self.course, day=self.days[0], period=self.periods[1])
+        self.client.force_login(self.user)
+
+    def test_cell_urgency_and_counts(self):
+        today = timezone.localdate()
+        Task.objects.create(course=self.course, title='レポート', due_date=today)
+        Task.objects.create(course=self.course, title='小テスト', due_date=today + timedelta(days=3))
+        Task.objects.create(course=self.course, title='提出済み', due_date=today - timedelta(days=1),
+                            is_completed=True)
+
+        response = self.client.get(reverse('schedule:time_table'))
+        cell = response.context['schedule_data'][self.days[0].pk][self.periods[1].pk]
+        self.assertEqual(cell.schedule, self.schedule)
+        self.assertEqual(cell.urgency, 'today')
+        self.assertEqual(cell.task_count, 2)
+        self.assertEqual(response.context['total_timetable_tasks'], 3)
+        self.assertEqual(response.context['completed_timetable_tasks'], 1)
+        self.assertIsNone(response.context['schedule_data'][self.days[1].pk][self.periods[0].pk].schedule)
+
+        response = self.client.get(reverse('schedule:time_table') + '?all=1')
+        cell = response.context['schedule_data'][self.days[0].pk][self.periods[1].pk]
+        self.assertEqual((cell.completed_count, cell.task_count), (1, 3))
+        self.assertEqual(len(response.context['upcoming_todos']), 3)
+
+    def test_cells_are_prebuilt(self):
+        Task.objects.create(course=self.course, title='レポート', due_date=timezone.localdate() - timedelta(days=1))
+        response = self.client.get(reverse('schedule:time_table'))
+        rows = response.context['grid_rows']
+        self.assertEqual([row.period for row in rows], self.periods)
+        cell = rows[1].cells[0]
+        self.assertEqual(cell.css_class, 'class-cell urgency-overdue')
+        self.assertEqual((cell.badge, cell.progress), ('⚠️ 期限切れ', 0))
+        self.assertEqual(cell.url, reverse('schedule:detail', kwargs={'pk': self.schedule.pk}))
+        empty = rows[0].cells[1]
+        self.assertEqual((empty.css_class, empty.badge, empty.progress), ('non-class', None, None))
+        self.assertContains(response, 'class="class-cell urgency-overdue"')
+        self.assertContains(response, f'href="{empty.url}" class="add-link"')
+
+    def test_styles_come_from_stylesheets(self):
+        self.course.color = '#fbcfe8'
+        self.course.save()
+        response = self.client.get(reverse('schedule:time_table'))
+        self.assertContains(response, 'class="course-accent-bar course-color-fbcfe8"')
+        self.assertContains(response, 'schedule/css/time_table.css')
+        self.assertContains(response, 'css/base.css')
+        self.assertNotContains(response, '<style')
+        self.assertNotContains(response, 'background-color: #')
+
+    def test_course_task_stats_in_one_query(self):
+        today = timezone.localdate()
+        Task.objects.create(course=self.course, title='遅れ', due_date=today - timedelta(days=2))
+        Task.objects.create(course=self.course, title='来週', due_date=today + timedelta(days=5))
+        Task.objects.create(course=self.course, title='完了', is_completed=True)
+
+        with self.assertNumQueries(1):
+            stats = fetch_course_task_stats([self.course.pk], today)
+        course_stats = stats[self.course.pk]
+        self.assertEqual((course_stats['total'], course_stats['completed'], course_stats['incomplete']), (3, 1, 2))
+        self.assertTrue(course_stats['overdue'])
+        self.assertFalse(course_stats['due_today'])
+        self.assertTrue(course_stats['due_this_week'])
+        self.assertEqual(course_stats['urgency'], 'overdue')
+
+
+class TimeTableCacheTests(ScheduleTestCase):
+    def setUp(self):
+        super().setUp()
+        self.user = User.objects.create_user('hanako')
+        self.timetable, self.days, self.periods = make_timetable(self.user)
+        self.course = Course.objects.create(name='英語', instructor='Smith')
+        Schedule.objects.create(user=self.user, course=self.course, day=self.days[0], period=self.periods[0])
+        self.client.force_login(self.user)
+        self.url = reverse('schedule:time_table')
+
+    def get_cell(self):
+        return self.client.get(self.url).context['schedule_data'][self.days[0].pk][self.periods[0].pk]
+
+    def test_cache_hit_skips_schedule_queries(self):
+        # 初回表示でセッションに時間割が記録されるため、2回目以降が同じキーになる
+        self.client.get(self.url)
+        self.client.get(self.url)
+        with CaptureQueriesContext(connection) as ctx:
+            response = self.client.get(self.url)
+        self.assertEqual(response.status_code, 200)
+        tables = [q['sql'] for q in ctx.captured_queries if 'schedule_' in q['sql']]
+        self.assertEqual(tables, [])
+
+    def test_writes_invalidate_cache(self):
+        self.assertEqual(self.get_cell().task_count, 0)
+
+        task = Task.objects.create(course=self.course, title='宿題', due_date=timezone.localdate())
+        cell = self.get_cell()
+        self.assertEqual((cell.task_count, cell.urgency), (1, 'today'))
+
+        task.is_completed = True
+        task.save()
+        self.assertEqual(self.get_cell().task_count, 0)
+
+        self.course.name = 'English'
+        self.course.save()
+        self.assertEqual(self.get_cell().schedule.course.name, 'English')
+
+        Day.objects.create(timetable=self.timetable, name='土', order=10)
+        self.assertEqual(len(self.client.get(self.url).context['days']), 3)
+
+    def test_other_users_cache_is_kept(self):
+        other = User.objects.create_user('jiro')
+        make_timetable(other)
+        other_client = self.client_class()
+        other_client.force_login(other)
+        other_client.get(self.url)
+        other_client.get(self.url)
+
+        Task.objects.create(course=self.course, title='宿題')
+        with CaptureQueriesContext(connection) as ctx:
+            other_client.get(self.url)
+        self.assertFalse([q for q in ctx.captured_queries if 'schedule_' in q['sql']])
+
+
+class TimetableListQueryCountTests(ScheduleTestCase):
+    def count_queries(self, timetables):
+        user = User.objects.create_user(f'list{timetables}')
+        for i in range(timetables):
+            make_timetable(user, name=f'{2020 + i}年度', days=6, periods=5, is_default=i == 0)
+        self.client.force_login(user)
+        with CaptureQueriesContext(connection) as ctx:
+            response = self.client.get(reverse('schedule:timetable_list'))
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(len(response.context['timetables']), timetables)
+        return len(ctx.captured_queries)
+
+    def test_query_count_is_independent_of_timetable_count(self):
+        self.assertEqual(self.count_queries(1), self.count_queries(8))
+
+    def test_day_and_period_lists_are_ordered(self):
+        user = User.objects.create_user('order')
+        timetable = Timetable.objects.create(user=user, name='後期')
+        Day.objects.create(timetable=timetable, name='火', order=2)
+        Day.objects.create(timetable=timetable, name='月', order=1)
+        self.client.force_login(user)
+        response = self.client.get(reverse('schedule:timetable_list'))
+        tt = response.context['timetables'][0]
+        self.assertEqual([day.name for day in tt.day_list], ['月', '火'])
+        self.assertEqual(tt.period_list, [])
+
+
+class CloneTimetableTests(ScheduleTestCase):
+    def setUp(self):
+        super().setUp()
+        self.user = User.objects.create_user('clone')
+        self.source, days, periods = make_timetable(self.user, days=6, periods=5)
+        fill_schedules(self.user, days, periods, tasks_per_course=3)
+
+    def test_structure_only(self):
+        with CaptureQueriesContext(connection) as ctx:
+            new = clone_timetable(self.source, '後期')
+        self.assertLessEqual(len(ctx.captured_queries), 10)
+        self.assertEqual(list(new.day_set.values_list('name', 'order')),
+                         list(self.source.day_set.values_list('name', 'order')))
+        self.assertEqual(new.period_set.count(), 5)
+        self.assertFalse(Schedule.objects.filter(day__timetable=new).exists())
+
+    def test_deep_copy_shares_courses(self):
+        with CaptureQueriesContext(connection) as ctx:
+            new = clone_timetable(self.source, '後期', deep=True)
+        self.assertLessEqual(len(ctx.captured_queries), 12)
+        copied = Schedule.objects.filter(day__timetable=new).select_related('day', 'period')
+        self.assertEqual(copied.count(), 30)
+        for schedule in copied:
+            self.assertEqual(schedule.period.timetable_id, new.pk)
+        self.assertEqual(Course.objects.count(), 30)
+
+    def test_deep_copy_with_courses_and_tasks(self):
+        with CaptureQueriesContext(connection) as ctx:
+            new = clone_timetable(self.source, '後期', deep=True, copy_courses=True)
+        self.assertLessEqual(len(ctx.captured_queries), 15)
+        self.assertEqual(Course.objects.count(), 60)
+        new_course_ids = Schedule.objects.filter(day__timetable=new).values_list('course_id', flat=True)
+        self.assertEqual(Task.objects.filter(course_id__in=new_course_ids).count(), 90)
+        old_course_ids = Schedule.objects.filter(day__timetable=self.source).values_list('course_id', flat=True)
+        self.assertFalse(set(new_course_ids) & set(old_course_ids))
+
+    def test_create_view_copies_previous_timetable(self):
+        self.client.force_login(self.user)
+        response = self.client.post(reverse('schedule:timetable_create'),
+                                    {'name': '後期', 'copy_mode': 'schedules'})
+        self.assertRedirects(response, reverse('schedule:timetable_list'))
+        new = Timetable.objects.get(user=self.user, name='後期')
+        self.assertEqual(new.day_set.count(), 6)
+        self.assertEqual(Schedule.objects.filter(day__timetable=new).count(), 30)
+
+    def test_create_view_default_structure(self):
+        user = User.objects.create_user('first')
+        self.client.force_login(user)
+        self.client.post(reverse('schedule:timetable_create'), {'name': '前期'})
+        new = Timetable.objects.get(user=user)
+        self.assertEqual(list(new.day_set.values_list('name', flat=True)), ['月', '火', '水', '木', '金', '土'])
+        self.assertEqual(new.period_set.count(), 5)
+
+
+class QueryPlanTests(ScheduleTestCase):
+    """メイン画面などのクエリが 0006_query_indexes のインデックスを使うことを EXPLAIN で確認する
+
+    SQLite では EXPLAIN QUERY PLAN、PostgreSQL では EXPLAIN の結果にインデックス名が含まれるかを見る。
+    PostgreSQL は行数が少ないと順次スキャンを選ぶため、enable_seqscan を無効にしてから確認する。
+    DATABASE_URL に PostgreSQL を指定して manage.py test を実行すれば PostgreSQL でも確認できる。
+    """
+
+    def setUp(self):
+        super().setUp()
+        self.user = User.objects.create_user('plan')
+        _, days, periods = make_timetable(self.user, days=3, periods=3)
+        fill_schedules(self.user, days, periods, tasks_per_course=4)
+        self.client.force_login(self.user)
+
+    def explain(self, sql):
+        with connection.cursor() as cursor:
+            if connection.vendor == 'postgresql':
+                cursor.execute('SET LOCAL enable_seqscan = off')
+                cursor.execute(f'EXPLAIN {sql}')
+            elif connection.vendor == 'sqlite':
+                cursor.execute(f'EXPLAIN QUERY PLAN {sql}')
+            else:
+                self.skipTest(f'{connection.vendor} の実行計画には未対応')
+            return '\n'.join(' '.join(map(str, row)) for row in cursor.fetchall())
+
+    def assertUsesIndex(self, sql, index_name):
+        plan = self.explain(sql)
+        self.assertIn(index_name, plan, f'{sql}\n{plan}')
+
+    def main_page_queries(self, url):
+        with CaptureQueriesContext(connection) as ctx:
+            self.client.get(url)
+        return [q['sql'] for q in ctx.captured_queries]
+
+    def find_query(self, queries, *fragments):
+        matches = [sql for sql in queries if all(fragment in sql for fragment in fragments)]
+        self.assertTrue(matches, f'{fragments} を含むクエリがありません')
+        return matches[0]
+
+    def test_main_page_uses_indexes(self):
+        queries = self.main_page_queries(reverse('schedule:time_table'))
+        # 表示する時間割は切り替えメニュー用の一覧から選ぶので、時間割のクエリは1回だけ
+        timetable_queries = [sql for sql in queries if 'FROM "schedule_timetable"' in sql]
+        self.assertEqual(len(timetable_queries), 1)
+        self.assertUsesIndex(timetable_queries[0], 'schedule_timetable_user_id')
+        self.assertUsesIndex(
+            self.find_query(queries, 'FROM "schedule_task"', 'ORDER BY'), 'task_open_due_idx')
+
+    def test_course_task_stats_use_index(self):
+        course_ids = list(Schedule.objects.filter(user=self.user).values_list('course_id', flat=True))
+        with CaptureQueriesContext(connection) as ctx:
+            fetch_course_task_stats(course_ids, timezone.localdate())
+        self.assertUsesIndex(ctx.captured_queries[0]['sql'], 'task_course_done_due_idx')
+
+    def test_orphan_course_check_uses_index(self):
+        course = Schedule.objects.filter(user=self.user).first().course
+        with CaptureQueriesContext(connection) as ctx:
+            list(Schedule.objects.filter(course=course).values_list('user_id', flat=True))
+        self.assertUsesIndex(ctx.captured_queries[0]['sql'], 'schedule_course_user_idx')
+
+    def test_todo_dashboard_uses_indexes(self):
+        url = reverse('schedule:todo_dashboard')
+        limit = f'LIMIT {todos.PAGE_SIZE + 1}'
+        queries = self.main_page_queries(url)
+        self.assertUsesIndex(self.find_query(queries, 'FROM "schedule_task"', limit), 'task_open_due_idx')
+        # 完了済みも含める場合は、授業ごとのどちらかのインデックス（FK の索引を含む）から読む
+        queries = self.main_page_queries(url + '?all=on')
+        plan = self.explain(self.find_query(queries, 'FROM "schedule_task"', limit))
+        self.assertTrue(any(name in plan for name in ('task_course_done_due_idx', 'schedule_task_course_id')), plan)
+
+
+class BenchmarkTests(ScheduleTestCase):
+    def test_every_url_is_measured(self):
+        samples = generate_dataset(timetables=1, days=2, periods=2, courses=3, tasks=20)
+        report = run_benchmark(samples, repeat=1)
+        self.assertEqual(report['skipped'], [])
+        for name, result in report['results'].items():
+            self.assertLess(result['status'], 400, name)
+            self.assertGreater(result['queries'], 0, name)
+
+    def test_measure_render(self):
+        samples = generate_dataset(timetables=1, days=2, periods=2, courses=3, tasks=20)
+        report = measure_render(samples, repeat=2)
+        self.assertEqual(report['cells'], 4)
+        self.assertGreater(report['html_bytes'], 0)
+        self.assertEqual(set(report['latency_ms']), {'cached', 'uncached', 'fragment'})
+
+    def test_measure_compression(self):
+        samples = generate_dataset(timetables=1, days=2, periods=2, courses=3, tasks=20)
+        report = measure_compression(samples, repeat=1, names=['time_table', 'grid_api'])
+        page = report['results']['time_table']
+        self.assertEqual({mode['status'] for mode in page.values()}, {200})
+        self.assertLess(page['stripped']['bytes'], page['identity']['bytes'])
+        self.assertEqual(page['gzip']['encoding'], 'gzip')
+        self.assertLess(page['gzip']['bytes'], page['stripped']['bytes'])
+
+    def test_isolated_cache_keeps_default_cache(self):
+        cache.set('production', 1)
+        with isolated_cache():
+            cache.set('benchmark', 1)
+            cache.clear()
+            self.assertIsNone(cache.get('production'))
+        self.assertEqual(cache.get('production'), 1)
+        self.assertIsNone(cache.get('benchmark'))
+
+    def test_compare_reports(self):
+        def report(queries, median):
+            return {'results': {'time_table': {'status': 200, 'queries': queries, 'latency_ms': {'median': median}}}}
+
+        self.assertEqual(compare_reports(report(10, 5.0), report(10, 9.0)), [])
+        self.assertEqual(len(compare_reports(report(10, 5.0), report(11, 5.0))), 1)
+        self.assertEqual(len(compare_reports(report(10, 5.0), report(10, 9.0), max_latency_regression=0.25)), 1)
+
+
+class PerformanceMiddlewareTests(ScheduleTestCase):
+    def setUp(self):
+        super().setUp()
+        self.user = User.objects.create_user('perf')
+        make_timetable(self.user)
+        self.client.force_login(self.user)
+
+    def test_disabled_by_default(self):
+        response = self.client.get(reverse('schedule:time_table'))
+        self.assertNotIn('Server-Timing', response)
+
+    @override_settings(PERF_INSTRUMENTATION=True, PERF_MAX_QUERIES=1000, PERF_SLOW_REQUEST_MS=100000)
+    def test_server_timing_and_log(self):
+        with self.assertLogs('schedule.performance', 'INFO') as logs:
+            response = self.client.get(reverse('schedule:time_table'))
+        self.assertRegex(response['Server-Timing'], r'db;dur=[\d.]+;desc="\d+ queries", tpl;dur=[\d.]+, total;dur=')
+        record = json.loads(logs.records[0].getMessage())
+        self.assertEqual(record['view'], 'schedule:time_table')
+        self.assertGreater(record['queries'], 0)
+        self.assertGreater(record['template_ms'], 0)
+        self.assertEqual(record['flags'], [])
+
+    @override_settings(PERF_INSTRUMENTATION=True, ROOT_URLCONF=ASYNC_URLCONF)
+    async def test_counts_queries_of_async_views(self):
+        await self.async_client.aforce_login(self.user)
+        with self.assertLogs('schedule.performance', 'INFO') as logs:
+            response = await self.async_client.get(reverse('schedule:time_table'))
+        self.assertRegex(response['Server-Timing'], r'db;dur=[\d.]+;desc="[1-9]\d* queries"')
+        self.assertGreater(json.loads(logs.records[0].getMessage())['queries'], 0)
+
+    @override_settings(PERF_INSTRUMENTATION=True, PERF_MAX_QUERIES=1)
+    def test_flags_requests_over_thresholds(self):
+        with self.assertLogs('schedule.performance', 'WARNING') as logs:
+            self.client.get(reverse('schedule:time_table'))
+        self.assertIn('too_many_queries', json.loads(logs.records[0].getMessage())['flags'])
+
+
+class GridApiTests(ScheduleTestCase):
+    def setUp(self):
+        super().setUp()
+        self.user = User.objects.create_user('api')
+        self.timetable, self.days, self.periods = make_timetable(self.user)
+        self.course = Course.objects.create(name='物理', instructor='湯川', color='#bae6fd')
+        Schedule.objects.create(user=self.user, course=self.course, day=self.days[0], period=self.periods[0])
+        self.client.force_login(self.user)
+        self.url = reverse('schedule:grid_api', kwargs={'timetable_pk': self.timetable.pk})
+
+    def test_full_payload(self):
+        data = self.client.get(self.url).json()
+        self.assertTrue(data['full'])
+        self.assertEqual(len(data['cells']), 4)
+        cell = next(c for c in data['cells'] if c['schedule'])
+        self.assertEqual(cell['schedule']['course'], {'name': '物理', 'room': '', 'color': '#bae6fd'})
+        self.assertEqual([d['name'] for d in data['days']], ['D0', 'D1'])
+
+    def test_etag_not_modified(self):
+        response = self.client.get(self.url)
+        again = self.client.get(self.url, HTTP_IF_NONE_MATCH=response['ETag'])
+        self.assertEqual(again.status_code, 304)
+
+    def test_since_returns_only_changed_cells(self):
+        version = self.client.get(self.url).json()['version']
+        Task.objects.create(course=self.course, title='演習', due_date=timezone.localdate())
+
+        data = self.client.get(self.url, {'since': version}).json()
+        self.assertFalse(data['full'])
+        self.assertNotEqual(data['version'], version)
+        self.assertEqual([c['key'] for c in data['cells']], [f'{self.days[0].pk}-{self.periods[0].pk}'])
+        self.assertEqual(data['cells'][0]['urgency'], 'today')
+        self.assertEqual(data['totals'], {'total': 1, 'completed': 0})
+
+    def test_structure_change_returns_full_payload(self):
+        version = self.client.get(self.url).json()['version']
+        Day.objects.create(timetable=self.timetable, name='D9', order=9)
+        data = self.client.get(self.url, {'since': version}).json()
+        self.assertTrue(data['full'])
+        self.assertEqual(len(data['cells']), 6)
+
+    def test_other_users_timetable(self):
+        other = User.objects.create_user('other')
+        self.client.force_login(other)
+        self.assertEqual(self.client.get(self.url).status_code, 404)
+
+
+class ConditionalGetTests(ScheduleTestCase):
+    def setUp(self):
+        super().setUp()
+        self.user = User.objects.create_user('etag')
+        _, self.days, self.periods = make_timetable(self.user)
+        self.course = Course.objects.create(name='化学', instructor='野依')
+        self.schedule = Schedule.objects.create(
+            user=self.user, course=self.course, day=self.days[0], period=self.periods[0])
+        self.client.force_login(self.user)
+
+    def assertRevalidates(self, url):
+        self.client.get(url)  # 初回はセッションに時間割が記録される
+        response = self.client.get(url)
+        self.assertEqual(response.status_code, 200)
+        self.assertIn('no-cache', response['Cache-Control'])
+
+        with CaptureQueriesContext(connection) as ctx:
+            again = self.client.get(url, HTTP_IF_NONE_MATCH=response['ETag'])
+        self.assertEqual(again.status_code, 304)
+        self.assertFalse([q for q in ctx.captured_queries if 'schedule_' in q['sql']])
+
+        Task.objects.create(course=self.course, title='実験レポート')
+        self.assertEqual(self.client.get(url, HTTP_IF_NONE_MATCH=response['ETag']).status_code, 200)
+
+    def test_time_table(self):
+        self.assertRevalidates(reverse('schedule:time_table'))
+
+    def test_schedule_detail(self):
+        self.assertRevalidates(reverse('schedule:detail', kwargs={'pk': self.schedule.pk}))
+
+    def test_if_modified_since(self):
+        url = reverse('schedule:time_table')
+        self.client.get(url)
+        response = self.client.get(url)
+        again = self.client.get(url, HTTP_IF_MODIFIED_SINCE=response['Last-Modified'])
+        self.assertEqual(again.status_code, 304)
+
+    def test_validators_are_same_in_every_worker(self):
+        url = reverse('schedule:time_table')
+        self.client.get(url)
+        response = self.client.get(url)
+        self.addCleanup(views.deploy_version.cache_clear)
+        # 別のワーカー（デプロイの識別子を計算し直したプロセス）でも同じ ETag・Last-Modified になる
+        views.deploy_version.cache_clear()
+        with mock.patch.object(views.timezone, 'now', return_value=timezone.now() + timedelta(minutes=5)):
+            again = self.client.get(url, HTTP_IF_NONE_MATCH=response['ETag'])
+        self.assertEqual(again.status_code, 304)
+        self.assertEqual(again['Last-Modified'], response['Last-Modified'])
+
+        views.deploy_version.cache_clear()
+        with override_settings(BUILD_VERSION='new-deploy'):
+            self.assertEqual(self.client.get(url, HTTP_IF_NONE_MATCH=response['ETag']).status_code, 200)
+
+    def test_show_all_has_own_etag(self):
+        url = reverse('schedule:time_table')
+        self.client.get(url)
+        etag = self.client.get(url)['ETag']
+        self.assertEqual(self.client.get(url + '?all=1', HTTP_IF_NONE_MATCH=etag).status_code, 200)
+
+
+@override_settings(SCHEDULE_CACHE_ENABLED=False)
+class ProcessLocalCacheTests(ScheduleTestCase):
+    """プロセスごとのキャッシュでは、他のワーカーでの変更が伝わらないので、キャッシュと ETag を使わない"""
+
+    def setUp(self):
+        super().setUp()
+        self.user = User.objects.create_user('worker')
+        _, self.days, self.periods = make_timetable(self.user)
+        self.course = Course.objects.create(name='物理', instructor='湯川')
+        self.schedule = Schedule.objects.create(
+            user=self.user, course=self.course, day=self.days[0], period=self.periods[0])
+        self.client.force_login(self.user)
+        self.url = reverse('schedule:time_table')
+
+    def test_enabled_only_with_shared_cache(self):
+        self.assertFalse(cache_url.is_shared(cache_url.parse('locmem://')))
+        self.assertFalse(cache_url.is_shared(cache_url.parse('dummy://')))
+        self.assertTrue(cache_url.is_shared(cache_url.parse('file:///var/tmp/cache')))
+        self.assertTrue(cache_url.is_shared(cache_url.parse('redis://127.0.0.1:6379/0')))
+
+    def test_pages_skip_cache_and_etag(self):
+        self.client.get(self.url)
+        response = self.client.get(self.url)
+        self.assertNotIn('ETag', response)
+        self.assertNotIn('Last-Modified', response)
+
+        # 他のワーカーでの変更（update() はシグナルを送らないので、このプロセスのバージョンは変わらない）も、
+        # 次の表示に反映される
+        Course.objects.filter(pk=self.course.pk).update(name='Physics')
+        self.assertContains(self.client.get(self.url), 'Physics')
+        self.assertEqual(schedule_cache.fragment_stats()['grid'], {'hits': 0, 'misses': 0, 'hit_ratio': None})
+
+        detail = self.client.get(reverse('schedule:detail', kwargs={'pk': self.schedule.pk}))
+        self.assertNotIn('ETag', detail)
+
+    def test_calendar_feed_has_no_etag(self):
+        timetable = Timetable.objects.get(user=self.user)
+        response = self.client.get(reverse('schedule:calendar_feed', kwargs={'token': feed_token(timetable)}))
+        self.assertEqual(response.status_code, 200)
+        self.assertNotIn('ETag', response)
+
+    @override_settings(ROOT_URLCONF=ASYNC_URLCONF)
+    async def test_async_views_skip_etag(self):
+        await self.async_client.aforce_login(self.user)
+        response = await self.async_client.get(self.url)
+        self.assertEqual(response.status_code, 200)
+        self.assertNotIn('ETag', response)
+
+
+class CourseTaskCounterTests(ScheduleTestCase):
+    def setUp(self):
+        super().setUp()
+        self.user = User.objects.create_user('counter')
+        _, days, periods = make_timetable(self.user)
+        self.course = Course.objects.create(name='統計学', instructor='林')
+        Schedule.objects.create(user=self.user, course=self.course, day=days[0], period=periods[0])
+        self.today = timezone.localdate()
+
+    def counters(self):
+        self.course.refresh_from_db()
+        return self.course.task_total, self.course.task_completed, self.course.next_due_date
+
+    def test_task_writes_keep_counters(self):
+        later = Task.objects.create(course=self.course, title='期末', due_date=self.today + timedelta(days=10))
+        soon = Task.objects.create(course=self.course, title='小テスト', due_date=self.today + timedelta(days=1))
+        self.assertEqual(self.counters(), (2, 0, soon.due_date))
+
+        self.client.force_login(self.user)
+        self.client.get(reverse('schedule:task_toggle', kwargs={'pk': soon.pk}))
+        self.assertEqual(self.counters(), (2, 1, later.due_date))
+
+        later.delete()
+        self.assertEqual(self.counters(), (1, 1, None))
+
+    def test_grid_reads_counters(self):
+        Task.objects.create(course=self.course, title='課題', due_date=self.today - timedelta(days=1))
+        self.client.force_login(self.user)
+        with CaptureQueriesContext(connection) as ctx:
+            response = self.client.get(reverse('schedule:time_table'))
+        self.assertFalse([q for q in ctx.captured_queries if 'COUNT(' in q['sql']])
+        self.assertEqual(response.context['total_timetable_tasks'], 1)
+        cells = [cell for row in response.context['schedule_data'].values() for cell in row.values()]
+        self.assertIn('overdue', [cell.urgency for cell in cells])
+
+    def test_task_moved_between_courses(self):
+        other = Course.objects.create(name='確率論', instructor='伊藤')
+        task = Task.objects.create(course=self.course, title='課題', due_date=self.today)
+        task = Task.objects.get(pk=task.pk)
+        task.course = other
+        task.save()
+        self.assertEqual(self.counters(), (0, 0, None))
+        other.refresh_from_db()
+        self.assertEqual((other.task_total, other.next_due_date), (1, self.today))
+
+        # 同じインスタンスをもう一度移しても、移す前の授業が更新される
+        task.course = self.course
+        task.save()
+        other.refresh_from_db()
+        self.assertEqual(other.task_total, 0)
+        self.assertEqual(self.counters(), (1, 0, self.today))
+
+    def test_course_update_keeps_counters(self):
+        schedule = Schedule.objects.get(course=self.course)
+        self.client.force_login(self.user)
+        task = Task.objects.create(course=self.course, title='課題', due_date=self.today)
+
+        def load_form_then_toggle(*args, **kwargs):
+            form = CourseForm(*args, **kwargs)
+            # フォームが授業を読み込んだ後に、別のリクエストでタスクが完了にされる
+            self.client.get(reverse('schedule:task_toggle', kwargs={'pk': task.pk}))
+            return form
+
+        with mock.patch('schedule.views.CourseForm', side_effect=load_form_then_toggle):
+            response = self.client.post(reverse('schedule:update', kwargs={'pk': schedule.pk}), {
+                'day': schedule.day_id, 'period': schedule.period_id,
+                'name': '統計学II', 'instructor': '林', 'room': '', 'description': '', 'color': self.course.color,
+            })
+        self.assertEqual(response.status_code, 302)
+        self.assertEqual(self.counters(), (1, 1, None))
+        self.assertEqual(self.course.name, '統計学II')
+
+    def test_rebuild_command(self):
+        Task.objects.create(course=self.course, title='課題', due_date=self.today)
+        Course.objects.filter(pk=self.course.pk).update(task_total=99, task_completed=0, next_due_date=None)
+        with self.assertRaises(CommandError):
+            call_command('rebuild_task_counters', '--check', stdout=io.StringIO())
+        call_command('rebuild_task_counters', stdout=io.StringIO())
+        self.assertEqual(self.counters(), (1, 0, self.today))
+        call_command('rebuild_task_counters', '--check', stdout=io.StringIO())
+
+
+class TaskEndpointTests(ScheduleTestCase):
+    def setUp(self):
+        super().setUp()
+        self.user = User.objects.create_user('owner')
+        _, days, periods = make_timetable(self.user)
+        self.course = Course.objects.create(name='線形代数')
+        self.schedule = Schedule.objects.create(user=self.user, course=self.course, day=days[0], period=periods[0])
+        self.tasks = [Task.objects.create(course=self.course, title=f'課題{i}') for i in range(3)]
+        self.client.force_login(self.user)
+
+    def test_toggle_is_single_conditional_update(self):
+        url = reverse('schedule:task_toggle', kwargs={'pk': self.tasks[0].pk})
+        with CaptureQueriesContext(connection) as ctx:
+            response = self.client.get(url)
+        self.assertRedirects(response, reverse('schedule:detail', kwargs={'pk': self.schedule.pk}),
+                             fetch_redirect_response=False)
+        task_queries = [q['sql'] for q in ctx.captured_queries if 'schedule_task' in q['sql']]
+        # 所有者の確認と戻り先の検索で SELECT 1回、反転で UPDATE 1回（あとは集計値の更新のみ）
+        self.assertEqual(len([sql for sql in task_queries if sql.startswith('SELECT')]), 1)
+        self.assertEqual(len([sql for sql in task_queries if sql.startswith('UPDATE "schedule_task"')]), 1)
+        self.assertTrue(Task.objects.get(pk=self.tasks[0].pk).is_completed)
+        self.client.get(url)
+        self.assertFalse(Task.objects.get(pk=self.tasks[0].pk).is_completed)
+
+    def test_other_users_tasks_are_not_found(self):
+        self.client.force_login(User.objects.create_user('intruder'))
+        for name in ('task_toggle', 'task_edit', 'task_delete'):
+            response = self.client.get(reverse(f'schedule:{name}', kwargs={'pk': self.tasks[0].pk}))
+            self.assertEqual(response.status_code, 404)
+        self.assertEqual(Task.objects.count(), 3)
+
+    def test_batch_toggle_and_delete(self):
+        other_course = Course.objects.create(name='他人の授業')
+        other = Task.objects.create(course=other_course, title='対象外')
+        ids = [self.tasks[0].pk, self.tasks[1].pk, other.pk]
+        next_url = reverse('schedule:detail', kwargs={'pk': self.schedule.pk})
+
+        response = self.client.post(reverse('schedule:task_batch'),
+                                    {'action': 'toggle', 'task_ids': ids, 'next': next_url})
+        self.assertRedirects(response, next_url, fetch_redirect_response=False)
+        self.assertEqual(set(Task.objects.filter(is_completed=True).values_list('pk', flat=True)),
+                         {self.tasks[0].pk, self.tasks[1].pk})
+        self.course.refresh_from_db()
+        self.assertEqual((self.course.task_total, self.course.task_completed), (3, 2))
+
+        with CaptureQueriesContext(connection) as ctx:
+            self.client.post(reverse('schedule:task_batch'), {'action': 'delete', 'task_ids': ids})
+        # 件数に関係なく、集計値の更新は1回だけ
+        self.assertEqual(len([q for q in ctx.captured_queries if q['sql'].startswith('UPDATE "schedule_course"')]), 1)
+        self.assertEqual(list(Task.objects.values_list('pk', flat=True).order_by('pk')), [self.tasks[2].pk, other.pk])
+        self.course.refresh_from_db()
+        self.assertEqual((self.course.task_total, self.course.task_completed), (1, 0))
+
+    def test_batch_rejects_unknown_action(self):
+        response = self.client.post(reverse('schedule:task_batch'), {'action': 'archive', 'task_ids': [self.tasks[0].pk]})
+        self.assertEqual(response.status_code, 400)
+
+
+class TaskBulkApiTests(ScheduleTestCase):
+    def setUp(self):
+        super().setUp()
+        self.user = User.objects.create_user('bulk')
+        _, days, periods = make_timetable(self.user)
+        self.today = timezone.localdate()
+        self.course = Course.objects.create(name='有機化学')
+        # 同じ授業を2コマに登録しても、ToDoが重複して処理されないこと
+        for period in periods[:2]:
+            Schedule.objects.create(user=self.user, course=self.course, day=days[0], period=period)
+        self.tasks = [
+            Task.objects.create(course=self.course, title=f'レポート{i}', due_date=self.today + timedelta(days=i))
+            for i in range(4)
+        ]
+        self.undated = Task.objects.create(course=self.course, title='期限なし')
+        self.client.force_login(self.user)
+
+    def post(self, body):
+        return self.client.post(reverse('schedule:task_bulk_api'), json.dumps(body), content_type='application/json')
+
+    def test_complete_returns_new_counts(self):
+        ids = [task.pk for task in self.tasks[:3]]
+        with CaptureQueriesContext(connection) as ctx:
+            response = self.post({'action': 'complete', 'task_ids': ids})
+        self.assertEqual(response.status_code, 200)
+        body = response.json()
+        self.assertEqual(body['changed'], 3)
+        self.assertEqual(body['courses'], [{
+            'id': self.course.pk, 'task_total': 5, 'task_completed': 3,
+            'next_due_date': self.tasks[3].due_date.isoformat(),
+        }])
+        self.assertEqual(body['version'], str(schedule_cache.get_user_version(self.user.pk)))
+        # ToDo の UPDATE と授業の集計値の UPDATE はそれぞれ1回
+        updates = [q['sql'] for q in ctx.captured_queries if q['sql'].startswith('UPDATE')]
+        self.assertEqual(len([sql for sql in updates if 'schedule_task' in sql.split('SET')[0]]), 1)
+        self.assertEqual(len([sql for sql in updates if 'schedule_course' in sql.split('SET')[0]]), 1)
+
+        response = self.post({'action': 'uncomplete', 'task_ids': ids})
+        self.assertEqual(response.json()['courses'][0]['task_completed'], 0)
+
+    def test_shift_due_dates(self):
+        response = self.post({'action': 'shift', 'days': 7, 'task_ids': [self.tasks[0].pk, self.undated.pk]})
+        self.assertEqual(response.json()['changed'], 1)
+        self.tasks[0].refresh_from_db()
+        self.assertEqual(self.tasks[0].due_date, self.today + timedelta(days=7))
+        self.assertIsNone(Task.objects.get(pk=self.undated.pk).due_date)
+
+        self.post({'action': 'shift', 'days': -2, 'task_ids': [self.tasks[0].pk]})
+        self.tasks[0].refresh_from_db()
+        self.assertEqual(self.tasks[0].due_date, self.today + timedelta(days=5))
+
+    def test_delete_only_own_tasks(self):
+        stranger = Task.objects.create(course=Course.objects.create(name='別の授業'), title='他人のToDo')
+        response = self.post({'action': 'delete', 'task_ids': [self.tasks[0].pk, stranger.pk]})
+        self.assertEqual(response.json()['changed'], 1)
+        self.assertTrue(Task.objects.filter(pk=stranger.pk).exists())
+        self.assertFalse(Task.objects.filter(pk=self.tasks[0].pk).exists())
+        self.assertEqual(response.json()['courses'][0]['task_total'], 4)
+
+    def test_invalid_requests(self):
+        for body in ({'action': 'archive', 'task_ids': [1]}, {'action': 'complete', 'task_ids': 'all'},
+                     {'action': 'shift', 'task_ids': [1]}, ['complete']):
+            self.assertEqual(self.post(body).status_code, 400, body)
+        response = self.client.post(reverse('schedule:task_bulk_api'), 'not json', content_type='application/json')
+        self.assertEqual(response.status_code, 400)
+
+
+class TodoDashboardTests(ScheduleTestCase):
+    def setUp(self):
+        super().setUp()
+        self.user = User.objects.create_user('dashboard')
+        self.today = timezone.localdate()
+        self.first, days, periods = make_timetable(self.user)
+        self.second, days2, periods2 = make_timetable(self.user, name='後期', is_default=False)
+        self.math = Course.objects.create(name='数学')
+        self.english = Course.objects.create(name='英語')
+        Schedule.objects.create(user=self.user, course=self.math, day=days[0], period=periods[0])
+        Schedule.objects.create(user=self.user, course=self.english, day=days2[0], period=periods2[0])
+        offsets = [-3, 0, 3, 10, None, -1, None, 2]
+        self.tasks = [
+            Task.objects.create(course=self.math if i % 2 else self.english, title=f'課題{i}',
+                                due_date=None if offset is None else self.today + timedelta(days=offset),
+                                is_completed=i == 7)
+            for i, offset in enumerate(offsets)
+        ]
+        # ほかのユーザーのToDoは表示しない
+        Task.objects.create(course=Course.objects.create(name='他人'), title='他人の課題', due_date=self.today)
+        self.client.force_login(self.user)
+
+    def expected_order(self, tasks):
+        return [task.pk for task in sorted(
+            tasks, key=lambda t: (t.is_completed, t.due_date is None, t.due_date or self.today, t.pk))]
+
+    def walk(self, query, page_size):
+        """カーソルをたどって全ページのToDoを集める"""
+        seen, cursor = [], None
+        with mock.patch.object(todos, 'PAGE_SIZE', page_size):
+            while True:
+                params = dict(query, **({'cursor': cursor} if cursor else {}))
+                response = self.client.get(reverse('schedule:todo_dashboard'), params)
+                self.assertLessEqual(len(response.context['tasks']), page_size)
+                seen += [task.pk for task in response.context['tasks']]
+                if not response.context['next_query']:
+                    return seen
+                cursor = QueryDict(response.context['next_query'])['cursor']
+
+    def test_keyset_pages_cover_every_task_once(self):
+        open_tasks = [task for task in self.tasks if not task.is_completed]
+        for page_size in (1, 2, 3, 50):
+            self.assertEqual(self.walk({}, page_size), self.expected_order(open_tasks), page_size)
+        self.assertEqual(self.walk({'all': 'on'}, 2), self.expected_order(self.tasks))
+
+    def test_urgency_is_computed_in_sql(self):
+        response = self.client.get(reverse('schedule:todo_dashboard'), {'all': 'on'})
+        next_week = self.today + timedelta(days=7)
+        for task in response.context['tasks']:
+            expected = None if task.is_completed else get_urgency(task.due_date, self.today, next_week)
+            self.assertEqual(task.urgency, expected, task.title)
+
+    def test_filters(self):
+        def titles(**params):
+            response = self.client.get(reverse('schedule:todo_dashboard'), params)
+            return {task.title for task in response.context['tasks']}
+
+        self.assertEqual(titles(urgency='overdue'), {'課題0', '課題5'})
+        self.assertEqual(titles(urgency='today'), {'課題1'})
+        self.assertEqual(titles(urgency='weekly'), {'課題2'})
+        self.assertEqual(titles(urgency='later'), {'課題3', '課題4', '課題6'})
+        self.assertEqual(titles(urgency='done'), {'課題7'})
+        self.assertEqual(titles(course=self.math.pk), {'課題1', '課題3', '課題5'})
+        self.assertEqual(titles(timetable=self.second.pk), {'課題0', '課題2', '課題4', '課題6'})
+
+    def test_query_count_does_not_grow(self):
+        url = reverse('schedule:todo_dashboard')
+        with CaptureQueriesContext(connection) as small:
+            self.client.get(url)
+        Task.objects.bulk_create([Task(course=self.math, title=f'追加{i}') for i in range(200)])
+        with CaptureQueriesContext(connection) as large:
+            response = self.client.get(url)
+        self.assertEqual(len(large.captured_queries), len(small.captured_queries))
+        self.assertEqual(len(response.context['tasks']), todos.PAGE_SIZE)
+
+    def test_invalid_cursor_shows_first_page(self):
+        response = self.client.get(reverse('schedule:todo_dashboard'), {'cursor': '!!'})
+        self.assertEqual(response.status_code, 200)
+        self.assertIsNone(response.context['first_query'])
+
+    def test_time_table_links_to_dashboard_when_truncated(self):
+        Task.objects.bulk_create([Task(course=self.math, title=f'追加{i}') for i in range(TODO_PREVIEW_LIMIT)])
+        response = self.client.get(reverse('schedule:time_table_with_pk', kwargs={'timetable_pk': self.first.pk}))
+        self.assertEqual(len(response.context['upcoming_todos']), TODO_PREVIEW_LIMIT)
+        self.assertTrue(response.context['more_todos'])
+        self.assertContains(response, reverse('schedule:todo_dashboard'))
+
+
+class CalendarFeedTests(ScheduleTestCase):
+    def setUp(self):
+        super().setUp()
+        self.user = User.objects.create_user('ical')
+        self.timetable, days, periods = make_timetable(self.user)
+        Day.objects.filter(pk=days[1].pk).update(name='火曜')
+        self.course = Course.objects.create(name='線形代数, 第2部', instructor='高木', room='A101')
+        Schedule.objects.create(user=self.user, course=self.course, day=days[1], period=periods[0])
+        self.today = timezone.localdate()
+        Task.objects.create(course=self.course, title='レポート', due_date=self.today)
+        Task.objects.create(course=self.course, title='済み', due_date=self.today, is_completed=True)
+        self.url = reverse('schedule:calendar_feed', kwargs={'token': feed_token(self.timetable)})
+
+    def get_body(self, response):
+        return b''.join(response.streaming_content).decode()
+
+    def test_feed_without_session(self):
+        response = self.client.get(self.url)
+        self.assertEqual(response.status_code, 200)
+        self.assertTrue(response.streaming)
+        self.assertTrue(response['Content-Type'].startswith('text/calendar'))
+        body = self.get_body(response)
+        self.assertTrue(body.startswith('BEGIN:VCALENDAR\r\n'))
+        self.assertTrue(body.endswith('END:VCALENDAR\r\n'))
+        self.assertEqual(body.count('BEGIN:VEVENT'), 2)
+        self.assertIn('RRULE:FREQ=WEEKLY;BYDAY=TU', body)
+        self.assertIn(f'DTSTART;TZID={settings.TIME_ZONE}:', body)
+        self.assertIn(f'BEGIN:VTIMEZONE\r\nTZID:{settings.TIME_ZONE}\r\n', body)
+        self.assertIn('SUMMARY:線形代数\\, 第2部', body)
+        self.assertIn(f'DTSTART;VALUE=DATE:{self.today:%Y%m%d}', body)
+        self.assertNotIn('済み', body)
+
+    def test_not_modified_checks_only_key(self):
+        response = self.client.get(self.url)
+        self.get_body(response)
+        with CaptureQueriesContext(connection) as ctx:
+            again = self.client.get(self.url, HTTP_IF_NONE_MATCH=response['ETag'])
+        self.assertEqual(again.status_code, 304)
+        self.assertEqual(len(ctx.captured_queries), 1)
+        self.assertIn('schedule_calendarfeedkey', ctx.captured_queries[0]['sql'])
+
+        Task.objects.create(course=self.course, title='小テスト', due_date=self.today)
+        self.assertEqual(self.client.get(self.url, HTTP_IF_NONE_MATCH=response['ETag']).status_code, 200)
+
+    def test_invalid_token(self):
+        self.assertEqual(self.client.get(self.url.replace('.ics', 'x.ics')).status_code, 404)
+        Schedule.objects.filter(user=self.user).delete()
+        self.timetable.delete()
+        self.assertEqual(self.client.get(self.url).status_code, 404)
+
+    def test_rotated_key_invalidates_urls(self):
+        self.assertEqual(self.client.get(self.url).status_code, 200)
+        self.client.force_login(self.user)
+        response = self.client.post(reverse('schedule:calendar_feed_rotate'))
+        self.assertRedirects(response, reverse('schedule:timetable_list'))
+        self.assertEqual(self.client.get(self.url).status_code, 404)
+
+        new_url = reverse('schedule:calendar_feed', kwargs={'token': feed_token(self.timetable)})
+        self.assertNotEqual(new_url, self.url)
+        self.assertEqual(self.client.get(new_url).status_code, 200)
+        self.assertContains(self.client.get(reverse('schedule:timetable_list')), new_url)
+
+    def test_vtimezone_lists_dst_transitions(self):
+        self.assertEqual(
+            [line for line in vtimezone('Asia/Tokyo', date(2026, 4, 1)) if line.startswith(('BEGIN', 'TZOFFSET'))],
+            ['BEGIN:VTIMEZONE', 'BEGIN:STANDARD', 'TZOFFSETFROM:+0900', 'TZOFFSETTO:+0900'],
+        )
+        lines = vtimezone('America/New_York', date(2026, 4, 1))
+        # 2026年11月1日 2:00 (EDT) に標準時へ戻る
+        start = lines.index('DTSTART:20261101T020000')
+        self.assertEqual(lines[start - 1:start + 3],
+                         ('BEGIN:STANDARD', 'DTSTART:20261101T020000', 'TZOFFSETFROM:-0400', 'TZOFFSETTO:-0500'))
+        self.assertIn('BEGIN:DAYLIGHT', lines)
+
+    def test_long_lines_are_folded(self):
+        line = 'DESCRIPTION:' + 'あ' * 40
+        folded = fold(line)
+        self.assertTrue(all(len(part.encode()) <= 75 for part in folded.split('\r\n')))
+        self.assertEqual(folded.replace('\r\n ', '').rstrip('\r\n'), line)
+
+
+class ImportTests(ScheduleTestCase):
+    CSV = (
+        'day,period,name,instructor,room,color,task_title,task_due_date,task_completed\n'
+        'D0,P0,英語,Smith,A1,#fbcfe8,単語テスト,2030-04-10,\n'
+        'D0,P0,英語,Smith,,,エッセイ,2030-04-20,1\n'
+        'D1,P0,数学,高橋,B2,,,,\n'
+        'D9,P0,物理,湯川,,,,,\n'
+        'D1,P0,化学,野依,,,,,\n'
+        'D1,P1,化学,野依,,#123456,,,\n'
+        'D0,P1,歴史,山田,,,課題,昨日,\n'
+    )
+
+    def setUp(self):
+        super().setUp()
+        self.user = User.objects.create_user('importer')
+        self.timetable, self.days, self.periods = make_timetable(self.user)
+
+    def run_import(self, content, fmt='csv', **kwargs):
+        return import_file(self.user, self.timetable, io.BytesIO(content.encode('utf-8-sig')), fmt, **kwargs)
+
+    def test_csv_rows_and_errors(self):
+        report = self.run_import(self.CSV)
+        self.assertEqual((report.rows, report.courses, report.schedules, report.tasks), (3, 2, 2, 2))
+        self.assertEqual([line for line, _ in report.errors], [5, 6, 7, 8])
+
+        english = Course.objects.get(name='英語')
+        self.assertEqual((english.room, english.color), ('A1', '#fbcfe8'))
+        self.assertEqual((english.task_total, english.task_completed), (2, 1))
+        self.assertEqual(Schedule.objects.filter(user=self.user).count(), 2)
+
+    def test_queries_do_not_grow_with_rows(self):
+        rows = ''.join(f'D{i % 2},P{i // 2 % 2},授業{i // 2 % 2}{i % 2},先生,,,課題{i},,\n' for i in range(40))
+        content = 'day,period,name,instructor,room,color,task_title,task_due_date,task_completed\n' + rows
+        with CaptureQueriesContext(connection) as ctx:
+            report = self.run_import(content, batch_size=10)
+        self.assertTrue(report.ok)
+        self.assertEqual((report.schedules, report.tasks), (4, 40))
+        # 準備3回 + まとまりごとに (SAVEPOINT/RELEASE と INSERT 最大3回) + 集計値の更新1回
+        self.assertLessEqual(len(ctx.captured_queries), 3 + 4 * 5 + 1)
+
+    def test_counters_refreshed_in_batches(self):
+        rows = ''.join(f'D{i % 2},P{i // 2 % 2},授業{i},先生,,,課題{i},,\n' for i in range(4))
+        content = 'day,period,name,instructor,room,color,task_title,task_due_date,task_completed\n' + rows
+        with mock.patch('schedule.importer.refresh_course_counters') as refresh:
+            self.assertTrue(self.run_import(content, batch_size=3).ok)
+        self.assertEqual([len(call.args) for call in refresh.call_args_list], [3, 1])
+
+    def test_json_array_is_read_in_chunks(self):
+        records = [
+            {'day': 'D0', 'period': 'P0', 'name': '英語', 'instructor': 'Smith', 'task_title': f'課題{i}'}
+            for i in range(5)
+        ] + ['不正な行']
+        with mock.patch('schedule.importer.READ_CHUNK_SIZE', 16):
+            report = self.run_import(json.dumps(records, ensure_ascii=False), fmt='json')
+        self.assertEqual((report.rows, report.tasks), (5, 5))
+        self.assertEqual(report.errors, [(6, '行の形式が正しくありません')])
+
+    def test_broken_json_element_stops_reading(self):
+        record = json.dumps({'day': 'D0', 'period': 'P0', 'name': '英語', 'instructor': 'Smith'})
+        stream = io.StringIO('[' + record + ', {"day": D0}, ' + ', '.join([record] * 1000) + ']')
+        with mock.patch('schedule.importer.READ_CHUNK_SIZE', 64), mock.patch('schedule.importer.MAX_RECORD_SIZE', 256):
+            rows = iter_json(stream)
+            self.assertEqual(next(rows)[0], 1)
+            with self.assertRaisesMessage(ImportFileError, '2件目'):
+                next(rows)
+        # 壊れた要素の後ろは、上限の分しか読んでいない
+        self.assertLess(stream.tell(), 512)
+
+    def test_json_lines_and_broken_file(self):
+        content = '\n'.join([
+            json.dumps({'day': 'D0', 'period': 'P0', 'name': '英語', 'instructor': 'Smith'}),
+            json.dumps({'day': 'D1', 'period': 'P1', 'name': '数学', 'instructor': '高橋'}),
+            '{"day": ',
+        ])
+        report = self.run_import(content, fmt='json')
+        self.assertEqual(report.schedules, 2)
+        self.assertEqual(report.errors[0][0], None)
+
+    def test_upload_view(self):
+        self.client.force_login(self.user)
+        url = reverse('schedule:timetable_import', kwargs={'timetable_pk': self.timetable.pk})
+        self.assertEqual(self.client.get(url).status_code, 200)
+        upload = SimpleUploadedFile('semester.csv', self.CSV.encode())
+        response = self.client.post(url, {'file': upload})
+        self.assertContains(response, '一部の行を取り込めませんでした')
+        self.assertEqual(response.context['report'].schedules, 2)
+
+        other = User.objects.create_user('other')
+        self.client.force_login(other)
+        self.assertEqual(self.client.get(url).status_code, 404)
+
+    def test_command_for_cohort(self):
+        User.objects.create_user('student2')
+        with tempfile.NamedTemporaryFile('w', suffix='.csv', encoding='utf-8', delete=False) as f:
+            f.write('day,period,name,instructor\n月,1限,英語,Smith\n火,2限,数学,高橋\n')
+        self.addCleanup(os.remove, f.name)
+        out = io.StringIO()
+        call_command('import_schedule', f.name, '--user', 'importer', '--user', 'student2',
+                     '--timetable', '新学期', stdout=out)
+        for username in ('importer', 'student2'):
+            self.assertEqual(Schedule.objects.filter(user__username=username, day__timetable__name='新学期').count(), 2)
+        # 学生ごとに別の授業として登録される
+        self.assertEqual(Course.objects.filter(name='英語').count(), 2)
+
+
+class ExportTests(ScheduleTestCase):
+    def setUp(self):
+        super().setUp()
+        self.user = User.objects.create_user('exporter')
+        self.timetable, days, periods = make_timetable(self.user, days=2, periods=2)
+        fill_schedules(self.user, days, periods, tasks_per_course=3)
+        make_timetable(self.user, name='後期', is_default=False)
+        self.other = User.objects.create_user('restored')
+
+    def export(self, compress=False):
+        return b''.join(iter_export(self.user, compress=compress))
+
+    def snapshot(self, user):
+        """比較用に、ユーザーのデータを主キーに依存しない形にする"""
+        return {
+            'timetables': sorted(Timetable.objects.filter(user=user).values_list('name', 'is_default')),
+            'slots': sorted(Schedule.objects.filter(user=user).values_list(
+                'day__timetable__name', 'day__name', 'period__name', 'course__name')),
+            'tasks': sorted(Task.objects.filter(course__schedule__user=user).values_list(
+                'course__name', 'title', 'due_date', 'is_completed')),
+            'counters': sorted(Course.objects.filter(schedule__user=user).values_list(
+                'name', 'task_total', 'task_completed', 'next_due_date')),
+        }
+
+    def test_round_trip(self):
+        for compress in (False, True):
+            with self.subTest(compress=compress):
+                Schedule.objects.filter(user=self.other).delete()
+                Timetable.objects.filter(user=self.other).delete()
+                report = restore_file(self.other, io.BytesIO(self.export(compress)))
+                self.assertTrue(report.ok, report.errors)
+                self.assertEqual((report.timetables, report.courses, report.tasks), (2, 4, 12))
+                self.assertEqual(self.snapshot(self.other), self.snapshot(self.user))
+
+    def test_one_query_per_model(self):
+        with CaptureQueriesContext(connection) as ctx:
+            lines = self.export().splitlines()
+        self.assertEqual(len(ctx.captured_queries), 6)
+        self.assertEqual(json.loads(lines[0])['model'], 'export')
+        self.assertEqual(len(lines), 1 + 2 + 4 + 4 + 4 + 4 + 12)
+
+    def test_restore_into_same_user_renames(self):
+        report = restore_file(self.user, io.BytesIO(self.export()))
+        self.assertTrue(report.ok)
+        names = set(Timetable.objects.filter(user=self.user).values_list('name', flat=True))
+        self.assertEqual(names, {'前期', '後期', '前期 (2)', '後期 (2)'})
+        self.assertEqual(Timetable.objects.filter(user=self.user, is_default=True).count(), 1)
+
+    def test_truncated_file_restores_nothing(self):
+        data = self.export(compress=True)
+        report = restore_file(self.other, io.BytesIO(data[:len(data) // 2]))
+        self.assertFalse(report.ok)
+        self.assertFalse(Timetable.objects.filter(user=self.other).exists())
+
+    def restore_records(self, records):
+        header = {'model': 'export', 'version': EXPORT_VERSION}
+        content = '\n'.join(json.dumps(record, ensure_ascii=False) for record in [header, *records])
+        return restore_file(self.other, io.BytesIO(content.encode()))
+
+    def test_invalid_records_are_row_errors(self):
+        report = self.restore_records([
+            {'model': 'timetable', 'id': 1, 'name': '前期', 'is_default': True},
+            {'model': 'timetable', 'id': 2, 'name': 'x' * 101, 'is_default': False},
+            {'model': 'course', 'id': 1, 'name': None, 'instructor': '林'},
+            {'model': 'course', 'id': 2, 'name': '統計学', 'instructor': '林', 'color': 'red'},
+            {'model': 'course', 'id': 3, 'name': '英語', 'instructor': 'Smith'},
+        ])
+        self.assertEqual([line for line, _ in report.errors], [3, 4, 5])
+        self.assertIn('時間割名', report.errors[0][1])
+        self.assertEqual((report.timetables, report.courses), (1, 1))
+        self.assertTrue(Course.objects.filter(name='英語').exists())
+
+    def test_database_error_restores_nothing(self):
+        # 同じ順番の曜日は検証を通るが、一意制約で保存できない
+        report = self.restore_records([
+            {'model': 'timetable', 'id': 1, 'name': '前期', 'is_default': True},
+            {'model': 'day', 'id': 1, 'timetable': 1, 'name': '月', 'order': 1},
+            {'model': 'day', 'id': 2, 'timetable': 1, 'name': '火', 'order': 1},
+        ])
+        self.assertFalse(report.ok)
+        self.assertIn('データを保存できませんでした', report.errors[-1][1])
+        self.assertFalse(Timetable.objects.filter(user=self.other).exists())
+
+    def test_corrupted_gzip_restores_nothing(self):
+        data = bytearray(self.export(compress=True))
+        # ヘッダー (10バイト) の後ろの圧縮データを壊す
+        for i in range(20, 60):
+            data[i] ^= 0xff
+        with tempfile.TemporaryDirectory() as directory:
+            path = os.path.join(directory, 'backup.ndjson.gz')
+            with open(path, 'wb') as f:
+                f.write(data)
+            with open(path, 'rb') as f:
+                report = restore_file(self.other, f)
+        self.assertFalse(report.ok)
+        self.assertIn('ファイルを最後まで読み込めませんでした', report.errors[-1][1])
+        self.assertFalse(Timetable.objects.filter(user=self.other).exists())
+
+    def test_download_view(self):
+        self.client.force_login(self.user)
+        response = self.client.get(reverse('schedule:data_export') + '?format=gzip')
+        self.assertTrue(response.streaming)
+        self.assertIn('attachment;', response['Content-Disposition'])
+        self.assertEqual(b''.join(response.streaming_content)[:2], b'\x1f\x8b')
+
+    def test_commands_round_trip(self):
+        with tempfile.TemporaryDirectory() as directory:
+            path = os.path.join(directory, 'backup.ndjson.gz')
+            call_command('export_schedule', '--user', 'exporter', '--output', path, stderr=io.StringIO())
+            call_command('import_schedule', path, '--user', 'restored', stdout=io.StringIO())
+        self.assertEqual(self.snapshot(self.other), self.snapshot(self.user))
+
+
+class StaticAssetTests(ScheduleTestCase):
+    def test_every_course_color_has_a_class(self):
+        with open(finders.find('schedule/css/time_table.css'), encoding='utf-8') as f:
+            css = f.read()
+        for color, _ in Course.COLOR_CHOICES:
+            course = Course(name='色', color=color)
+            self.assertIn(f'.{course.color_class} {{ background-color: {color}; }}', css)
+        self.assertEqual(Course(name='色', color='#123456').color_class, 'course-color-e2e8f0')
+
+    def test_collectstatic_precompresses_and_serves_immutable(self):
+        storages = {**settings.STORAGES, 'staticfiles': {
+            'BACKEND': 'whitenoise.storage.CompressedManifestStaticFilesStorage'}}
+        with tempfile.TemporaryDirectory() as root, override_settings(STATIC_ROOT=root, STORAGES=storages):
+            call_command('collectstatic', interactive=False, verbosity=0)
+            url = static('schedule/css/time_table.css')
+            self.assertRegex(url, r'time_table\.[0-9a-f]{12}\.css$')
+            path = os.path.join(root, url.removeprefix(settings.STATIC_URL))
+            self.assertTrue(os.path.exists(path + '.gz'))
+            if importlib.util.find_spec('brotli'):
+                self.assertTrue(os.path.exists(path + '.br'))
+
+            # WhiteNoise はハッシュ付きのファイルを1年間キャッシュさせる
+            response = Client().get(url, HTTP_ACCEPT_ENCODING='gzip')
+            self.assertEqual(response.status_code, 200)
+            self.assertIn('immutable', response['Cache-Control'])
+            self.assertEqual(response['Content-Encoding'], 'gzip')
+            response.close()
+
+
+@override_settings(SCHEDULE_COMPRESSION=True, SCHEDULE_COMPRESSION_MIN_SIZE=200)
+class CompressionTests(ScheduleTestCase):
+    def setUp(self):
+        super().setUp()
+        self.user = User.objects.create_user('zip')
+        self.timetable, days, periods = make_timetable(self.user, days=3, periods=3)
+        fill_schedules(self.user, days, periods, tasks_per_course=2)
+        self.client.force_login(self.user)
+        self.grid_url = reverse('schedule:grid_api', kwargs={'timetable_pk': self.timetable.pk})
+
+    def test_accepted_encodings(self):
+        self.assertEqual(accepted_encodings('gzip, deflate, br;q=0.5'), {'gzip', 'deflate', 'br'})
+        self.assertEqual(accepted_encodings('br;q=0, GZIP'), {'gzip'})
+        self.assertEqual(accepted_encodings(''), set())
+        self.assertIsNone(choose_encoding({'deflate'}))
+        self.assertEqual(choose_encoding({'br', 'gzip'}, breach_sensitive=True), 'gzip')
+
+    @override_settings(SCHEDULE_COMPRESSION=False)
+    def test_disabled_by_default(self):
+        response = self.client.get(self.grid_url, HTTP_ACCEPT_ENCODING='gzip')
+        self.assertFalse(response.has_header('Content-Encoding'))
+
+    def test_gzip_json_keeps_conditional_get(self):
+        response = self.client.get(self.grid_url, HTTP_ACCEPT_ENCODING='gzip')
+        self.assertEqual(response['Content-Encoding'], 'gzip')
+        self.assertIn('Accept-Encoding', response['Vary'])
+        self.assertEqual(json.loads(gzip.decompress(response.content))['full'], True)
+        self.assertTrue(response['ETag'].startswith('W/"'))
+
+        not_modified = self.client.get(self.grid_url, HTTP_ACCEPT_ENCODING='gzip', HTTP_IF_NONE_MATCH=response['ETag'])
+        self.assertEqual(not_modified.status_code, 304)
+
+    @unittest.skipUnless(importlib.util.find_spec('brotli'), 'Brotli がインストールされていない')
+    def test_brotli_preferred_without_csrf_token(self):
+        import brotli
+
+        response = self.client.get(self.grid_url, HTTP_ACCEPT_ENCODING='gzip, br')
+        self.assertEqual(response['Content-Encoding'], 'br')
+        self.assertEqual(json.loads(brotli.decompress(response.content))['full'], True)
+
+    def test_pages_with_csrf_token_use_padded_gzip(self):
+        response = self.client.get(reverse('schedule:time_table'), HTTP_ACCEPT_ENCODING='br, gzip')
+        self.assertEqual(response['Content-Encoding'], 'gzip')
+        # gzip のヘッダーの FNAME フラグ（ランダムな長さのファイル名）
+        self.assertTrue(response.content[3] & 0x08)
+        self.assertIn(b'csrfmiddlewaretoken', gzip.decompress(response.content))
+
+    def test_skips_small_streaming_and_unaccepted(self):
+        with override_settings(SCHEDULE_COMPRESSION_MIN_SIZE=10 ** 6):
+            self.assertFalse(Client().get(self.grid_url, HTTP_ACCEPT_ENCODING='gzip').has_header('Content-Encoding'))
+
+        feed = self.client.get(reverse('schedule:calendar_feed', kwargs={'token': feed_token(self.timetable)}),
+                               HTTP_ACCEPT_ENCODING='gzip')
+        self.assertTrue(feed.streaming)
+        self.assertFalse(feed.has_header('Content-Encoding'))
+
+        self.assertFalse(self.client.get(self.grid_url, HTTP_ACCEPT_ENCODING='deflate').has_header('Content-Encoding'))
+
+    def test_strip_whitespace(self):
+        self.assertEqual(strip_whitespace('<div>\n    <p>{{ a }}</p>\n\n\t</div>\n'), '<div>\n<p>{{ a }}</p>\n</div>\n')
+        source = '<pre>\n    code\n</pre>'
+        self.assertEqual(strip_whitespace(source), source)
+
+    def test_whitespace_loader(self):
+        base = settings.TEMPLATES[0]
+        loaders = [('schedule.loaders.Loader', ['django.template.loaders.filesystem.Loader',
+                                                'django.template.loaders.app_directories.Loader'])]
+        templates = [{**base, 'OPTIONS': {**base['OPTIONS'], 'loaders': [('django.template.loaders.cached.Loader', loaders)]}}]
+        with override_settings(SCHEDULE_COMPRESSION=False, SCHEDULE_FRAGMENT_CACHE=False):
+            original = self.client.get(reverse('schedule:time_table')).content
+            with override_settings(TEMPLATES=templates):
+                stripped = self.client.get(reverse('schedule:time_table')).content
+        self.assertLess(len(stripped), len(original) * 0.8)
+        self.assertNotIn(b'\n    <', stripped)
+        self.assertIn('class="course-name"'.encode(), stripped)
+
+
+class SessionTests(ScheduleTestCase):
+    def setUp(self):
+        super().setUp()
+        self.user = User.objects.create_user('session')
+        self.timetable, _, _ = make_timetable(self.user)
+        self.client.force_login(self.user)
+
+    def test_engine_from_environment(self):
+        with mock.patch.dict(os.environ, {'SESSION_BACKEND': ''}):
+            self.assertEqual(session_config.engine(), 'django.contrib.sessions.backends.db')
+        with mock.patch.dict(os.environ, {'SESSION_BACKEND': 'signed_cookies'}):
+            self.assertEqual(session_config.engine(), 'django.contrib.sessions.backends.signed_cookies')
+        with mock.patch.dict(os.environ, {'SESSION_BACKEND': 'files'}), self.assertRaises(ValueError):
+            session_config.engine()
+
+    def test_cache_engines_require_shared_cache(self):
+        # プロセスごとのキャッシュでは、ログアウトが他のワーカーに伝わらないので使わせない
+        for name in ('cached_db', 'cache'):
+            with mock.patch.dict(os.environ, {'SESSION_BACKEND': name}):
+                with self.assertRaises(ValueError):
+                    session_config.engine()
+                self.assertEqual(session_config.engine(shared_cache=True), session_config.ENGINES[name])
+
+    @override_settings(SESSION_ENGINE='django.contrib.sessions.backends.db')
+    def test_unchanged_timetable_is_not_written(self):
+        self.client.force_login(self.user)
+        url = reverse('schedule:time_table')
+        self.client.get(url)
+        self.assertEqual(self.client.session['current_timetable_pk'], self.timetable.pk)
+
+        with CaptureQueriesContext(connection) as ctx:
+            self.client.get(url)
+        self.assertFalse([q for q in ctx.captured_queries if q['sql'].startswith('UPDATE "django_session"')])
+
+        other, _, _ = make_timetable(self.user, name='後期', is_default=False)
+        with CaptureQueriesContext(connection) as ctx:
+            self.client.get(reverse('schedule:time_table_with_pk', kwargs={'timetable_pk': other.pk}))
+        self.assertTrue([q for q in ctx.captured_queries if q['sql'].startswith('UPDATE "django_session"')])
+        self.assertEqual(self.client.session['last_timetable_pk'], other.pk)
+
+    @override_settings(SESSION_ENGINE='django.contrib.sessions.backends.signed_cookies')
+    def test_signed_cookies(self):
+        self.client.force_login(self.user)
+        response = self.client.get(reverse('schedule:time_table'))
+        self.assertEqual(response.status_code, 200)
+        self.assertIn(settings.SESSION_COOKIE_NAME, response.cookies)
+        self.assertNotIn(settings.SESSION_COOKIE_NAME, self.client.get(reverse('schedule:time_table')).cookies)
+        self.assertEqual(session_config.session_metrics(), {'engine': settings.SESSION_ENGINE})
+
+    def test_prune_expired_and_metrics(self):
+        model = session_config.session_model()
+        past = timezone.now() - timedelta(days=1)
+        model.objects.bulk_create([model(session_key=f'expired{i}', session_data='x', expire_date=past) for i in range(5)])
+
+        metrics = session_config.session_metrics()
+        self.assertEqual((metrics['rows'], metrics['expired']), (6, 5))
+        self.assertGreater(metrics['data_bytes'], 0)
+
+        out = io.StringIO()
+        call_command('prune_sessions', batch_size=2, stdout=out)
+        self.assertIn('5 件削除', out.getvalue())
+        self.assertEqual(model.objects.count(), 1)
+        self.assertEqual(json.loads(out.getvalue().splitlines()[-1])['expired'], 0)
+
+    def test_metrics_view(self):
+        url = reverse('schedule:session_metrics')
+        self.assertEqual(self.client.get(url).status_code, 302)
+        self.client.force_login(User.objects.create_user('ops', is_staff=True))
+        body = self.client.get(url).json()
+        self.assertEqual(body['sessions']['engine'], settings.SESSION_ENGINE)
+        self.assertGreaterEqual(body['sessions']['rows'], 1)
+
+
+class DbMetricsViewTests(ScheduleTestCase):
+    def test_staff_only(self):
+        url = reverse('schedule:db_metrics')
+        self.client.force_login(User.objects.create_user('student'))
+        self.assertEqual(self.client.get(url).status_code, 302)
+
+        self.client.force_login(User.objects.create_user('ops', is_staff=True))
+        response = self.client.get(url)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.json()['databases']['default']['vendor'], connection.vendor)
+
+
+class FragmentCacheTests(ScheduleTestCase):
+    """時間割画面のグリッド・ToDoリストの断片キャッシュ"""
+
+    def setUp(self):
+        super().setUp()
+        self.user = User.objects.create_user('fragment')
+        self.timetable, days, periods = make_timetable(self.user, days=2, periods=2)
+        fill_schedules(self.user, days, periods, tasks_per_course=2)
+        self.client.force_login(self.user)
+        self.url = reverse('schedule:time_table')
+
+    def stats(self, name):
+        stats = schedule_cache.fragment_stats()[name]
+        return stats['hits'], stats['misses']
+
+    def test_second_render_hits(self):
+        first = self.client.get(self.url)
+        self.assertEqual(self.stats('grid'), (0, 1))
+        self.assertEqual(self.stats('todos'), (0, 1))
+
+        second = self.client.get(self.url)
+        self.assertEqual(self.stats('grid'), (1, 1))
+        self.assertEqual(self.stats('todos'), (1, 1))
+        # ページ全体はCSRFトークンが変わるので、グリッドの部分だけを比べる
+        def grid(response):
+            html = response.content.decode()
+            return html[html.index('<table>'):html.index('</table>')]
+        self.assertEqual(grid(first), grid(second))
+
+    def test_varies_on_show_all_and_date(self):
+        self.client.get(self.url)
+        self.client.get(self.url, {'all': '1'})
+        self.assertEqual(self.stats('grid'), (0, 2))
+
+        tomorrow = timezone.localdate() + timedelta(days=1)
+        with mock.patch('django.utils.timezone.localdate', return_value=tomorrow):
+            self.client.get(self.url)
+        self.assertEqual(self.stats('grid'), (0, 3))
+
+    def test_model_changes_invalidate(self):
+        self.client.get(self.url)
+        course = Course.objects.filter(schedule__user=self.user).first()
+        Task.objects.create(course=course, title='新しい課題', due_date=timezone.localdate())
+
+        response = self.client.get(self.url)
+        self.assertContains(response, '新しい課題')
+        self.assertEqual(self.stats('todos'), (0, 2))
+
+        course.name = '名前を変えた授業'
+        course.save()
+        self.assertContains(self.client.get(self.url), '名前を変えた授業')
+
+    def test_other_users_do_not_share_fragments(self):
+        self.client.get(self.url)
+        other = User.objects.create_user('other')
+        make_timetable(other, days=2, periods=2)
+        self.client.force_login(other)
+        response = self.client.get(self.url)
+        self.assertNotContains(response, '新しい課題')
+        self.assertEqual(self.stats('grid'), (0, 2))
+
+    @override_settings(SCHEDULE_FRAGMENT_CACHE=False)
+    def test_can_be_disabled(self):
+        self.client.get(self.url)
+        self.client.get(self.url)
+        self.assertEqual(self.stats('grid'), (0, 0))
+
+    def test_metrics_view(self):
+        url = reverse('schedule:cache_metrics')
+        self.client.get(self.url)
+        self.assertEqual(self.client.get(url).status_code, 302)
+
+        self.client.force_login(User.objects.create_user('ops', is_staff=True))
+        body = self.client.get(url).json()
+        self.assertTrue(body['fragment_cache'])
+        self.assertEqual(body['fragments']['grid'], {'hits': 0, 'misses': 1, 'hit_ratio': 0.0})
+
+
+@override_settings(ROOT_URLCONF=ASYNC_URLCONF)
+class AsyncViewTests(ScheduleTestCase):
+    def setUp(self):
+        super().setUp()
+        self.user = User.objects.create_user('async')
+        self.timetable, days, periods = make_timetable(self.user, days=3, periods=2)
+        fill_schedules(self.user, days, periods, tasks_per_course=3)
+        self.schedule = Schedule.objects.filter(user=self.user).first()
+        self.client.force_login(self.user)
+        self.async_client.force_login(self.user)
+
+    def test_urls_use_async_views(self):
+        self.assertIs(resolve(reverse('schedule:time_table')).func, views.time_table_view_async)
+        self.assertIs(resolve(reverse('schedule:detail', kwargs={'pk': 1})).func, views.schedule_detail_view_async)
+        with override_settings(ROOT_URLCONF=SYNC_URLCONF):
+            self.assertIs(resolve(reverse('schedule:time_table')).func, views.time_table_view)
+
+    def test_default_urls_follow_setting(self):
+        # settings.SCHEDULE_ASYNC_VIEWS は schedule/urls.py を読み込むときに一度だけ使う
+        expected = views.time_table_view_async if settings.SCHEDULE_ASYNC_VIEWS else views.time_table_view
+        self.assertIs(resolve('/', urlconf='config.urls').func, expected)
+
+    async def test_time_table_matches_sync_view(self):
+        response = await self.async_client.get(reverse('schedule:time_table'))
+        self.assertEqual(response.status_code, 200)
+        with override_settings(ROOT_URLCONF=SYNC_URLCONF):
+            await sync_to_async(cache.clear)()
+            expected = await sync_to_async(self.client.get)(reverse('schedule:time_table'))
+        for key in ('total_timetable_tasks', 'completed_timetable_tasks', 'current_timetable'):
+            self.assertEqual(response.context[key], expected.context[key])
+
+        def cells(context):
+            return [(cell.url, cell.css_class, cell.badge, cell.progress, cell.task_count)
+                    for row in context['grid_rows'] for cell in row.cells]
+        self.assertEqual(cells(response.context), cells(expected.context))
+        self.assertEqual(
+            [task.pk for task in response.context['upcoming_todos']],
+            [task.pk for task in expected.context['upcoming_todos']])
+
+        # 1回目の表示でセッションに時間割が記録されるので、2回目の ETag で再検証する
+        response = await self.async_client.get(reverse('schedule:time_table'))
+        again = await self.async_client.get(reverse('schedule:time_table'), headers={'if-none-match': response['ETag']})
+        self.assertEqual(again.status_code, 304)
+
+    async def test_detail_get_and_post(self):
+        url = reverse('schedule:detail', kwargs={'pk': self.schedule.pk})
+        response = await self.async_client.get(url)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(len(response.context['tasks']), 2)
+
+        response = await self.async_client.post(url, {'title': '追加の課題'})
+        self.assertEqual(response.status_code, 302)
+        self.assertTrue(await Task.objects.filter(course_id=self.schedule.course_id, title='追加の課題').aexists())
+
+        other = await sync_to_async(User.objects.create_user)('someone')
+        await sync_to_async(self.async_client.force_login)(other)
+        self.assertEqual((await self.async_client.get(url)).status_code, 404)
+
+    async def test_grid_api_matches_sync_view(self):
+        url = reverse('schedule:grid_api', kwargs={'timetable_pk': self.timetable.pk})
+        response = await self.async_client.get(url)
+        body = json.loads(response.content)
+        with override_settings(ROOT_URLCONF=SYNC_URLCONF):
+            await sync_to_async(cache.clear)()
+            expected = json.loads((await sync_to_async(self.client.get)(url)).content)
+        self.assertEqual(body, expected)
+
+    def test_load_comparison(self):
+        samples = generate_dataset(username='load', timetables=1, days=2, periods=2, courses=3, tasks=20)
+        report = run_load_comparison(samples, concurrency=4, requests=8)
+        for name in ('time_table', 'detail', 'grid_api'):
+            for mode in ('sync', 'async'):
+                self.assertEqual(report['results'][name][mode]['statuses'], {'200': 8})
+
+
+class OnCommitTests(TestCase):
+    """ScheduleTestCase と違い on_commit を置き換えず、コミットまでバージョンが変わらないことを確認する"""
+
+    def setUp(self):
+        cache.clear()
+        self.user = User.objects.create_user('commit')
+
+    def test_version_bumped_after_commit(self):
+        version = schedule_cache.get_user_version(self.user.pk)
+        with self.captureOnCommitCallbacks(execute=True) as callbacks:
+            Timetable.objects.create(user=self.user, name='後期')
+            # コミット前に他のリクエストが読んでも、古いバージョンのまま
+            self.assertEqual(schedule_cache.get_user_version(self.user.pk), version)
+        self.assertEqual(len(callbacks), 1)
+        self.assertNotEqual(schedule_cache.get_user_version(self.user.pk), version)
+
+    def test_version_kept_on_rollback(self):
+        version = schedule_cache.get_user_version(self.user.pk)
+        with self.captureOnCommitCallbacks(execute=True) as callbacks:
+            with self.assertRaises(RuntimeError), transaction.atomic():
+                Timetable.objects.create(user=self.user, name='後期')
+                raise RuntimeError
+        self.assertEqual(callbacks, [])
+        self.assertEqual(schedule_cache.get_user_version(self.user.pk), version)
+
+
+class DatabaseConfigTests(SimpleTestCase):
+    databases = {'default'}
+
+    @mock.patch.dict(os.environ, {'DB_POOL_MAX_SIZE': '4'})
+    def test_postgres_uses_pool(self):
+        config = database_url.config(default='postgres://user:pass@db:5432/schedule')
+        self.assertEqual(config['OPTIONS']['pool'], {'min_size': 2, 'max_size': 4, 'timeout': 10})
+        # 持続接続とプールは併用できない
+        self.assertEqual(config['CONN_MAX_AGE'], 0)
+
+    @mock.patch.dict(os.environ, {'DB_POOL': '0'})
+    def test_postgres_without_pool(self):
+        config = database_url.config(default='postgres://user:pass@db:5432/schedule')
+        self.assertNotIn('pool', config['OPTIONS'])
+        self.assertEqual(config['CONN_MAX_AGE'], 600)
+        self.assertTrue(config['CONN_HEALTH_CHECKS'])
+
+    def test_sqlite_pragmas_applied_on_connect(self):
+        with tempfile.TemporaryDirectory() as path:
+            # テスト用DBとは別の接続（一時ファイルのDB）で確かめる
+            handler = ConnectionHandler({'default': database_url.config(default=f'sqlite:///{path}/db.sqlite3')})
+            try:
+                metrics = database_url.pool_metrics(handler)['default']
+            finally:
+                handler.close_all()
+        self.assertEqual(metrics['journal_mode'], 'wal')
+        self.assertEqual(metrics['synchronous'], 1)  # NORMAL
+        self.assertEqual(metrics['busy_timeout'], 5000)
+        self.assertFalse(metrics['pooled'])
+
+
+class CacheUrlTests(SimpleTestCase):
+    def test_default_is_locmem(self):
+        self.assertEqual(cache_url.parse('locmem://')['BACKEND'],
+                         'django.core.cache.backends.locmem.LocMemCache')
+
+    def test_file_backend(self):
+        config = cache_url.parse('file:///var/tmp/timetable?timeout=600&max_entries=500')
+        self.assertEqual(config['BACKEND'], 'django.core.cache.backends.filebased.FileBasedCache')
+        self.assertEqual(config['LOCATION'], '/var/tmp/timetable')
+        self.assertEqual(config['TIMEOUT'], 600)
+        self.assertEqual(config['OPTIONS'], {'MAX_ENTRIES': 500})
+
+    def test_redis_backend(self):
+        config = cache_url.parse('redis://127.0.0.1:6379/1?key_prefix=tt')
+        self.assertEqual(config['BACKEND'], 'django.core.cache.backends.redis.RedisCache')
+        self.assertEqual(config['LOCATION'], 'redis://127.0.0.1:6379/1')
+        self.assertEqual(config['KEY_PREFIX'], 'tt')
+
+    def test_unknown_scheme(self):
+        with self.assertRaises(ValueError):
+            cache_url.parse('memcache://127.0.0.1')
+
+
+class ScheduleCacheHelperTests(SimpleTestCase):
+    def setUp(self):
+        cache.clear()
+
+    def exercise_backend(self):
+        built = []
+
+        def build():
+            built.append(1)
+            return {'value': len(built)}
+
+        self.assertEqual(schedule_cache.get_or_build('test', 1, ('a', None), build), {'value': 1})
+        self.assertEqual(schedule_cache.get_or_build('test', 1, ('a', None), build), {'value': 1})
+        schedule_cache.bump_user_version(1)
+        self.assertEqual(schedule_cache.get_or_build('test', 1, ('a', None), build), {'value': 2})
+
+    def test_namespaced_key(self):
+        self.assertEqual(schedule_cache.make_key('time-table', 3, None, 1), 'schedule:time-table:3:-:1')
+
+    @override_settings(SCHEDULE_CACHE_TIMEOUTS={'time-table': 42})
+    def test_timeouts_from_settings(self):
+        self.assertEqual(schedule_cache.get_timeout('time-table'), 42)
+        self.assertEqual(schedule_cache.get_timeout('unknown'), schedule_cache.DEFAULT_TIMEOUT)
+
+    def test_locmem_backend(self):
+        self.exercise_backend()
+
+    def test_file_backend(self):
+        with tempfile.TemporaryDirectory() as path:
+            with override_settings(CACHES={'default': cache_url.parse(f'file://{path}')}):
+                self.exercise_backend()
+
+    @unittest.skipUnless(os.environ.get('TEST_REDIS_URL'), 'TEST_REDIS_URL が未設定')
+    def test_redis_backend(self):
+        # ローカルのRedis互換サーバーを TEST_REDIS_URL で指定したときだけ実行する
+        with override_settings(CACHES={'default': cache_url.parse(os.environ['TEST_REDIS_URL'])}):
+            caches['default'].clear()
+            self.exercise_backend()
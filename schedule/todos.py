@@ -0,0 +1,126 @@
+# schedule/todos.py
+"""
+ToDo ダッシュボード（ユーザーのすべての時間割のToDoを一覧する）
+
+緊急度は SQL の Case/When で注釈し、緊急度での絞り込みは期限日の範囲の条件に変換するので、
+どちらもPythonのループを使わない。並び順は (is_completed, due_date, pk)（期限なしは最後）で、
+ページ送りは OFFSET ではなく直前のページの最後の行からのキーセット（カーソル）で行う。
+
+ToDo はユーザーの授業 (course_id) ごとのインデックス task_open_due_idx（未完了のみの場合）・
+task_course_done_due_idx から読む。並び順だけのインデックスを全体に張ると、ほかのユーザーの
+ToDoまで読み飛ばすことになるため、授業ごとに絞り込んでから並べ替える（並べ替えるのは
+そのユーザーのToDoだけで、読み飛ばしたページの行は条件で除かれる）。
+"""
+
+import base64
+from datetime import date, timedelta
+
+from django.db.models import Case, CharField, F, OuterRef, Q, Subquery, Value, When
+
+from .models import Schedule, Task
+
+PAGE_SIZE = 50
+
+# 緊急度の表示名（ダッシュボードの絞り込みの選択肢）
+URGENCY_CHOICES = [
+    ('overdue', '期限切れ'),
+    ('today', '今日まで'),
+    ('weekly', '今週'),
+    ('later', 'それ以降・期限なし'),
+    ('done', '完了済み'),
+]
+
+
+def urgency_filters(today):
+    """緊急度 -> その緊急度のToDoだけに絞り込む条件（インデックスの範囲検索になる形）"""
+    next_week = today + timedelta(days=7)
+    incomplete = Q(is_completed=False)
+    return {
+        'overdue': incomplete & Q(due_date__lt=today),
+        'today': incomplete & Q(due_date=today),
+        'weekly': incomplete & Q(due_date__gt=today, due_date__lte=next_week),
+        'later': incomplete & (Q(due_date__gt=next_week) | Q(due_date__isnull=True)),
+        'done': Q(is_completed=True),
+    }
+
+
+def urgency_annotation(today):
+    """緊急度を計算する SQL の式（get_urgency と同じ判定。完了済みは None）"""
+    next_week = today + timedelta(days=7)
+    return Case(
+        When(is_completed=True, then=Value(None)),
+        When(due_date__lt=today, then=Value('overdue')),
+        When(due_date=today, then=Value('today')),
+        When(due_date__lte=next_week, then=Value('weekly')),
+        default=Value(None),
+        output_field=CharField(),
+    )
+
+
+# --- カーソル ---
+
+def encode_cursor(task):
+    """ページの最後のToDoから、次のページのカーソル（URLに使える文字列）を作る"""
+    due = task.due_date.isoformat() if task.due_date else ''
+    raw = f'{int(task.is_completed)}:{due}:{task.pk}'
+    return base64.urlsafe_b64encode(raw.encode()).decode().rstrip('=')
+
+
+def decode_cursor(cursor):
+    """カーソルを (is_completed, due_date, pk) に戻す（不正な値なら None）"""
+    try:
+        raw = base64.urlsafe_b64decode(cursor + '=' * (-len(cursor) % 4)).decode()
+        completed, due, pk = raw.split(':')
+        return completed == '1', date.fromisoformat(due) if due else None, int(pk)
+    except (ValueError, UnicodeDecodeError):
+        return None
+
+
+def after_cursor(cursor):
+    """(is_completed, due_date NULLS LAST, pk) の並びで、カーソルより後ろの行を表す条件"""
+    completed, due, pk = cursor
+    if due is None:
+        # 期限なしの行は同じ完了状態の中で最後に並ぶ
+        same_group = Q(due_date__isnull=True, pk__gt=pk)
+    else:
+        same_group = Q(due_date__gt=due) | Q(due_date__isnull=True) | Q(due_date=due, pk__gt=pk)
+    rest = Q(is_completed=completed) & same_group
+    return rest if completed else rest | Q(is_completed=True)
+
+
+# --- 一覧 ---
+
+def dashboard_tasks(user, today, urgency=None, course=None, timetable=None, show_all=False):
+    """ダッシュボードに表示するToDoのクエリセット（並び替え・緊急度の注釈付き）"""
+    schedules = Schedule.objects.filter(user=user)
+    if timetable is not None:
+        schedules = schedules.filter(day__timetable=timetable)
+
+    tasks = Task.objects.filter(course__in=schedules.values('course'))
+    if course is not None:
+        tasks = tasks.filter(course=course)
+    if urgency:
+        tasks = tasks.filter(urgency_filters(today)[urgency])
+    elif not show_all:
+        tasks = tasks.filter(is_completed=False)
+
+    # 詳細画面へのリンク先（その授業の最初のコマ）
+    first_schedule = schedules.filter(course=OuterRef('course')).order_by('pk').values('pk')[:1]
+    return (
+        tasks.select_related('course')
+        .annotate(urgency=urgency_annotation(today), schedule_pk=Subquery(first_schedule))
+        .order_by('is_completed', F('due_date').asc(nulls_last=True), 'pk')
+    )
+
+
+def paginate(tasks, cursor=None, page_size=None):
+    """キーセットでページを切り出し、(そのページのToDo, 次のページのカーソル) を返す"""
+    page_size = page_size or PAGE_SIZE
+    if cursor is not None:
+        tasks = tasks.filter(after_cursor(cursor))
+    # 1件多く読み、次のページがあるかを判定する（COUNT は使わない）
+    page = list(tasks[:page_size + 1])
+    if len(page) > page_size:
+        page = page[:page_size]
+        return page, encode_cursor(page[-1])
+    return page, None
@@ -1,42 +1,78 @@
+from django.conf import settings
 from django.urls import path
 from . import views
 
 app_name = 'schedule'
 
-urlpatterns = [
-    # 時間割表示
-    path('', views.time_table_view, name='time_table'),
-    path('<int:timetable_pk>/', views.time_table_view, name='time_table_with_pk'),
-    path('switch/<int:pk>/', views.switch_timetable_view, name='switch_timetable'),
-
-    # 授業（Schedule/Course）操作
-    path('create/<int:day_pk>/<int:period_pk>/', views.schedule_create_view, name='create'),
-    path('detail/<int:pk>/', views.schedule_detail_view, name='detail'),
-    path('update/<int:pk>/', views.schedule_update_view, name='update'),
-    path('delete/<int:pk>/', views.schedule_delete_view, name='delete'), # views.pyの関数名に合わせました
-
-    # ToDo（Task）操作
-    path('task/<int:pk>/toggle/', views.task_toggle_complete, name='task_toggle'),
-    path('task/<int:pk>/edit/', views.task_edit, name='task_edit'),
-    path('task/<int:pk>/delete/', views.task_delete, name='task_delete'),
-
-    # 設定センター（時間割セット管理）
-    path('timetables/', views.TimetableListView.as_view(), name='timetable_list'),
-    path('timetables/add/', views.TimetableCreateView.as_view(), name='timetable_create'),
-    path('timetables/<int:pk>/edit/', views.TimetableUpdateView.as_view(), name='timetable_update'),
-    path('timetables/<int:pk>/delete/', views.TimetableDeleteView.as_view(), name='timetable_delete'),
-
-    # 曜日管理
-    path('timetables/<int:timetable_pk>/days/add/', views.DayCreateView.as_view(), name='day_create'),
-    path('days/<int:pk>/edit/', views.DayUpdateView.as_view(), name='day_update'),
-    path('days/<int:pk>/delete/', views.DayDeleteView.as_view(), name='day_delete'),
-
-    # 時限管理
-    path('timetables/<int:timetable_pk>/periods/add/', views.PeriodCreateView.as_view(), name='period_create'),
-    path('periods/<int:pk>/edit/', views.PeriodUpdateView.as_view(), name='period_update'),
-    path('periods/<int:pk>/delete/', views.PeriodDeleteView.as_view(), name='period_delete'),
-
-    # アカウント管理
-    path('signup/', views.SignUpView.as_view(), name='signup'),
-    path('account/delete/', views.AccountDeleteView.as_view(), name='account_delete'),
-]
\ No newline at end of file
+# 【追加】ASGI で動かすときに非同期版に切り替えるビュー (名前 -> (同期版, 非同期版))
+ASYNC_VIEWS = {
+    'time_table': (views.time_table_view, views.time_table_view_async),
+    'grid_api': (views.grid_api_view, views.grid_api_view_async),
+    'detail': (views.schedule_detail_view, views.schedule_detail_view_async),
+}
+
+def build_urlpatterns(async_views):
+    """URLの一覧を作る。async_views が True なら ASYNC_VIEWS のビューに非同期版を使う
+
+    テスト・ベンチマークで両方を比べるときは、config/sync_urls.py・config/async_urls.py を
+    ROOT_URLCONF に指定する。
+    """
+    def view(name):
+        return ASYNC_VIEWS[name][bool(async_views)]
+
+    return [
+        # 時間割表示
+        path('', view('time_table'), name='time_table'),
+        path('<int:timetable_pk>/', view('time_table'), name='time_table_with_pk'),
+        path('switch/<int:pk>/', views.switch_timetable_view, name='switch_timetable'),
+
+        # JSON API（クライアント側での差分更新用）
+        path('api/timetables/<int:timetable_pk>/grid/', view('grid_api'), name='grid_api'),
+
+        # カレンダー購読（iCalendar フィード。URLのトークンで認証する）
+        path('calendar/<str:token>.ics', views.calendar_feed_view, name='calendar_feed'),
+        path('calendar/rotate/', views.calendar_feed_rotate_view, name='calendar_feed_rotate'),  # 【追加】購読URLの作り直し
+
+        # 授業（Schedule/Course）操作
+        path('create/<int:day_pk>/<int:period_pk>/', views.schedule_create_view, name='create'),
+        path('detail/<int:pk>/', view('detail'), name='detail'),
+        path('update/<int:pk>/', views.schedule_update_view, name='update'),
+        path('delete/<int:pk>/', views.schedule_delete_view, name='delete'), # views.pyの関数名に合わせました
+
+        # ToDo（Task）操作
+        path('task/<int:pk>/toggle/', views.task_toggle_complete, name='task_toggle'),
+        path('task/<int:pk>/edit/', views.task_edit, name='task_edit'),
+        path('task/<int:pk>/delete/', views.task_delete, name='task_delete'),
+        path('todos/', views.todo_dashboard_view, name='todo_dashboard'),  # 【追加】全時間割のToDo一覧
+        path('task/batch/', views.task_batch_view, name='task_batch'),  # 【追加】まとめて切り替え・削除
+        path('api/tasks/bulk/', views.task_bulk_api_view, name='task_bulk_api'),  # 【追加】一括操作のJSON API
+
+        # 設定センター（時間割セット管理）
+        path('timetables/', views.TimetableListView.as_view(), name='timetable_list'),
+        path('timetables/add/', views.TimetableCreateView.as_view(), name='timetable_create'),
+        path('timetables/<int:pk>/edit/', views.TimetableUpdateView.as_view(), name='timetable_update'),
+        path('timetables/<int:pk>/delete/', views.TimetableDeleteView.as_view(), name='timetable_delete'),
+        path('timetables/<int:timetable_pk>/import/', views.timetable_import_view, name='timetable_import'),
+
+        # 曜日管理
+        path('timetables/<int:timetable_pk>/days/add/', views.DayCreateView.as_view(), name='day_create'),
+        path('days/<int:pk>/edit/', views.DayUpdateView.as_view(), name='day_update'),
+        path('days/<int:pk>/delete/', views.DayDeleteView.as_view(), name='day_delete'),
+
+        # 時限管理
+        path('timetables/<int:timetable_pk>/periods/add/', views.PeriodCreateView.as_view(), name='period_create'),
+        path('periods/<int:pk>/edit/', views.PeriodUpdateView.as_view(), name='period_update'),
+        path('periods/<int:pk>/delete/', views.PeriodDeleteView.as_view(), name='period_delete'),
+
+        # アカウント管理
+        path('signup/', views.SignUpView.as_view(), name='signup'),
+        path('account/delete/', views.AccountDeleteView.as_view(), name='account_delete'),
+        path('account/export/', views.data_export_view, name='data_export'),
+
+        # 【追加】運用・監視用（スタッフのみ）
+        path('ops/database/', views.db_metrics_view, name='db_metrics'),
+        path('ops/cache/', views.cache_metrics_view, name='cache_metrics'),
+        path('ops/sessions/', views.session_metrics_view, name='session_metrics'),
+    ]
+
+urlpatterns = build_urlpatterns(getattr(settings, 'SCHEDULE_ASYNC_VIEWS', False))
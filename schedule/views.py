@@ -1,141 +1,337 @@
-from django.shortcuts import render, get_object_or_404, redirect
+import asyncio
+import hashlib
+import json
+from datetime import datetime, timezone as dt_timezone
+from pathlib import Path
+
+from django.apps import apps
+from django.conf import settings
+from functools import lru_cache, wraps
+
+from django.shortcuts import render, get_object_or_404, aget_object_or_404, redirect
+from django.http import Http404, HttpResponseBadRequest, JsonResponse, StreamingHttpResponse
 from django.urls import reverse, reverse_lazy
-from django.db import transaction
-from django.db.models import Count, Q
+from django.db import connections, transaction
+from django.db.models import Min, Prefetch
+from django.template.autoreload import get_template_directories
 from django.views.generic import ListView, CreateView, UpdateView, DeleteView
+from django.contrib.admin.views.decorators import staff_member_required
 from django.contrib.auth import logout
 from django.contrib.auth.decorators import login_required
 from django.contrib.auth.mixins import LoginRequiredMixin
+from django.views.decorators.cache import cache_control
+from django.views.decorators.http import condition, require_POST, require_safe
 from django.utils import timezone
-from django.core.exceptions import PermissionDenied
-from datetime import time
+from django.utils.cache import get_conditional_response
+from django.utils.http import http_date, quote_etag, url_has_allowed_host_and_scheme
+
+from config.database import pool_metrics
+from config.sessions import session_metrics
 
 from .models import Day, Period, Schedule, Course, Task, Timetable
+from .grid import abuild_time_table, alist, aserialize_time_table, build_time_table, serialize_time_table
+from .services import TASK_ACTIONS, bulk_task_action, copy_timetable, create_default_structure, tasks_changed, toggle_tasks
+from . import cache as schedule_cache
+from . import ical
+from . import todos
+from .exporter import export_filename, iter_export
+from .importer import import_file
 from .forms import (
     ScheduleUpdateForm, CourseForm, TaskForm, 
-    DayForm, PeriodForm, TimetableForm, JapaneseSignUpForm
+    DayForm, PeriodForm, TimetableForm, TimetableCreateForm, TimetableImportForm, TodoFilterForm, JapaneseSignUpForm
 )
 
 # --- 補助関数 ---
 
 def get_back_url(request):
     """セッションから最後に表示していた時間割に戻るURLを生成"""
-    last_pk = request.session.get('last_timetable_pk')
+    return back_url_for(request.session.get('last_timetable_pk'))
+
+async def aget_back_url(request):
+    """get_back_url の非同期版"""
+    return back_url_for(await request.session.aget('last_timetable_pk'))
+
+# 表示中の時間割を記録するセッションのキー（戻り先用・次に開いたときの表示用）
+TIMETABLE_SESSION_KEYS = ('last_timetable_pk', 'current_timetable_pk')
+
+def remember_timetable(session, timetable_pk):
+    """表示した時間割をセッションに記録する（値が変わらないキーは書き込まない）
+
+    同じ値でも代入するとセッションが変更扱いになり、レスポンスのたびにセッションの行の UPDATE
+    （signed_cookies なら Set-Cookie）が発生するため。
+    """
+    for key in TIMETABLE_SESSION_KEYS:
+        if session.get(key) != timetable_pk:
+            session[key] = timetable_pk
+
+async def aremember_timetable(session, timetable_pk):
+    """remember_timetable の非同期版"""
+    for key in TIMETABLE_SESSION_KEYS:
+        if await session.aget(key) != timetable_pk:
+            await session.aset(key, timetable_pk)
+
+def back_url_for(last_pk):
     if last_pk:
         return reverse('schedule:time_table_with_pk', kwargs={'timetable_pk': last_pk})
     return reverse('schedule:time_table')
 
+# 条件付きGET (ETag) 用。デプロイ後に古いHTMLを使わせないよう、デプロイの識別子を含める
+# BUILD_VERSION がないときは、ページの内容に関わるファイルから作る（ワーカーが違っても同じ値になる）
+DEPLOY_FINGERPRINT_SUFFIXES = ('.py', '.html', '.css', '.js')
+
+@lru_cache(maxsize=None)
+def deploy_version():
+    """デプロイの識別子（settings.BUILD_VERSION、なければアプリ・テンプレート・静的ファイルの内容のハッシュ）"""
+    if settings.BUILD_VERSION:
+        return settings.BUILD_VERSION
+    roots = {
+        Path(apps.get_app_config('schedule').path), *get_template_directories(),
+        *map(Path, settings.STATICFILES_DIRS),
+    }
+    digest = hashlib.sha1()
+    for root in sorted(roots):
+        for path in sorted(root.rglob('*')):
+            if path.suffix in DEPLOY_FINGERPRINT_SUFFIXES and path.is_file():
+                digest.update(str(path.relative_to(root)).encode())
+                digest.update(path.read_bytes())
+    return digest.hexdigest()
+
+def make_page_etag(request, user_pk, version, *parts):
+    """ユーザーのデータのバージョンとページ固有の値から ETag を作る
+
+    データのバージョンは signals.py で、ユーザーのデータが変更されるたびに更新される。
+    ページに埋め込む CSRF トークンが変わったときも別の ETag になるよう、CSRF Cookie も含める。
+    """
+    raw = ':'.join(str(part) for part in (
+        deploy_version(), user_pk, version,
+        request.COOKIES.get(settings.CSRF_COOKIE_NAME, ''), *parts,
+    ))
+    return hashlib.sha1(raw.encode()).hexdigest()
+
+def version_last_modified(version):
+    """データの最終更新時刻（日付が変わると緊急度も変わるので、今日の0時より前にはしない）"""
+    updated_at = datetime.fromtimestamp(version / 1e9, tz=dt_timezone.utc)
+    midnight = timezone.make_aware(datetime.combine(timezone.localdate(), datetime.min.time()))
+    return max(updated_at, midnight)
+
+def page_etag(request, *parts):
+    # バージョンが共有されていない（プロセスごとのキャッシュ）ときは、条件付きGETを行わない
+    if not schedule_cache.enabled():
+        return None
+    version = schedule_cache.get_user_version(request.user.pk)
+    return make_page_etag(request, request.user.pk, version, *parts)
+
+def page_last_modified(request, *args, **kwargs):
+    if not schedule_cache.enabled():
+        return None
+    return version_last_modified(schedule_cache.get_user_version(request.user.pk))
+
+def time_table_etag(request, timetable_pk=None):
+    return page_etag(
+        request, 'time-table', timetable_pk, request.session.get('current_timetable_pk'),
+        request.GET.get('all') == '1', timezone.localdate(),
+    )
+
+def schedule_detail_etag(request, pk):
+    return page_etag(
+        request, 'detail', pk, request.session.get('last_timetable_pk'), request.GET.get('all') == '1',
+    )
+
 # --- メインビュー (時間割表示) ---
 
+def pick_timetable(timetables, timetable_pk, session_pk):
+    """ユーザーの時間割の一覧から、表示する時間割を選ぶ（なければ None）"""
+    by_pk = {timetable.pk: timetable for timetable in timetables}
+    # ① URLで直接指定された場合 (例: /schedule/5/) -> 最優先
+    if timetable_pk in by_pk:
+        return by_pk[timetable_pk]
+    # ② URL指定なし(トップページ等) -> 「デフォルト(is_default=True)」を探す
+    for timetable in timetables:
+        if timetable.is_default:
+            return timetable
+    # ③ デフォルト未設定の場合 -> セッション（前回の記憶）を確認
+    if session_pk in by_pk:
+        return by_pk[session_pk]
+    # ④ それでもない場合 -> とりあえず「一番古い時間割」を表示
+    return timetables[0] if timetables else None
+
+def time_table_context(user_timetables, current_timetable, show_all):
+    """時間割画面のテンプレートに渡すデータ（グリッド以外の部分）"""
+    return {
+        'days': [], 'periods': [], 'schedule_data': {}, 'grid_rows': [], 'upcoming_todos': [], 'more_todos': False,
+        'total_timetable_tasks': 0, 'completed_timetable_tasks': 0,
+        'current_timetable': current_timetable, 'show_all': show_all,
+        'user_timetables': user_timetables,
+    }
+
+def build_time_table_context(user, timetable_pk, session_pk, show_all, today):
+    """時間割画面のテンプレートに渡すデータを組み立てる"""
+    # 1. 表示する時間割セットの特定 (切り替えメニュー用の一覧から選ぶので、追加のクエリは不要)
+    user_timetables = list(Timetable.objects.filter(user=user).order_by('pk'))
+    current_timetable = pick_timetable(user_timetables, timetable_pk, session_pk)
+
+    context = time_table_context(user_timetables, current_timetable, show_all)
+    if current_timetable:
+        # グリッド・進捗・ToDoリストは固定回数のクエリでまとめて組み立てる
+        context.update(build_time_table(user, current_timetable, show_all, today))
+    return context
+
 @login_required
+@cache_control(private=True, no_cache=True)
+@condition(etag_func=time_table_etag, last_modified_func=page_last_modified)
 def time_table_view(request, timetable_pk=None):
     """メインの時間割画面を表示する"""
     show_all = request.GET.get('all') == '1'
-    jst_now = timezone.localtime(timezone.now())
-    today = jst_now.date() 
-    next_week = today + timezone.timedelta(days=7)
-
-    # 1. 表示する時間割セットの特定
-    current_timetable = None
-    # ① URLで直接指定された場合 (例: /schedule/5/) -> 最優先
-    if timetable_pk:
-        current_timetable = Timetable.objects.filter(pk=timetable_pk, user=request.user).first()
-
-    # ② URL指定なし(トップページ等) -> 「デフォルト(is_default=True)」を探す
-    if not current_timetable:
-        current_timetable = Timetable.objects.filter(user=request.user, is_default=True).first()
-
-    # ③ デフォルト未設定の場合 -> セッション（前回の記憶）を確認
-    if not current_timetable and 'current_timetable_pk' in request.session:
-        session_pk = request.session['current_timetable_pk']
-        current_timetable = Timetable.objects.filter(pk=session_pk, user=request.user).first()
+    today = timezone.localdate()
+    session_pk = request.session.get('current_timetable_pk')
 
-    # ④ それでもない場合 -> とりあえず「一番新しい時間割」を表示
-    if not current_timetable:
-        current_timetable = Timetable.objects.filter(user=request.user).order_by('pk').first()
+    # 組み立て済みのデータがキャッシュにあれば、DBに問い合わせずに表示する
+    # (データが変更されると signals.py でキャッシュが無効になる)
+    context = schedule_cache.get_or_build(
+        'time-table', request.user.pk, (timetable_pk, session_pk, int(show_all), today.isoformat()),
+        lambda: build_time_table_context(request.user, timetable_pk, session_pk, show_all, today),
+    )
 
-    days, periods, schedule_data, upcoming_todos = [], [], {}, []
-    total_timetable_tasks = completed_timetable_tasks = 0
-    
+    current_timetable = context['current_timetable']
     if current_timetable:
         # セッションに現在の時間割を記録
-        request.session['last_timetable_pk'] = current_timetable.pk
-        request.session['current_timetable_pk'] = current_timetable.pk
-        
-        days = Day.objects.filter(timetable=current_timetable).order_by('order', 'pk')
-        periods = Period.objects.filter(timetable=current_timetable).order_by('order', 'pk')
-        
-        user_schedules = Schedule.objects.filter(
-            user=request.user,
-            day__timetable=current_timetable,
-            period__timetable=current_timetable
-        ).select_related('day', 'period', 'course')
-        
-        # グリッドデータの生成
-        for day in days:
-            schedule_data[day.pk] = {}
-            for period in periods:
-                schedule_obj = user_schedules.filter(day=day, period=period).first()
-                urgency = None
-                display_total = display_completed = 0
-
-                if schedule_obj:
-                    task_query = Task.objects.filter(course=schedule_obj.course)
-                    incomplete_tasks = task_query.filter(is_completed=False)
-
-                    # 緊急度判定
-                    if incomplete_tasks.filter(due_date__lt=today).exists():
-                        urgency = 'overdue'
-                    elif incomplete_tasks.filter(due_date=today).exists():
-                        urgency = 'today'
-                    elif incomplete_tasks.filter(due_date__lte=next_week).exists():
-                        urgency = 'weekly'
-
-                    if show_all:
-                        display_total = task_query.count()
-                        display_completed = task_query.filter(is_completed=True).count()
-                    else:
-                        display_total = incomplete_tasks.count()
-                        display_completed = 0
-
-                schedule_data[day.pk][period.pk] = {
-                    'schedule': schedule_obj,
-                    'task_count': display_total,
-                    'completed_count': display_completed,
-                    'urgency': urgency,
-                }
-
-        # 全体の進捗計算
-        course_ids = user_schedules.values_list('course_id', flat=True)
-        stats = Task.objects.filter(course_id__in=course_ids).aggregate(
-            total=Count('pk'), completed=Count('pk', filter=Q(is_completed=True))
-        )
-        total_timetable_tasks = stats['total'] or 0
-        completed_timetable_tasks = stats['completed'] or 0
-
-        # 下部のToDoリスト
-        todo_query = Task.objects.filter(course_id__in=course_ids).distinct().select_related('course')
-        if not show_all:
-            todo_query = todo_query.filter(is_completed=False)
-        upcoming_todos = todo_query.order_by('is_completed', 'due_date', 'pk')
-
-        for task in upcoming_todos:
-            task.urgency = None
-            if not task.is_completed and task.due_date:
-                if task.due_date < today: task.urgency = 'overdue'
-                elif task.due_date == today: task.urgency = 'today'
-                elif task.due_date <= next_week: task.urgency = 'weekly'
-
-    context = {
-        'days': days, 'periods': periods, 'schedule_data': schedule_data,
-        'current_timetable': current_timetable, 'show_all': show_all,
-        'total_timetable_tasks': total_timetable_tasks,
-        'completed_timetable_tasks': completed_timetable_tasks,
-        'upcoming_todos': upcoming_todos,
-        'user_timetables': Timetable.objects.filter(user=request.user).order_by('pk'),
-    }
+        remember_timetable(request.session, current_timetable.pk)
+
     return render(request, 'schedule/time_table.html', context)
 
+# --- JSON API (時間割グリッド) ---
+
+def grid_cell_hashes(payload):
+    return {cell['key']: cell['hash'] for cell in payload['cells']}
+
+def grid_json_response(payload, previous, since, etag):
+    """差分取得の基準 (previous) と比べて、変わったセルだけ（または全体）を返す"""
+    if previous is not None and previous.keys() == grid_cell_hashes(payload).keys():
+        # 構成が同じなら、ハッシュが変わったセルだけを返す
+        body = {key: value for key, value in payload.items() if key not in ('cells', 'days', 'periods')}
+        body.update({
+            'full': False,
+            'since': since,
+            'cells': [cell for cell in payload['cells'] if previous[cell['key']] != cell['hash']],
+        })
+    else:
+        body = {**payload, 'full': True, 'since': since}
+
+    response = JsonResponse(body, json_dumps_params={'ensure_ascii': False, 'separators': (',', ':')})
+    response['ETag'] = etag
+    response['Cache-Control'] = 'private, no-cache'
+    return response
+
+@login_required
+def grid_api_view(request, timetable_pk):
+    """時間割グリッドをJSONで返す（読み取り専用）
+
+    ?all=1 で完了済みタスクも数える。?since=<version> を付けると、その version から
+    変わったセルだけを返す（曜日・時限の構成が変わった場合や古すぎる場合は全体を返す）。
+    ETag には version を使うので、変更がなければ 304 Not Modified を返す。version は内容から計算するので、
+    キャッシュが無効 (schedule_cache.enabled() が False) で毎回作り直す場合も正しく比べられる。
+    """
+    show_all = request.GET.get('all') == '1'
+    today = timezone.localdate()
+
+    def build():
+        timetable = get_object_or_404(Timetable, pk=timetable_pk, user=request.user)
+        return serialize_time_table(request.user, timetable, show_all, today)
+
+    # データが変わらない限り、キャッシュから返す (DBへの問い合わせなし)
+    payload = schedule_cache.get_or_build(
+        'grid-json', request.user.pk, (timetable_pk, int(show_all), today.isoformat()), build)
+    etag = quote_etag(payload['version'])
+
+    not_modified = get_conditional_response(request, etag=etag)
+    if not_modified is not None:
+        return not_modified
+
+    # 差分取得の基準として、この version のセルのハッシュを残しておく
+    snapshot_parts = (request.user.pk, timetable_pk, int(show_all))
+    if schedule_cache.get_data('grid-snapshot', *snapshot_parts, payload['version']) is None:
+        schedule_cache.set_data('grid-snapshot', *snapshot_parts, payload['version'], value=grid_cell_hashes(payload))
+
+    since = request.GET.get('since')
+    previous = schedule_cache.get_data('grid-snapshot', *snapshot_parts, since) if since else None
+    return grid_json_response(payload, previous, since, etag)
+
+# --- ToDo ダッシュボード ---
+
+@login_required
+def todo_dashboard_view(request):
+    """すべての時間割のToDoを、緊急度・授業・時間割で絞り込んで期限順に表示する
+
+    緊急度はSQLで計算し、ページ送りはキーセット（?cursor=）で行うので、ToDoが何件あっても
+    1ページ分（PAGE_SIZE 件）しか読まない。
+    """
+    form = TodoFilterForm(request.GET or None, user=request.user)
+    filters = form.cleaned_data if form.is_valid() else {}
+    tasks = todos.dashboard_tasks(
+        request.user, timezone.localdate(),
+        urgency=filters.get('urgency'), course=filters.get('course'),
+        timetable=filters.get('timetable'), show_all=filters.get('all', False),
+    )
+    cursor = todos.decode_cursor(request.GET.get('cursor', ''))
+    page, next_cursor = todos.paginate(tasks, cursor)
+
+    # ページ送りのリンクは、絞り込み条件を残してカーソルだけを差し替える
+    query = request.GET.copy()
+    query.pop('cursor', None)
+    first_query = None if cursor is None else query.urlencode()
+    next_query = None
+    if next_cursor:
+        query['cursor'] = next_cursor
+        next_query = query.urlencode()
+    return render(request, 'schedule/todos.html', {
+        'form': form, 'tasks': page, 'first_query': first_query, 'next_query': next_query,
+    })
+
+# --- カレンダー購読 (iCalendar フィード) ---
+
+def calendar_feed_etag(request, token):
+    """フィードの ETag（トークンの鍵を確認した後は、DBに問い合わせずにデータのバージョンから作る）"""
+    owner = ical.read_feed_token(token)
+    if owner is None or not schedule_cache.enabled():
+        return None
+    user_id, timetable_pk = owner
+    raw = ':'.join(str(part) for part in (
+        deploy_version(), 'ics', user_id, timetable_pk,
+        schedule_cache.get_user_version(user_id), ical.term_start(timezone.localdate()),
+    ))
+    return hashlib.sha1(raw.encode()).hexdigest()
+
+@require_safe
+@cache_control(private=True, max_age=60 * 15)
+@condition(etag_func=calendar_feed_etag)
+def calendar_feed_view(request, token):
+    """時間割を iCalendar 形式で返す（カレンダーアプリの購読用。ログイン不要）
+
+    URLの署名付きトークンで時間割を特定する。データが変わっていなければ、
+    トークンの鍵の確認だけで 304 Not Modified を返す。
+    """
+    owner = ical.read_feed_token(token)
+    if owner is None:
+        raise Http404
+    user_id, timetable_pk = owner
+    timetable = get_object_or_404(Timetable, pk=timetable_pk, user_id=user_id)
+    version = schedule_cache.get_user_version(user_id)
+    stamp = datetime.fromtimestamp(version / 1e9, tz=dt_timezone.utc)
+
+    response = StreamingHttpResponse(
+        ical.iter_calendar(timetable, request.get_host(), stamp, timezone.localdate()),
+        content_type='text/calendar; charset=utf-8',
+    )
+    response['Content-Disposition'] = f'inline; filename="timetable-{timetable.pk}.ics"'
+    return response
+
+@login_required
+@require_POST
+def calendar_feed_rotate_view(request):
+    """カレンダー購読URLを作り直す（それまでのURLはすべて使えなくなる）"""
+    ical.rotate_feed_key(request.user.pk)
+    return redirect('schedule:timetable_list')
+
 # --- 授業の登録・詳細・更新・削除 ---
 
 @login_required
@@ -182,6 +378,8 @@ def schedule_create_view(request, day_pk, period_pk):
     })
 
 @login_required
+@cache_control(private=True, no_cache=True)
+@condition(etag_func=schedule_detail_etag, last_modified_func=page_last_modified)
 def schedule_detail_view(request, pk):
     """授業の詳細とToDoを表示する"""
     schedule_obj = get_object_or_404(Schedule, pk=pk, user=request.user)
@@ -231,7 +429,10 @@ def schedule_update_view(request, pk):
             else:
                 # 重複がない場合 -> 保存して完了
                 schedule_form.save()
-                course_form.save()
+                # タスクの集計値 (task_total など) は読み込んだ後に別のリクエストで変わりうるので、
+                # フォームの項目だけを書き込む
+                course = course_form.save(commit=False)
+                course.save(update_fields=course_form.Meta.fields)
                 return redirect('schedule:detail', pk=schedule_obj.pk)
             
 
@@ -255,6 +456,215 @@ def schedule_delete_view(request, pk):
         course_obj.delete()
     return redirect(get_back_url(request))
 
+@login_required
+def timetable_import_view(request, timetable_pk):
+    """CSV / JSON ファイルから授業とToDoを一括登録する
+
+    ファイルは少しずつ読み込み、まとまりごとに bulk_create で保存する。
+    不正な行は読み飛ばし、行番号とエラー内容を画面に表示する。
+    """
+    timetable = get_object_or_404(Timetable, pk=timetable_pk, user=request.user)
+    form = TimetableImportForm(request.POST or None, request.FILES or None)
+    report = None
+    if request.method == 'POST' and form.is_valid():
+        report = import_file(request.user, timetable, form.cleaned_data['file'], form.cleaned_data['format'])
+
+    return render(request, 'schedule/import.html', {
+        'timetable': timetable, 'form': form, 'report': report,
+        'day_names': timetable.day_set.values_list('name', flat=True),
+        'period_names': timetable.period_set.values_list('name', flat=True),
+    })
+
+@login_required
+@require_safe
+def data_export_view(request):
+    """ユーザーのデータをバックアップ用の NDJSON（?format=gzip で gzip 圧縮）としてダウンロードする"""
+    compress = request.GET.get('format') == 'gzip'
+    response = StreamingHttpResponse(
+        iter_export(request.user, compress=compress),
+        content_type='application/gzip' if compress else 'application/x-ndjson; charset=utf-8',
+    )
+    response['Content-Disposition'] = f'attachment; filename="{export_filename(request.user, compress)}"'
+    response['Cache-Control'] = 'private, no-store'
+    return response
+
+# --- 運用・監視 ---
+
+@staff_member_required
+@require_safe
+def db_metrics_view(request):
+    """接続プール（PostgreSQL）・PRAGMA（SQLite）の状態をJSONで返す（スタッフのみ）"""
+    response = JsonResponse({'databases': pool_metrics(connections)})
+    response['Cache-Control'] = 'private, no-store'
+    return response
+
+@staff_member_required
+@require_safe
+def session_metrics_view(request):
+    """セッションの保存先・行数・期限切れの行数・データの大きさをJSONで返す（スタッフのみ）"""
+    response = JsonResponse({'sessions': session_metrics()})
+    response['Cache-Control'] = 'private, no-store'
+    return response
+
+@staff_member_required
+@require_safe
+def cache_metrics_view(request):
+    """テンプレートの断片キャッシュのヒット・ミスの回数をJSONで返す（スタッフのみ）"""
+    response = JsonResponse({
+        'enabled': schedule_cache.enabled(),
+        'fragment_cache': getattr(settings, 'SCHEDULE_FRAGMENT_CACHE', True),
+        'fragments': schedule_cache.fragment_stats(),
+    })
+    response['Cache-Control'] = 'private, no-store'
+    return response
+
+# --- 非同期版のビュー (ASGI 用。settings.SCHEDULE_ASYNC_VIEWS で切り替える) ---
+
+def async_condition(values_func):
+    """condition デコレーターの非同期版
+
+    values_func は (ETag, 最終更新時刻) を返すコルーチン関数。condition の etag_func は
+    同期的に呼ばれるため、その中で request.user やセッションを読むとイベントループ上で
+    DBにアクセスしてしまう。非同期ビューではこちらを使う。
+    キャッシュが無効 (schedule_cache.enabled() が False) のときは、条件付きGETを行わない。
+    """
+    def decorator(view):
+        @wraps(view)
+        async def inner(request, *args, **kwargs):
+            if not schedule_cache.enabled():
+                return await view(request, *args, **kwargs)
+            etag, last_modified = await values_func(request, *args, **kwargs)
+            etag = quote_etag(etag)
+            last_modified = int(last_modified.timestamp())
+            response = get_conditional_response(request, etag=etag, last_modified=last_modified)
+            if response is None:
+                response = await view(request, *args, **kwargs)
+            if request.method in ('GET', 'HEAD'):
+                if not response.has_header('Last-Modified'):
+                    response.headers['Last-Modified'] = http_date(last_modified)
+                response.headers.setdefault('ETag', etag)
+            return response
+        return inner
+    return decorator
+
+async def request_user(request):
+    """ログインユーザーを取得し、request.user にも設定する
+
+    テンプレートの context processor が request.user を読んだときに、
+    イベントループ上でDBにアクセスしないようにするため。
+    """
+    user = await request.auser()
+    request.user = user
+    return user
+
+async def time_table_conditions(request, timetable_pk=None):
+    user = await request_user(request)
+    session_pk = await request.session.aget('current_timetable_pk')
+    version = await schedule_cache.aget_user_version(user.pk)
+    etag = make_page_etag(
+        request, user.pk, version, 'time-table', timetable_pk, session_pk,
+        request.GET.get('all') == '1', timezone.localdate(),
+    )
+    return etag, version_last_modified(version)
+
+async def schedule_detail_conditions(request, pk):
+    user = await request_user(request)
+    last_pk = await request.session.aget('last_timetable_pk')
+    version = await schedule_cache.aget_user_version(user.pk)
+    etag = make_page_etag(request, user.pk, version, 'detail', pk, last_pk, request.GET.get('all') == '1')
+    return etag, version_last_modified(version)
+
+async def abuild_time_table_context(user, timetable_pk, session_pk, show_all, today):
+    """build_time_table_context の非同期版"""
+    user_timetables = await alist(Timetable.objects.filter(user=user).order_by('pk'))
+    current_timetable = pick_timetable(user_timetables, timetable_pk, session_pk)
+
+    context = time_table_context(user_timetables, current_timetable, show_all)
+    if current_timetable:
+        context.update(await abuild_time_table(user, current_timetable, show_all, today))
+    return context
+
+@login_required
+@cache_control(private=True, no_cache=True)
+@async_condition(time_table_conditions)
+async def time_table_view_async(request, timetable_pk=None):
+    """time_table_view の非同期版"""
+    user = await request_user(request)
+    show_all = request.GET.get('all') == '1'
+    today = timezone.localdate()
+    session_pk = await request.session.aget('current_timetable_pk')
+
+    context = await schedule_cache.aget_or_build(
+        'time-table', user.pk, (timetable_pk, session_pk, int(show_all), today.isoformat()),
+        lambda: abuild_time_table_context(user, timetable_pk, session_pk, show_all, today),
+    )
+
+    current_timetable = context['current_timetable']
+    if current_timetable:
+        await aremember_timetable(request.session, current_timetable.pk)
+
+    return render(request, 'schedule/time_table.html', context)
+
+@login_required
+@cache_control(private=True, no_cache=True)
+@async_condition(schedule_detail_conditions)
+async def schedule_detail_view_async(request, pk):
+    """schedule_detail_view の非同期版（コマ・ToDo・戻り先を同時に取得する）"""
+    user = await request_user(request)
+    show_all = request.GET.get('all') == '1'
+    schedules = Schedule.objects.select_related('course')
+
+    if request.method == 'POST':
+        schedule_obj = await aget_object_or_404(schedules, pk=pk, user=user)
+        task_form = TaskForm(request.POST)
+        if task_form.is_valid():
+            new_task = task_form.save(commit=False)
+            new_task.course = schedule_obj.course
+            await new_task.asave()
+            return redirect(f"{reverse('schedule:detail', kwargs={'pk': pk})}?all={'1' if show_all else '0'}")
+
+    # ToDo はコマの取得結果を待たずに、コマの主キーから直接絞り込む
+    tasks = Task.objects.filter(course__schedule__pk=pk, course__schedule__user=user).order_by('is_completed', 'due_date')
+    if not show_all:
+        tasks = tasks.filter(is_completed=False)
+    schedule_obj, tasks, back_url = await asyncio.gather(
+        aget_object_or_404(schedules, pk=pk, user=user), alist(tasks), aget_back_url(request),
+    )
+
+    return render(request, 'schedule/detail.html', {
+        'schedule': schedule_obj, 'course': schedule_obj.course,
+        'tasks': tasks, 'task_form': TaskForm(), 'show_all': show_all,
+        'back_url': back_url,
+    })
+
+@login_required
+async def grid_api_view_async(request, timetable_pk):
+    """grid_api_view の非同期版"""
+    user = await request_user(request)
+    show_all = request.GET.get('all') == '1'
+    today = timezone.localdate()
+
+    async def build():
+        timetable = await aget_object_or_404(Timetable, pk=timetable_pk, user=user)
+        return await aserialize_time_table(user, timetable, show_all, today)
+
+    payload = await schedule_cache.aget_or_build(
+        'grid-json', user.pk, (timetable_pk, int(show_all), today.isoformat()), build)
+    etag = quote_etag(payload['version'])
+
+    not_modified = get_conditional_response(request, etag=etag)
+    if not_modified is not None:
+        return not_modified
+
+    snapshot_parts = (user.pk, timetable_pk, int(show_all))
+    if await schedule_cache.aget_data('grid-snapshot', *snapshot_parts, payload['version']) is None:
+        await schedule_cache.aset_data(
+            'grid-snapshot', *snapshot_parts, payload['version'], value=grid_cell_hashes(payload))
+
+    since = request.GET.get('since')
+    previous = await schedule_cache.aget_data('grid-snapshot', *snapshot_parts, since) if since else None
+    return grid_json_response(payload, previous, since, etag)
+
 # --- ユーザー・アカウント管理 ---
 
 class SignUpView(CreateView):
@@ -289,20 +699,30 @@ class TimetableListView(LoginRequiredMixin, UserDataMixin, ListView):
     model = Timetable
     template_name = 'schedule/timetable_list.html'
     context_object_name = 'timetables'
+
+    def get_queryset(self):
+        # 曜日・時限は時間割の数に関係なく、それぞれ1クエリでまとめて取得する
+        return super().get_queryset().order_by('pk').prefetch_related(
+            Prefetch('day_set', queryset=Day.objects.order_by('order', 'pk'), to_attr='day_list'),
+            Prefetch('period_set', queryset=Period.objects.order_by('order', 'pk'), to_attr='period_list'),
+        )
+
     def get_context_data(self, **kwargs):
         context = super().get_context_data(**kwargs)
-        for tt in context['timetables']:
-            tt.day_list = Day.objects.filter(timetable=tt).order_by('order')
-            tt.period_list = Period.objects.filter(timetable=tt).order_by('order')
         context['back_url'] = get_back_url(self.request)
+        key = ical.feed_key(self.request.user.pk)
+        for timetable in context['timetables']:
+            timetable.calendar_feed_url = self.request.build_absolute_uri(
+                reverse('schedule:calendar_feed', kwargs={'token': ical.feed_token(timetable, key)}))
         return context
 
 class TimetableCreateView(LoginRequiredMixin, CreateView):
     model = Timetable
-    form_class = TimetableForm
+    form_class = TimetableCreateForm
     template_name = 'schedule/timetable_form.html'
     success_url = reverse_lazy('schedule:timetable_list')
 
+    @transaction.atomic
     def form_valid(self, form):
         # 1. ユーザーをセットして保存
         form.instance.user = self.request.user
@@ -320,43 +740,16 @@ class TimetableCreateView(LoginRequiredMixin, CreateView):
         latest_timetable = Timetable.objects.filter(user=self.request.user).exclude(pk=new_timetable.pk).order_by('-pk').first()
 
         if latest_timetable:
-            # 直前の時間割がある場合 -> その曜日と時限構成をコピーする
-            for day in latest_timetable.day_set.all():
-                Day.objects.create(timetable=new_timetable, name=day.name, order=day.order)
-            
-            for period in latest_timetable.period_set.all():
-                Period.objects.create(
-                    timetable=new_timetable, 
-                    name=period.name, 
-                    order=period.order,
-                    start_time=period.start_time,
-                    end_time=period.end_time,
-                )
-        
+            # 直前の時間割がある場合 -> その構成（選択に応じて授業も）を bulk_create でコピーする
+            copy_mode = form.cleaned_data.get('copy_mode') or TimetableCreateForm.COPY_STRUCTURE
+            copy_timetable(
+                latest_timetable, new_timetable,
+                deep=copy_mode != TimetableCreateForm.COPY_STRUCTURE,
+                copy_courses=copy_mode == TimetableCreateForm.COPY_COURSES,
+            )
         else:
             # 直前の時間割がない場合（初めての作成） -> デフォルトを作成
-            default_days = ['月', '火', '水', '木', '金', '土']
-            default_periods = ['1限', '2限', '3限', '4限', '5限']
-            
-            for i, name in enumerate(default_days):
-                Day.objects.create(timetable=new_timetable, name=name, order=i+1)
-            
-            default_periods = [
-                {'name': '1限', 'start': time(9, 20),  'end': time(11, 00)},
-                {'name': '2限', 'start': time(11, 10), 'end': time(12, 50)},
-                {'name': '3限', 'start': time(13, 40),  'end': time(15, 20)},
-                {'name': '4限', 'start': time(15, 30), 'end': time(17, 10)},
-                {'name': '5限', 'start': time(17, 20), 'end': time(19, 00)},
-            ]
-
-            for i, p_data in enumerate(default_periods):
-                Period.objects.create(
-                    timetable=new_timetable, 
-                    name=p_data['name'], 
-                    order=i+1,
-                    start_time=p_data['start'],
-                    end_time=p_data['end'],
-                )
+            create_default_structure(new_timetable)
         return response
 
 class TimetableUpdateView(LoginRequiredMixin, UserDataMixin, UpdateView):
@@ -436,33 +829,106 @@ class PeriodDeleteView(LoginRequiredMixin, UserDataMixin, DeleteView):
 
 # --- その他操作 (タスク切り替えなど) ---
 
+def owned_task_or_404(user, pk):
+    """ユーザーの授業のToDoを、戻り先のコマの主キー (schedule_pk) と一緒に1つのクエリで取得する
+
+    所有者の確認と戻り先の検索を、コマ (Schedule) との JOIN でまとめて行う。
+    """
+    tasks = Task.objects.filter(course__schedule__user=user).annotate(schedule_pk=Min('course__schedule__pk'))
+    return get_object_or_404(tasks, pk=pk)
+
 @login_required
 def task_toggle_complete(request, pk):
-    task = get_object_or_404(Task, pk=pk)
-    if not task.course.schedule_set.filter(user=request.user).exists(): raise PermissionDenied
-    task.is_completed = not task.is_completed
-    task.save()
-    return redirect('schedule:detail', pk=task.course.schedule_set.filter(user=request.user).first().pk)
+    task = owned_task_or_404(request.user, pk)
+    # 読み込んだ値ではなく、UPDATE の中で現在の値を反転する
+    toggle_tasks(Task.objects.filter(pk=task.pk))
+    tasks_changed(task.course_id)
+    return redirect('schedule:detail', pk=task.schedule_pk)
 
 @login_required
 def task_delete(request, pk):
-    task = get_object_or_404(Task, pk=pk)
-    sched_pk = task.course.schedule_set.filter(user=request.user).first().pk
+    task = owned_task_or_404(request.user, pk)
     task.delete()
-    return redirect('schedule:detail', pk=sched_pk)
+    return redirect('schedule:detail', pk=task.schedule_pk)
 
 @login_required
 def task_edit(request, pk):
-    task = get_object_or_404(Task, pk=pk)
-    if not task.course.schedule_set.filter(user=request.user).exists(): raise PermissionDenied
+    task = owned_task_or_404(request.user, pk)
     form = TaskForm(request.POST or None, instance=task)
     if request.method == 'POST' and form.is_valid():
         form.save()
-        return redirect('schedule:detail', pk=task.course.schedule_set.filter(user=request.user).first().pk)
+        return redirect('schedule:detail', pk=task.schedule_pk)
     return render(request, 'schedule/task_edit.html', {'form': form, 'task': task})
 
+# 一度にまとめて操作できるToDoの件数・期限をずらせる日数の上限
+MAX_BULK_TASKS = 1000
+MAX_SHIFT_DAYS = 365
+
+def clean_task_action(action, task_ids, days):
+    """ToDo の一括操作の入力を検証し、(action, ToDoのIDのリスト, 日数) を返す（不正なら ValueError）"""
+    if action not in TASK_ACTIONS:
+        raise ValueError(f"action には {' / '.join(TASK_ACTIONS)} のいずれかを指定してください")
+    if not isinstance(task_ids, list) or len(task_ids) > MAX_BULK_TASKS:
+        raise ValueError(f'task_ids には {MAX_BULK_TASKS} 件までのIDのリストを指定してください')
+    try:
+        task_ids = [int(task_id) for task_id in task_ids]
+        days = int(days or 0)
+    except (TypeError, ValueError):
+        raise ValueError('task_ids と days には整数を指定してください') from None
+    if action == 'shift' and not (0 < abs(days) <= MAX_SHIFT_DAYS):
+        raise ValueError(f'days には 1〜{MAX_SHIFT_DAYS} 日（前にずらす場合は負の数）を指定してください')
+    return action, task_ids, days
+
+@login_required
+@require_POST
+def task_batch_view(request):
+    """選択したToDoをまとめて完了・未完了の切り替え、期限の変更、または削除する（詳細画面のフォーム用）
+
+    task_ids に含まれていても、ログインユーザーの授業のものでなければ対象にしない。
+    """
+    try:
+        action, task_ids, days = clean_task_action(
+            request.POST.get('action'), request.POST.getlist('task_ids'), request.POST.get('days'))
+    except ValueError as e:
+        return HttpResponseBadRequest(str(e))
+    bulk_task_action(request.user, task_ids, action, days)
+
+    next_url = request.POST.get('next')
+    if not url_has_allowed_host_and_scheme(next_url, allowed_hosts={request.get_host()}):
+        next_url = reverse('schedule:time_table')
+    return redirect(next_url)
+
+@login_required
+@require_POST
+def task_bulk_api_view(request):
+    """ToDo の一括操作（JSON API）
+
+    本文は {"task_ids": [...], "action": "complete" | "uncomplete" | "toggle" | "shift" | "delete",
+    "days": 日数 (shift のみ)}。1回の UPDATE / DELETE で処理し、変更した授業の新しい集計値と
+    データのバージョンを返すので、画面側はグリッドを1回取り直すだけでよい。
+    """
+    try:
+        body = json.loads(request.body or b'{}')
+        if not isinstance(body, dict):
+            raise ValueError('本文はJSONのオブジェクトで指定してください')
+        action, task_ids, days = clean_task_action(body.get('action'), body.get('task_ids'), body.get('days'))
+    except ValueError as e:
+        # json.JSONDecodeError も ValueError のサブクラス
+        return JsonResponse({'error': str(e)}, status=400)
+
+    changed, course_ids = bulk_task_action(request.user, task_ids, action, days)
+    courses = Course.objects.filter(pk__in=course_ids).order_by('pk').values(
+        'id', 'task_total', 'task_completed', 'next_due_date')
+    return JsonResponse({
+        'action': action,
+        'changed': changed,
+        'courses': list(courses),
+        'version': str(schedule_cache.get_user_version(request.user.pk)),
+    })
+
 @login_required
 def switch_timetable_view(request, pk):
     timetable = get_object_or_404(Timetable, pk=pk, user=request.user)
-    request.session['current_timetable_pk'] = timetable.pk
+    if request.session.get('current_timetable_pk') != timetable.pk:
+        request.session['current_timetable_pk'] = timetable.pk
     return redirect('schedule:time_table')
\ No newline at end of file
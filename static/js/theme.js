@@ -0,0 +1,24 @@
+// ライト・ダークモードの切り替え（選んだテーマは localStorage に保存する）
+const btn = document.getElementById("theme-toggle");
+const themeText = document.getElementById("theme-text");
+const html = document.documentElement;
+const applyTheme = (theme) => {
+    if (theme === "dark") {
+        html.setAttribute("data-theme", "dark");
+        if(themeText) themeText.innerText = "☀️ライトモードに変更";
+    } else {
+        html.removeAttribute("data-theme");
+        if(themeText) themeText.innerText = "🌙ダークモードに変更";
+    }
+};
+const savedTheme = localStorage.getItem("theme");
+const systemDark = window.matchMedia("(prefers-color-scheme: dark)").matches;
+applyTheme(savedTheme || (systemDark ? "dark" : "light"));
+if(btn) {
+    btn.addEventListener("click", () => {
+        const isDark = html.getAttribute("data-theme") === "dark";
+        const newTheme = isDark ? "light" : "dark";
+        applyTheme(newTheme);
+        localStorage.setItem("theme", newTheme);
+    });
+}